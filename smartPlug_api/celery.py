@@ -1,6 +1,7 @@
 import os
 from celery import Celery
 from celery.schedules import schedule
+from django.conf import settings
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'smartPlug_api.settings')
 
@@ -12,13 +13,21 @@ app.autodiscover_tasks()
 app.conf.beat_schedule = {
     'sync-ecoflow-every-10-seconds': {
         'task': 'smartPlug_devices.tasks.sync_ecoflow_task',
-        'schedule': 10.0,
+        'schedule': float(settings.SMARTPLUG_POLL_SECONDS),
+    },
+    'sync-smart-plug-registry': {
+        'task': 'smartPlug_devices.tasks.sync_smart_plugs_task',
+        'schedule': settings.ECOFLOW_DEVICE_SYNC_INTERVAL,
     },
 
     'aggregate-data-every-minute': {
         'task': 'smartPlug_devices.tasks.aggregate_smart_plug_data_all_devices',
         'schedule': 300.0,  # every 5 minutes
     },
+    'rollup-aggregates': {
+        'task': 'smartPlug_devices.tasks.rollup_smart_plug_data_task',
+        'schedule': settings.SMARTPLUG_ROLLUP_INTERVAL,  # hourly/daily/monthly cascade
+    },
     'delete-old-aggregated-data-every-hour': {
         'task': 'smartPlug_devices.tasks.delete_old_aggregated_data',
         'schedule': 3600.0,  # every 1 hour
@@ -83,12 +83,69 @@ WSGI_APPLICATION = 'smartPlug_api.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/4.2/ref/settings/#databases
 
-DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+# DB_ENGINE=postgresql selects the PostgreSQL profile (connection from POSTGRES_*);
+# SMARTPLUG_TIMESCALEDB=True additionally turns the raw table into a TimescaleDB
+# hypertable.
+
+DB_ENGINE = os.getenv('DB_ENGINE', 'sqlite3')
+
+if DB_ENGINE == 'postgresql':
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME': os.getenv('POSTGRES_DB', 'ecoflow'),
+            'USER': os.getenv('POSTGRES_USER', 'postgres'),
+            'PASSWORD': os.getenv('POSTGRES_PASSWORD', ''),
+            'HOST': os.getenv('POSTGRES_HOST', 'localhost'),
+            'PORT': os.getenv('POSTGRES_PORT', '5432'),
+            'CONN_MAX_AGE': int(os.getenv('POSTGRES_CONN_MAX_AGE', '60')),
+        }
     }
+else:
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': BASE_DIR / 'db.sqlite3',
+        }
+    }
+
+# SQLite profile: pragmas applied to every new connection, and an optional
+# per-process writer thread that batches telemetry inserts. Each prefork Celery
+# child runs its own writer, so it only serialises writes within one process.
+SQLITE_TUNING = os.getenv('SQLITE_TUNING', 'True').lower() in ['true', '1']
+SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'busy_timeout': int(os.getenv('SQLITE_BUSY_TIMEOUT_MS', '30000')),
+    'mmap_size': int(os.getenv('SQLITE_MMAP_SIZE', str(256 * 1024 * 1024))),
+    'temp_store': 'MEMORY',
 }
+SQLITE_WRITER_QUEUE = os.getenv('SQLITE_WRITER_QUEUE', 'False').lower() in ['true', '1']
+SQLITE_WRITER_BATCH_SIZE = int(os.getenv('SQLITE_WRITER_BATCH_SIZE', '5000'))  # rows per transaction
+SQLITE_WRITER_FLUSH_SECONDS = float(os.getenv('SQLITE_WRITER_FLUSH_SECONDS', '2'))
+SQLITE_WRITER_RETRIES = int(os.getenv('SQLITE_WRITER_RETRIES', '3'))  # retries of a locked batch
+SQLITE_WRITER_RETRY_SECONDS = float(os.getenv('SQLITE_WRITER_RETRY_SECONDS', '1'))  # first backoff, doubled
+
+SMARTPLUG_TIMESCALEDB = os.getenv('SMARTPLUG_TIMESCALEDB', 'False').lower() in ['true', '1']
+
+
+# Cache
+# Shared Redis cache when CACHE_URL is set (needed to share the device list
+# across Celery workers), otherwise a per-process in-memory cache.
+
+if os.getenv('CACHE_URL'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.getenv('CACHE_URL'),
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    }
 
 
 # Password validation
@@ -139,15 +196,110 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 CELERY_BROKER_URL = 'redis://localhost:6379/0'  # use Redis
 CELERY_ACCEPT_CONTENT = ['json']
 CELERY_TASK_SERIALIZER = 'json'
+CELERY_RESULT_BACKEND = os.getenv('CELERY_RESULT_BACKEND')  # e.g. redis://localhost:6379/1; sharded aggregation reports totals through a chord when set
 
 
 # EcoFlow API Credentials
 ECOFLOW_ACCESS_KEY = os.getenv('ECOFLOW_ACCESS_KEY')
 ECOFLOW_SECRET_KEY = os.getenv('ECOFLOW_SECRET_KEY')
 ECOFLOW_BASE_URL = os.getenv('ECOFLOW_BASE_URL', 'https://api-e.ecoflow.com')
-
+ECOFLOW_REQUEST_TIMEOUT = float(os.getenv('ECOFLOW_REQUEST_TIMEOUT', '5'))  # seconds per request
+ECOFLOW_QUOTA_MAX_WORKERS = int(os.getenv('ECOFLOW_QUOTA_MAX_WORKERS', '32'))  # concurrent quota calls
+ECOFLOW_POOL_SIZE = int(os.getenv('ECOFLOW_POOL_SIZE', str(ECOFLOW_QUOTA_MAX_WORKERS)))  # keep-alive connections
+ECOFLOW_MAX_RETRIES = int(os.getenv('ECOFLOW_MAX_RETRIES', '2'))
+ECOFLOW_RETRY_BACKOFF = float(os.getenv('ECOFLOW_RETRY_BACKOFF', '0.3'))  # seconds, doubled per retry
+ECOFLOW_DEVICE_LIST_TTL = int(os.getenv('ECOFLOW_DEVICE_LIST_TTL', '600'))  # cached device list lifetime
+ECOFLOW_DEVICE_SYNC_INTERVAL = float(os.getenv('ECOFLOW_DEVICE_SYNC_INTERVAL', '300'))  # registry sync period
+ECOFLOW_SELECTIVE_QUOTA = os.getenv('ECOFLOW_SELECTIVE_QUOTA', 'False').lower() in ['true', '1']  # fetch only ecoflow.QUOTA_KEYS
+ECOFLOW_BREAKER_WINDOW_SECONDS = int(os.getenv('ECOFLOW_BREAKER_WINDOW_SECONDS', '60'))  # error-rate window
+ECOFLOW_BREAKER_MIN_CALLS = int(os.getenv('ECOFLOW_BREAKER_MIN_CALLS', '20'))  # calls in a window before it can trip
+ECOFLOW_BREAKER_ERROR_RATE = float(os.getenv('ECOFLOW_BREAKER_ERROR_RATE', '0.5'))  # failure share that opens the circuit
+ECOFLOW_BREAKER_COOLDOWN_SECONDS = int(os.getenv('ECOFLOW_BREAKER_COOLDOWN_SECONDS', '30'))  # open time before a probe
+
+# /api/device_list and /api/devices_data: 'cache' (live EcoFlow data behind the
+# response cache), 'live' (always upstream) or 'snapshot' (registry and latest
+# ingested SmartPlugData, no EcoFlow calls). Overridable per request with ?source=.
+ECOFLOW_VIEW_SOURCE = os.getenv('ECOFLOW_VIEW_SOURCE', 'cache')
+ECOFLOW_VIEW_CACHE_TTL = int(os.getenv('ECOFLOW_VIEW_CACHE_TTL', '15'))  # seconds a response is fresh
+ECOFLOW_VIEW_STALE_TTL = int(os.getenv('ECOFLOW_VIEW_STALE_TTL', '300'))  # served stale while refreshing
+ECOFLOW_VIEW_COALESCE_WAIT = int(os.getenv('ECOFLOW_VIEW_COALESCE_WAIT', '10'))  # wait on a concurrent fetch
+
+# Telemetry ingestion
+SMARTPLUG_RAW_STORAGE = os.getenv('SMARTPLUG_RAW_STORAGE', 'full')  # 'full' or 'compact' (numeric columns only)
+SMARTPLUG_COPY_INGEST = os.getenv('SMARTPLUG_COPY_INGEST', 'True').lower() in ['true', '1']  # COPY on PostgreSQL
+SMARTPLUG_BULK_BATCH_SIZE = int(os.getenv('SMARTPLUG_BULK_BATCH_SIZE', '500'))  # rows per INSERT
+SMARTPLUG_AGGREGATE_CHUNK_SIZE = int(os.getenv('SMARTPLUG_AGGREGATE_CHUNK_SIZE', '5000'))  # rows per cursor fetch
+SMARTPLUG_POLL_SECONDS = 10  # telemetry polling period (sync_ecoflow_task beat)
+
+# Adaptive polling: the beat still ticks every SMARTPLUG_POLL_SECONDS but each plug
+# has its own next-poll time (fast while its power changes, backing off while idle
+# or steady, rare probes while offline) within a global quota-call budget.
+SMARTPLUG_ADAPTIVE_POLLING = os.getenv('SMARTPLUG_ADAPTIVE_POLLING', 'False').lower() in ['true', '1']
+SMARTPLUG_POLL_BUDGET_PER_MINUTE = int(os.getenv('SMARTPLUG_POLL_BUDGET_PER_MINUTE', '3000'))  # quota calls
+SMARTPLUG_POLL_CHANGE_WATTS = float(os.getenv('SMARTPLUG_POLL_CHANGE_WATTS', '5'))  # "active" threshold
+SMARTPLUG_POLL_ACTIVE_MAX_SECONDS = int(os.getenv('SMARTPLUG_POLL_ACTIVE_MAX_SECONDS', '60'))
+SMARTPLUG_POLL_IDLE_MAX_SECONDS = int(os.getenv('SMARTPLUG_POLL_IDLE_MAX_SECONDS', '120'))  # keep below the 300s bin
+SMARTPLUG_POLL_OFFLINE_SECONDS = int(os.getenv('SMARTPLUG_POLL_OFFLINE_SECONDS', '600'))
+
+# Shared EcoFlow rate limit (all workers via CACHE_URL). Defaults follow the poll
+# budget: SMARTPLUG_POLL_BUDGET_PER_MINUTE / 60 calls per second, and a bucket that
+# holds one tick's worth of calls. Fixed-rate polling needs plugs / SMARTPLUG_POLL_SECONDS
+# per second (50/s for 500 plugs every 10 s); see the smartPlug_devices.W001 check.
+ECOFLOW_RATE_LIMIT_PER_SECOND = float(os.getenv('ECOFLOW_RATE_LIMIT_PER_SECOND', str(SMARTPLUG_POLL_BUDGET_PER_MINUTE / 60)))
+ECOFLOW_RATE_LIMIT_BURST = int(os.getenv('ECOFLOW_RATE_LIMIT_BURST', str(int(ECOFLOW_RATE_LIMIT_PER_SECOND * SMARTPLUG_POLL_SECONDS))))
+ECOFLOW_RATE_LIMIT_MAX_WAIT = float(os.getenv('ECOFLOW_RATE_LIMIT_MAX_WAIT', str(SMARTPLUG_POLL_SECONDS)))  # seconds a call may wait for a token
+
+# Sharded fan-out: sync and aggregation split the fleet by consistent hashing on SN
+# and run one Celery subtask per shard (1 = a single task for the whole fleet).
+SMARTPLUG_SHARDS = int(os.getenv('SMARTPLUG_SHARDS', '1'))
+SMARTPLUG_SHARD_LOCK_TTL = int(os.getenv('SMARTPLUG_SHARD_LOCK_TTL', '300'))  # seconds; frees shards of killed workers
+
+# MQTT ingestion (manage.py ingest_mqtt, needs the optional paho-mqtt package)
+SMARTPLUG_MQTT_FLUSH_SECONDS = float(os.getenv('SMARTPLUG_MQTT_FLUSH_SECONDS', '1'))  # micro-batch period
+SMARTPLUG_MQTT_MIN_SAMPLE_SECONDS = float(os.getenv('SMARTPLUG_MQTT_MIN_SAMPLE_SECONDS', '1'))  # per plug
+# Updates are pushed on change, so with MQTT ingestion on the aggregation holds each
+# sample until the next one (up to SMARTPLUG_MQTT_HOLD_SECONDS) instead of plain bin means.
+SMARTPLUG_MQTT_INGEST = os.getenv('SMARTPLUG_MQTT_INGEST', 'False').lower() in ['true', '1']
+SMARTPLUG_MQTT_HOLD_SECONDS = float(os.getenv('SMARTPLUG_MQTT_HOLD_SECONDS', '300'))
+
+# Deadband recording: only store a sample when a value moves beyond its threshold
+# or the switch state changes, plus a heartbeat after SMARTPLUG_DEADBAND_HEARTBEAT
+# seconds of silence. Aggregation forward-fills the gaps.
+SMARTPLUG_DEADBAND_ENABLED = os.getenv('SMARTPLUG_DEADBAND_ENABLED', 'False').lower() in ['true', '1']
+SMARTPLUG_DEADBAND_HEARTBEAT = int(os.getenv('SMARTPLUG_DEADBAND_HEARTBEAT', '300'))
+SMARTPLUG_DEADBAND_THRESHOLDS = {
+    'watts': float(os.getenv('SMARTPLUG_DEADBAND_WATTS', '1.0')),
+    'volt': float(os.getenv('SMARTPLUG_DEADBAND_VOLT', '2.0')),
+    'freq': float(os.getenv('SMARTPLUG_DEADBAND_FREQ', '0.2')),
+    'current': float(os.getenv('SMARTPLUG_DEADBAND_CURRENT', '10')),
+}
+SMARTPLUG_AGGREGATE_GRACE_SECONDS = int(os.getenv('SMARTPLUG_AGGREGATE_GRACE_SECONDS', '60'))  # wait for late samples before closing a bin
+
+# Hourly, daily and monthly rollups cascade from the 5-minute aggregates. Day and
+# month boundaries follow SMARTPLUG_ROLLUP_TIME_ZONE rather than UTC.
+SMARTPLUG_ROLLUP_TIME_ZONE = os.getenv('SMARTPLUG_ROLLUP_TIME_ZONE', 'Africa/Nairobi')
+SMARTPLUG_ROLLUP_INTERVAL = float(os.getenv('SMARTPLUG_ROLLUP_INTERVAL', '900'))  # rollup task period
+
+# Raw data retention. On PostgreSQL the raw table is range-partitioned on
+# fetched_at and expired partitions are dropped; SQLite deletes rows in batches.
+# Whole partitions are dropped, so on PostgreSQL raw rows are kept for up to
+# SMARTPLUG_RAW_RETENTION_HOURS + SMARTPLUG_PARTITION_HOURS (26h by default).
+SMARTPLUG_RAW_RETENTION_HOURS = int(os.getenv('SMARTPLUG_RAW_RETENTION_HOURS', '2'))
+SMARTPLUG_PARTITION_HOURS = int(os.getenv('SMARTPLUG_PARTITION_HOURS', '24'))  # width of one partition
+SMARTPLUG_PARTITION_AHEAD_HOURS = int(os.getenv('SMARTPLUG_PARTITION_AHEAD_HOURS', '48'))  # pre-created ahead of now
+SMARTPLUG_RETENTION_BATCH_SIZE = int(os.getenv('SMARTPLUG_RETENTION_BATCH_SIZE', '5000'))  # rows per DELETE
+
+
+# Read API (aggregate/raw history endpoints)
+SMARTPLUG_API_PAGE_SIZE = int(os.getenv('SMARTPLUG_API_PAGE_SIZE', '500'))  # rows per cursor page
+SMARTPLUG_API_MAX_PAGE_SIZE = int(os.getenv('SMARTPLUG_API_MAX_PAGE_SIZE', '5000'))
+SMARTPLUG_API_MAX_POINTS = int(os.getenv('SMARTPLUG_API_MAX_POINTS', '5000'))  # downsampling ceiling
+# Streaming exports (/api/export/, export_telemetry); Parquet needs the optional pyarrow package
+SMARTPLUG_EXPORT_CHUNK_SIZE = int(os.getenv('SMARTPLUG_EXPORT_CHUNK_SIZE', '10000'))  # rows per CSV/Parquet chunk
 
 # Prospect API
 
 PROSPECT_API_URL = os.getenv("PROSPECT_API_URL")
 PROSPECT_API_TOKEN = os.getenv("PROSPECT_API_TOKEN")
+PROSPECT_REQUEST_TIMEOUT = float(os.getenv("PROSPECT_REQUEST_TIMEOUT", "60"))
+PROSPECT_PUSH_BATCH_SIZE = int(os.getenv("PROSPECT_PUSH_BATCH_SIZE", "1000"))  # aggregates per POST
@@ -1,7 +1,38 @@
 from django.contrib import admin
+from django.core.paginator import Paginator
+from django.db import connection
+from django.db.models import F
+from django.db.models.functions import NullIf, Round
+from django.utils.functional import cached_property
 from import_export.admin import ImportExportModelAdmin
 from .models import SmartPlug, SmartPlugData, SmartPlugDataAggregate
 
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Paginator for the telemetry tables. Unfiltered changelists on PostgreSQL use
+    the planner's row estimate (summed over partitions/chunks) instead of a full
+    COUNT(*); filtered lists and other databases count exactly.
+    """
+
+    @cached_property
+    def count(self):
+        query = getattr(self.object_list, 'query', None)
+        if connection.vendor == 'postgresql' and query is not None and not query.where:
+            table = connection.ops.quote_name(self.object_list.model._meta.db_table)
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    "SELECT sum(reltuples)::bigint FROM pg_class WHERE oid = to_regclass(%s) "
+                    "OR oid IN (SELECT inhrelid FROM pg_inherits WHERE inhparent = to_regclass(%s))",
+                    [table, table],
+                )
+                estimate = cursor.fetchone()[0]
+            # Never analyzed tables report -1/0
+            if estimate and estimate > 0:
+                return estimate
+        return super().count
+
+
 @admin.register(SmartPlug)
 class SmartPlugDeviceAdmin(ImportExportModelAdmin):
     list_display = ('name', 'sn', 'online','productName', 'last_updated')
@@ -10,15 +41,48 @@ class SmartPlugDeviceAdmin(ImportExportModelAdmin):
     ordering = ('name',)
 
 @admin.register(SmartPlugData)
-class DeviceQuotaAdmin(ImportExportModelAdmin):
+class SmartPlugDataAdmin(ImportExportModelAdmin):
     list_display = (
-        'device','id','serial_number',  'eatTime', 'country', 'town', 'switchStatus', 'volt','current_calculated', 'current', 'watts', 
-        'freq','updateTime','fetched_at','utcTime','timeZone','is_aggregated',
+        'device','id','serial_number',  'eatTime', 'sample_country', 'sample_town', 'switchStatus', 'volt','calculated_current', 'current', 'watts',
+        'freq','updateTime','fetched_at','utcTime','sample_time_zone','is_aggregated',
     )
+    list_select_related = ('device', 'location')
     search_fields = ('device__name', 'device__sn')
     readonly_fields = ('fetched_at',)
-    ordering = ('-fetched_at',)
-    list_filter = ('fetched_at',)
+    ordering = ('-id',)  # primary key; fetched_at is not indexed
+    list_filter = ('is_aggregated',)
+    date_hierarchy = 'eatTime'
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+    def get_queryset(self, request):
+        # watts / volt in SQL instead of the per-row Decimal property
+        return super().get_queryset(request).annotate(
+            calculated_current_a=Round(F('watts') / NullIf(F('volt'), 0.0), 2)
+        )
+
+    @admin.display(description='Current calculated', ordering='calculated_current_a')
+    def calculated_current(self, obj):
+        return obj.calculated_current_a
+
+    # Compact rows keep country/town/time zone on the interned location
+    def _location_value(self, obj, field):
+        value = getattr(obj, field)
+        if not value and obj.location is not None:
+            value = getattr(obj.location, field)
+        return value or None
+
+    @admin.display(description='Country')
+    def sample_country(self, obj):
+        return self._location_value(obj, 'country')
+
+    @admin.display(description='Town')
+    def sample_town(self, obj):
+        return self._location_value(obj, 'town')
+
+    @admin.display(description='Time zone')
+    def sample_time_zone(self, obj):
+        return self._location_value(obj, 'timeZone')
 
 @admin.action(description='❌ Delete ALL SmartPlugData records')
 def delete_all_smartplug_data(modeladmin, request, queryset):
@@ -26,14 +90,16 @@ def delete_all_smartplug_data(modeladmin, request, queryset):
 
 
 @admin.register(SmartPlugDataAggregate)
-class DeviceQuotaAdmin(ImportExportModelAdmin):
+class SmartPlugDataAggregateAdmin(ImportExportModelAdmin):
     list_display = (
-        'device',  'manufacturer', 'serial_number', 'country', 'town', 'switchStatus', 'metered_at', 'interval_seconds', 'phase', 'voltage_v', 'current_a', 
+        'device',  'manufacturer', 'serial_number', 'country', 'town', 'switchStatus', 'metered_at', 'interval_seconds', 'phase', 'voltage_v', 'current_a',
         'frequency_hz','power_w','power_factor','energy_interval_wh','energy_lifetime_wh','billing_cycle_start_at','is_pushed'
     )
+    list_select_related = ('device',)
     search_fields = ('device__name', 'device__sn')
     readonly_fields = ('metered_at',)
-    ordering = ('-metered_at',)
-    list_filter = ('metered_at',)
-
-
+    ordering = ('-id',)
+    list_filter = ('interval_seconds', 'is_pushed')
+    date_hierarchy = 'metered_at'
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
@@ -4,3 +4,10 @@ from django.apps import AppConfig
 class SmartplugDevicesConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'smartPlug_devices'
+
+    def ready(self):
+        from django.db.backends.signals import connection_created
+        from smartPlug_devices import ratelimit  # noqa: F401  registers the poll budget check
+        from smartPlug_devices.sqlite import configure_sqlite
+
+        connection_created.connect(configure_sqlite)
@@ -0,0 +1,62 @@
+"""
+Response cache for the live EcoFlow views.
+
+Entries are fresh for ECOFLOW_VIEW_CACHE_TTL seconds and then served stale for
+up to ECOFLOW_VIEW_STALE_TTL more while one background refresh runs. A miss
+takes a cache lock (cache.add, atomic on Redis and locmem) so concurrent
+requests wait for the single upstream fetch instead of repeating it.
+"""
+import threading
+import time
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection
+
+LOCK_SUFFIX = ":lock"
+POLL_SECONDS = 0.1
+
+
+def _refresh(key, producer, ttl, stale_ttl):
+    try:
+        data = producer()
+        cache.set(key, {"data": data, "cached_at": time.time()}, ttl + stale_ttl)
+        return data
+    finally:
+        cache.delete(key + LOCK_SUFFIX)
+
+
+def _refresh_in_background(key, producer, ttl, stale_ttl):
+    try:
+        _refresh(key, producer, ttl, stale_ttl)
+    except Exception as e:
+        print(f"❌ Background refresh of {key} failed, serving stale data: {e}")
+    finally:
+        connection.close()
+
+
+def cached(key, producer, ttl=None, stale_ttl=None, wait=None):
+    """Return producer()'s result through the cache at `key` (see module docstring)."""
+    ttl = settings.ECOFLOW_VIEW_CACHE_TTL if ttl is None else ttl
+    stale_ttl = settings.ECOFLOW_VIEW_STALE_TTL if stale_ttl is None else stale_ttl
+    wait = settings.ECOFLOW_VIEW_COALESCE_WAIT if wait is None else wait
+    lock_key = key + LOCK_SUFFIX
+
+    entry = cache.get(key)
+    if entry is not None:
+        if time.time() - entry["cached_at"] >= ttl and cache.add(lock_key, 1, wait):
+            threading.Thread(
+                target=_refresh_in_background, args=(key, producer, ttl, stale_ttl), daemon=True
+            ).start()
+        return entry["data"]
+
+    if cache.add(lock_key, 1, wait):
+        return _refresh(key, producer, ttl, stale_ttl)
+
+    # Another request is already fetching: wait for its result
+    deadline = time.monotonic() + wait
+    while time.monotonic() < deadline:
+        time.sleep(POLL_SECONDS)
+        entry = cache.get(key)
+        if entry is not None:
+            return entry["data"]
+    return producer()
@@ -0,0 +1,60 @@
+"""
+Server-side downsampling of time series for the read API.
+
+lttb() keeps the points that preserve the visual shape of one series
+(Largest-Triangle-Three-Buckets); bucket_mean() averages every column into
+equal-width time buckets.
+"""
+import numpy as np
+import pandas as pd
+
+
+def lttb(x, y, threshold):
+    """Return the indices of the `threshold` points LTTB keeps from the (x, y) series."""
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    length = len(x)
+    if threshold >= length or threshold < 3:
+        return np.arange(length)
+
+    # First and last points are always kept; the rest is split into threshold - 2 buckets
+    edges = np.linspace(1, length - 1, threshold - 1).astype(int)
+    selected = np.empty(threshold, dtype=int)
+    selected[0] = 0
+    selected[-1] = length - 1
+    previous = 0
+    for bucket in range(threshold - 2):
+        start, end = edges[bucket], edges[bucket + 1]
+        # Average of the next bucket is the third corner of the triangle
+        next_start, next_end = edges[bucket + 1], edges[bucket + 2] if bucket + 2 < len(edges) else length
+        next_x = x[next_start:next_end].mean()
+        next_y = y[next_start:next_end].mean()
+        areas = np.abs(
+            (x[previous] - next_x) * (y[start:end] - y[previous])
+            - (x[previous] - x[start:end]) * (next_y - y[previous])
+        )
+        previous = start + int(areas.argmax())
+        selected[bucket + 1] = previous
+    return selected
+
+
+def bucket_mean(df, time_column, points, start=None, end=None):
+    """
+    Average `df` into `points` equal-width buckets over [start, end] (the data's
+    own bounds by default). Numeric columns are averaged, others keep their last
+    value, and each bucket is stamped with its start time. Empty buckets are dropped.
+    """
+    if df.empty or points < 1:
+        return df
+    times = pd.to_datetime(df[time_column], utc=True)
+    start = pd.Timestamp(start) if start is not None else times.min()
+    end = pd.Timestamp(end) if end is not None else times.max()
+    width = max((end - start) / points, pd.Timedelta(microseconds=1))
+
+    bucket = ((times - start) // width).clip(0, points - 1)
+    values = df.drop(columns=time_column)
+    numeric = values.select_dtypes('number').columns
+    reducers = {name: ('mean' if name in numeric else 'last') for name in values.columns}
+    result = values.groupby(bucket.to_numpy()).agg(reducers)
+    result.insert(0, time_column, (start + width * result.index.astype(int)).to_pydatetime())
+    return result.reset_index(drop=True)
@@ -1,8 +1,17 @@
+import io
+import json
 import time
 import hmac
 import hashlib
+import threading
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from django.conf import settings
+from django.core.cache import cache
+from django.db import connection, models, transaction
+from django.db.models import Max, OuterRef, Q, Subquery
+from django.db.models.functions import Coalesce
 import secrets
 from datetime import datetime, timezone, timedelta
 import pandas as pd
@@ -10,25 +19,69 @@ from django.utils.timezone import now
 from django.utils.timezone import make_aware, is_naive
 from datetime import datetime, timezone, timedelta
 import pytz
-from smartPlug_devices.models import SmartPlug, SmartPlugData, SmartPlugDataAggregate 
+from concurrent.futures import ThreadPoolExecutor
+from smartPlug_devices.ratelimit import RateLimitTimeout, get_breaker, get_limiter, tick_capacity
+from smartPlug_devices.sqlite import get_writer, use_writer_queue
+from smartPlug_devices.models import (
+    SmartPlug, SmartPlugData, SmartPlugDataAggregate, SmartPlugAggregationWatermark, SmartPlugLocation,
+)
 
 
 # --- EcoFlow API Credentials ---
 ACCESS_KEY = settings.ECOFLOW_ACCESS_KEY
 SECRET_KEY = settings.ECOFLOW_SECRET_KEY
 BASE_URL = settings.ECOFLOW_BASE_URL
+REQUEST_TIMEOUT = settings.ECOFLOW_REQUEST_TIMEOUT
+QUOTA_MAX_WORKERS = settings.ECOFLOW_QUOTA_MAX_WORKERS
+DEVICE_LIST_CACHE_KEY = "ecoflow:device_list"
+
+# SmartPlugData field -> smart plug quota key. The single list of keys that is
+# fetched (selective quota), extracted and stored.
+QUOTA_FIELDS = {
+    'utcTime': "2_1.utcTime",
+    'updateTime': "2_1.updateTime",
+    'timeZone': "2_1.timeZone",
+    'country': "2_1.country",
+    'town': "2_1.town",
+    'switchStatus': "2_1.switchSta",
+    'freq': "2_1.freq",
+    'volt': "2_1.volt",
+    'current': "2_1.current",
+    'watts': "2_1.watts",
+}
+QUOTA_KEYS = list(QUOTA_FIELDS.values())
+
+
+def flatten_params(params, prefix=""):
+    """Flatten a nested request body the way EcoFlow signs it: {"a": {"b": [1]}} -> {"a.b[0]": 1}."""
+    flat = {}
+    for key, value in params.items():
+        name = f"{prefix}.{key}" if prefix else key
+        if isinstance(value, dict):
+            flat.update(flatten_params(value, name))
+        elif isinstance(value, (list, tuple)):
+            for index, item in enumerate(value):
+                if isinstance(item, dict):
+                    flat.update(flatten_params(item, f"{name}[{index}]"))
+                else:
+                    flat[f"{name}[{index}]"] = item
+        else:
+            flat[name] = value
+    return flat
 
 
-def generate_signature(params: dict, timestamp: int, nonce: str) -> str:
-    sorted_params = sorted(params.items(), key=lambda x: x[0])
+def generate_signature(params: dict, timestamp: int, nonce: str, access_key=None, secret_key=None) -> str:
+    access_key = access_key or ACCESS_KEY
+    secret_key = secret_key or SECRET_KEY
+    sorted_params = sorted(flatten_params(params).items(), key=lambda x: x[0])
     if sorted_params:
         param_str = '&'.join(f"{k}={v}" for k, v in sorted_params)
-        param_str += f"&accessKey={ACCESS_KEY}&nonce={nonce}&timestamp={timestamp}"
+        param_str += f"&accessKey={access_key}&nonce={nonce}&timestamp={timestamp}"
     else:
-        param_str = f"accessKey={ACCESS_KEY}&nonce={nonce}&timestamp={timestamp}"
+        param_str = f"accessKey={access_key}&nonce={nonce}&timestamp={timestamp}"
 
     sign = hmac.new(
-        SECRET_KEY.encode('utf-8'),
+        secret_key.encode('utf-8'),
         param_str.encode('utf-8'),
         hashlib.sha256
     ).hexdigest()
@@ -36,30 +89,141 @@ def generate_signature(params: dict, timestamp: int, nonce: str) -> str:
     return sign
 
 
-def get_all_devices():
-    path = "/iot-open/sign/device/list"
-    timestamp = int(time.time() * 1000)
-    nonce = str(secrets.randbelow(1000000)).zfill(6)
-    sign = generate_signature({}, timestamp, nonce)
+SELECTIVE_QUOTA_PATH = "/iot-open/sign/device/quota"
+
+
+class _ExactURLAdapter(HTTPAdapter):
+    """
+    Adapter for exactly one URL. requests mounts adapters by prefix, so anything
+    else under the same prefix (/quota/all, /quota-set, ...) is sent through
+    `fallback` instead of inheriting this adapter's retry policy.
+    """
+
+    def __init__(self, url, fallback, **kwargs):
+        super().__init__(**kwargs)
+        self.url = url
+        self.fallback = fallback
+
+    def send(self, request, **kwargs):
+        if request.url.split("?", 1)[0] != self.url:
+            return self.fallback.send(request, **kwargs)
+        return super().send(request, **kwargs)
+
+
+class EcoFlowClient:
+    """
+    Signed EcoFlow API client backed by one pooled, keep-alive requests.Session.
+    GET requests are retried with exponential backoff on connection errors and
+    429/5xx. POSTs are only retried on the read-only selective quota endpoint,
+    which gets its own adapter; the session is also used for the Prospect push,
+    whose POSTs must not be repeated. Each signed call is throttled by the shared
+    token bucket and short-circuited while the circuit breaker is open (see
+    ratelimit.py).
+    """
+
+    def __init__(self, access_key=None, secret_key=None, base_url=None, timeout=None,
+                 pool_size=None, max_retries=None, backoff_factor=None):
+        self.access_key = access_key or ACCESS_KEY
+        self.secret_key = secret_key or SECRET_KEY
+        self.base_url = base_url or BASE_URL
+        self.timeout = timeout or REQUEST_TIMEOUT
+
+        pool_size = pool_size or settings.ECOFLOW_POOL_SIZE
+        retry = Retry(
+            total=settings.ECOFLOW_MAX_RETRIES if max_retries is None else max_retries,
+            backoff_factor=settings.ECOFLOW_RETRY_BACKOFF if backoff_factor is None else backoff_factor,
+            status_forcelist=(429, 500, 502, 503, 504),
+            allowed_methods=frozenset(["GET"]),
+        )
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+        quota_url = self.base_url + SELECTIVE_QUOTA_PATH
+        quota_adapter = _ExactURLAdapter(
+            quota_url, adapter, pool_connections=pool_size, pool_maxsize=pool_size,
+            max_retries=retry.new(allowed_methods=frozenset(["GET", "POST"])),
+        )
+        self.session = requests.Session()
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        # Longest prefix wins; the adapter hands other URLs under it back to `adapter`
+        self.session.mount(quota_url, quota_adapter)
+
+    def signed_headers(self, params: dict) -> dict:
+        timestamp = int(time.time() * 1000)
+        nonce = str(secrets.randbelow(1000000)).zfill(6)
+        sign = generate_signature(params, timestamp, nonce, self.access_key, self.secret_key)
+        return {
+            "accessKey": self.access_key,
+            "timestamp": str(timestamp),
+            "nonce": nonce,
+            "sign": sign,
+        }
 
-    url = BASE_URL + path
-    headers = {
-        "accessKey": ACCESS_KEY,
-        "timestamp": str(timestamp),
-        "nonce": nonce,
-        "sign": sign,
-    }
+    def _request(self, method, path, **kwargs) -> dict:
+        # Every signed call takes a token from the shared bucket and goes through the breaker
+        breaker = get_breaker()
+        breaker.before_call()
+        get_limiter().acquire()
+        try:
+            response = self.session.request(method, self.base_url + path, timeout=self.timeout, **kwargs)
+        except requests.RequestException:
+            breaker.record_failure()
+            raise
+        if response.status_code == 429 or response.status_code >= 500:
+            breaker.record_failure()
+        else:
+            breaker.record_success()
+        response.raise_for_status()
+        return response.json()
+
+    def get(self, path, params=None) -> dict:
+        params = params or {}
+        return self._request("GET", path, params=params, headers=self.signed_headers(params))
+
+    def post(self, path, body=None) -> dict:
+        body = body or {}
+        return self._request(
+            "POST", path, json=body,
+            headers={**self.signed_headers(body), "Content-Type": "application/json;charset=UTF-8"},
+        )
 
-    response = requests.get(url, headers=headers)
-    response.raise_for_status()
+    def close(self):
+        self.session.close()
 
-    data = response.json()
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_client() -> EcoFlowClient:
+    """Return the process-wide EcoFlowClient, creating it on first use."""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = EcoFlowClient()
+    return _client
+
+
+def get_all_devices():
+    data = get_client().get("/iot-open/sign/device/list")
     if data.get("code") != "0":
         raise Exception(f"API Error: {data.get('message')} (Code: {data.get('code')})")
-    return data.get("data", [])
+    devices = data.get("data", [])
+    cache.set(DEVICE_LIST_CACHE_KEY, devices, settings.ECOFLOW_DEVICE_LIST_TTL)
+    return devices
 
-def get_device_list():
-    devices = get_all_devices()
+
+def get_cached_devices(force_refresh=False):
+    """Return the EcoFlow device list from cache, fetching it on a miss or when forced."""
+    devices = None if force_refresh else cache.get(DEVICE_LIST_CACHE_KEY)
+    if devices is None:
+        devices = get_all_devices()
+    return devices
+
+
+def get_device_list(devices=None):
+    if devices is None:
+        devices = get_all_devices()
     results = []
 
     if not devices:
@@ -77,56 +241,121 @@ def get_device_list():
     return results
 
 
-def get_ecoflow_devices_all():
-    devices = get_all_devices()
+def get_device_quota(sn):
+    """
+    Quota document for one plug: only QUOTA_KEYS through the selective quota
+    endpoint when ECOFLOW_SELECTIVE_QUOTA is on, otherwise the full quota/all.
+    """
+    if settings.ECOFLOW_SELECTIVE_QUOTA:
+        return get_client().post(SELECTIVE_QUOTA_PATH, {"sn": sn, "params": {"quotas": QUOTA_KEYS}})
+    return get_client().get("/iot-open/sign/device/quota/all", {"sn": sn})
+
+
+def _fetch_device_quota(device_data):
+    sn = device_data["sn"]
+    try:
+        data = get_device_quota(sn)
+        if data.get("code") == "0":
+            device_data["quota"] = data.get("data", {})
+        else:
+            device_data["quota_error"] = f"API Error: {data.get('message')} (Code: {data.get('code')})"
+    except RateLimitTimeout as e:
+        # Our own limiter ran dry: nothing is known about the plug, so it is polled next tick
+        device_data["quota_error"] = str(e)
+        device_data["quota_deferred"] = True
+    except Exception as e:
+        device_data["quota_error"] = str(e)
+    return device_data
+
+
+def get_ecoflow_devices_all(max_workers=None, devices=None):
+    if devices is None:
+        devices = get_all_devices()
     results = []
 
     if not devices:
         return []
 
     for device in devices:
-        sn = device.get("sn")
-        device_data = {
+        results.append({
             "name": device.get("deviceName") or "Unnamed Device",
-            "sn": sn,
+            "sn": device.get("sn"),
             "model": device.get("model", "Unknown"),
             "status": device.get("status", "Unknown"),
             "full_info": device,
             "quota": {},
             "quota_error": None
-        }
-
-        if sn:
-            try:
-                path = "/iot-open/sign/device/quota/all"
-                query_params = {"sn": sn}
-                timestamp = int(time.time() * 1000)
-                nonce = str(secrets.randbelow(1000000)).zfill(6)
-                sign = generate_signature(query_params, timestamp, nonce)
-                url = f"{BASE_URL}{path}?sn={sn}"
-                headers = {
-                    "accessKey": ACCESS_KEY,
-                    "timestamp": str(timestamp),
-                    "nonce": nonce,
-                    "sign": sign,
-                }
-
-                response = requests.get(url, headers=headers)
-                response.raise_for_status()
-                data = response.json()
-
-                if data.get("code") == "0":
-                    device_data["quota"] = data.get("data", {})
-                else:
-                    device_data["quota_error"] = f"API Error: {data.get('message')} (Code: {data.get('code')})"
+        })
 
-            except Exception as e:
-                device_data["quota_error"] = str(e)
+    # Fan the quota calls out over a bounded pool; each worker fills in its own
+    # dict so the result order matches the device list.
+    pending = [device_data for device_data in results if device_data["sn"]]
+    workers = min(max_workers or QUOTA_MAX_WORKERS, len(pending)) or 1
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        list(executor.map(_fetch_device_quota, pending))
 
-        results.append(device_data)
+    return results
 
+def _snapshot_quota(sample):
+    """Quota document of a stored sample; compact rows are rebuilt from their typed columns."""
+    if sample.quota_data:
+        return sample.quota_data
+    location = sample.location
+    quota = {
+        QUOTA_FIELDS['utcTime']: int(sample.eatTime.timestamp()) if sample.eatTime else None,
+        QUOTA_FIELDS['timeZone']: location.timeZone if location else sample.timeZone,
+        QUOTA_FIELDS['country']: location.country if location else sample.country,
+        QUOTA_FIELDS['town']: location.town if location else sample.town,
+        QUOTA_FIELDS['watts']: sample.watts * 10 if sample.watts is not None else None,
+    }
+    for field in ('switchStatus', 'freq', 'volt', 'current'):
+        quota[QUOTA_FIELDS[field]] = getattr(sample, field)
+    return quota
+
+
+def get_device_list_snapshot():
+    """get_device_list() shaped view of the synced SmartPlug registry, without calling EcoFlow."""
+    return [
+        {
+            "name": plug.name,
+            "sn": plug.sn,
+            "model": plug.model,
+            "status": plug.status,
+            "full_info": plug.full_info or {},
+        }
+        for plug in SmartPlug.objects.order_by('sn')
+    ]
+
+
+def get_ecoflow_devices_snapshot():
+    """
+    get_ecoflow_devices_all() shaped view built from the registry and each plug's
+    most recently ingested SmartPlugData row, without calling EcoFlow.
+    """
+    plugs = list(SmartPlug.objects.annotate(
+        latest_id=Subquery(
+            SmartPlugData.objects.filter(device=OuterRef('pk')).order_by('-id').values('id')[:1]
+        )
+    ).order_by('sn'))
+    samples = SmartPlugData.objects.select_related('location').in_bulk(
+        [plug.latest_id for plug in plugs if plug.latest_id]
+    )
+    results = []
+    for plug in plugs:
+        sample = samples.get(plug.latest_id)
+        results.append({
+            "name": plug.name,
+            "sn": plug.sn,
+            "model": plug.model,
+            "status": plug.status,
+            "full_info": plug.full_info or {},
+            "quota": _snapshot_quota(sample) if sample else {},
+            "quota_error": None if sample else "No ingested sample",
+            "snapshot_at": sample.fetched_at if sample else None,
+        })
     return results
 
+
 def extract_selected_full_info_fields(full_info: dict) -> dict:
     return {
         'online': full_info.get("online"),
@@ -135,161 +364,507 @@ def extract_selected_full_info_fields(full_info: dict) -> dict:
     }
 
 def extract_selected_quota_fields(quota: dict) -> dict:
-    return {
-        'utcTime': quota.get("2_1.utcTime"),
-        'updateTime': quota.get("2_1.updateTime"),
-        'timeZone': quota.get("2_1.timeZone"),
-        'country': quota.get("2_1.country"),
-        'town': quota.get("2_1.town"),
-        'switchStatus': quota.get("2_1.switchSta"),
-        'freq': quota.get("2_1.freq"),
-        'volt': quota.get("2_1.volt"),
-        'current': quota.get("2_1.current"),
-        'watts': quota.get("2_1.watts"),
-    }
+    return {field: quota.get(key) for field, key in QUOTA_FIELDS.items()}
 
 
-# def sync_smart_plugs():
-#     device_list = get_device_list()
+SMART_PLUG_SYNC_FIELDS = ["name", "model", "status", "online", "productName", "full_info"]
 
-#     for device in device_list:
-#         SmartPlug.objects.update_or_create(
-#             sn=device["sn"],
-#             defaults={
-#                 "name": device["name"],
-#                 "model": device["model"],
-#                 "status": device["status"],
-#                 "full_info": device["full_info"],
-#             }
-#         )
 
+def sync_smart_plugs(device_list=None):
+    """
+    Upsert the device registry in one statement, skipping plugs whose fields are
+    unchanged so idle cycles write nothing. Returns the number of rows written.
+    """
+    if device_list is None:
+        device_list = get_device_list()
 
-def sync_smart_plugs():
-    device_list = get_device_list()
+    existing = {
+        row["sn"]: row
+        for row in SmartPlug.objects.values("sn", *SMART_PLUG_SYNC_FIELDS)
+    }
 
+    changed = []
     for device in device_list:
+        if not device["sn"]:
+            continue
         full_info = device.get("full_info", {})
-
-        SmartPlug.objects.update_or_create(
-            sn=device["sn"],
-            defaults={
-                "name": device["name"],
-                "model": device["model"],
-                "status": device["status"],
-                "online": full_info.get("online"),
-                "productName": full_info.get("productName"),
-                "full_info": full_info,
-            }
+        values = {
+            "name": device["name"],
+            "model": device["model"],
+            "status": device["status"],
+            "online": full_info.get("online"),
+            "productName": full_info.get("productName"),
+            "full_info": full_info,
+        }
+        current = existing.get(device["sn"])
+        if current and all(current[field] == values[field] for field in SMART_PLUG_SYNC_FIELDS):
+            continue
+        changed.append(SmartPlug(sn=device["sn"], **values))
+
+    if changed:
+        SmartPlug.objects.bulk_create(
+            changed,
+            update_conflicts=True,
+            unique_fields=["sn"],
+            update_fields=SMART_PLUG_SYNC_FIELDS + ["last_updated"],
         )
+    return len(changed)
 
 
-
-def sync_smart_plug_data():
-    devices = get_ecoflow_devices_all()
-
+def parse_eat_time(raw_utc_time):
+    """Convert EcoFlow's epoch-seconds utcTime into an aware EAT (UTC+3) datetime."""
+    if not raw_utc_time:
+        return None
+    try:
+        utc_dt = datetime.fromtimestamp(int(raw_utc_time), tz=timezone.utc)
+        return utc_dt.astimezone(timezone(timedelta(hours=3)))
+    except (TypeError, ValueError, OverflowError, OSError):
+        return None
+
+
+_location_ids = {}
+
+
+def get_location_id(country, town, time_zone):
+    """
+    Return the SmartPlugLocation id for a country/town/time zone, cached per process.
+    An id is only cached once its transaction commits, so a rollback cannot leave
+    the cache pointing at a location row that no longer exists.
+    """
+    key = (country or '', town or '', time_zone or '')
+    if key in _location_ids:
+        return _location_ids[key]
+    location, _ = SmartPlugLocation.objects.get_or_create(country=key[0], town=key[1], timeZone=key[2])
+    transaction.on_commit(lambda: _location_ids.setdefault(key, location.id))
+    return location.id
+
+
+def build_smart_plug_data(plug, quota: dict) -> SmartPlugData:
+    """
+    Build an unsaved SmartPlugData row for one quota sample. In compact storage
+    mode only the typed numeric columns are kept: location strings are interned
+    into SmartPlugLocation and the raw quota document is dropped.
+    """
+    extracted = extract_selected_quota_fields(quota)
+    sample = SmartPlugData(
+        device=plug,
+        serial_number=plug.sn or "MISSING",
+        eatTime=parse_eat_time(extracted.get("utcTime")),
+        switchStatus=extracted['switchStatus'],
+        freq=extracted['freq'],
+        volt=extracted['volt'],
+        current=extracted['current'],
+        watts=(extracted["watts"] / 10) if extracted["watts"] is not None else None,
+    )
+    if settings.SMARTPLUG_RAW_STORAGE == 'compact':
+        sample.location_id = get_location_id(extracted['country'], extracted['town'], extracted['timeZone'])
+    else:
+        sample.utcTime = extracted['utcTime']
+        sample.updateTime = extracted['updateTime']
+        sample.timeZone = extracted['timeZone']
+        sample.country = extracted['country']
+        sample.town = extracted['town']
+        sample.quota_data = quota
+    return sample
+
+
+def sync_smart_plug_data(devices=None, shard=None, shards=None):
+    """
+    Ingest one polling cycle: resolve all plugs in a single query and write every
+    sample with one bulk_create inside one transaction. Returns the rows created.
+
+    Quotas are fetched for the cached device list, or only its `shard` of `shards`
+    (see sharding.py); an SN missing from the registry forces a device-list refresh
+    and registry upsert instead of dropping the sample. With
+    SMARTPLUG_ADAPTIVE_POLLING only the plugs the scheduler reports due are polled,
+    each shard getting its share of the budget, and each is rescheduled from its result.
+    """
+    adaptive = devices is None and settings.SMARTPLUG_ADAPTIVE_POLLING
+    if devices is None:
+        listed = get_cached_devices()
+        shards = shards or 1
+        if shard is not None:
+            from smartPlug_devices.sharding import shard_devices
+            listed = shard_devices(listed, shard, shards)
+        if adaptive:
+            from smartPlug_devices import scheduler
+            listed = scheduler.select_due_devices(listed, shards=shards)
+        elif len(listed) * shards > tick_capacity():
+            print(f"⚠️ Polling {len(listed) * shards} plugs per tick exceeds the {tick_capacity():.0f} calls "
+                  f"ECOFLOW_RATE_LIMIT_PER_SECOND grants; the rest are deferred.")
+        devices = get_ecoflow_devices_all(devices=listed)
+
+    sns = [device_data["sn"] for device_data in devices if device_data["sn"]]
+    plugs = SmartPlug.objects.in_bulk(sns, field_name='sn')
+
+    missing = [sn for sn in sns if sn not in plugs]
+    if missing:
+        print(f"Unknown SmartPlug SNs {missing}; refreshing device registry.")
+        sync_smart_plugs(get_device_list(get_cached_devices(force_refresh=True)))
+        plugs.update(SmartPlug.objects.in_bulk(missing, field_name='sn'))
+
+    rows = []
+    deferred = 0
     for device_data in devices:
+        if device_data.get("quota_deferred"):
+            deferred += 1
+            continue
         sn = device_data["sn"]
-        try:
-            # plug = SmartPlug.objects.get(sn=sn)
-            # sn_value = plug.sn if plug and plug.sn else "MISSING"
-            plug = SmartPlug.objects.get(sn=sn)
-            plug.refresh_from_db()  # Ensures the latest data is loaded
-            sn_value = plug.sn if plug.sn else "MISSING"
-            #print("Creating SmartPlugData with serial_number =", sn_value)
-            quota = device_data.get("quota", {})
-            extracted = extract_selected_quota_fields(quota)
-
-            raw_utc_time = extracted.get("utcTime")
-
-            if raw_utc_time:
-                try:
-                    # Parse raw UTC timestamp
-                    # Parse UTC timestamp directly to an aware datetime
-                    utc_dt = datetime.fromtimestamp(int(raw_utc_time), tz=timezone.utc)
-
-                    # Convert to EAT (UTC+3)
-                    eat_tz = timezone(timedelta(hours=3))
-                    eat_dt = utc_dt.astimezone(eat_tz)
-
-                            # Ensure timezone-awareness
-                    if is_naive(eat_dt):
-                        eat_dt = make_aware(eat_dt, timezone=eat_tz)
-                    
-
-                    # formatted_utc_time = utc_dt.strftime("%Y-%m-%d %H:%M:%S")
-                    # formatted_eat_time = eat_dt.strftime("%Y-%m-%d %H:%M:%S")
-
-                except Exception as e:
-                    eat_dt = None
-                    # formatted_utc_time = None
-                    # formatted_eat_time = None
-            else:
-                eat_dt = None
-                # formatted_utc_time = None
-                # formatted_eat_time = None
-
-            SmartPlugData.objects.create(
-                device=plug,
-                serial_number=sn_value,
-                utcTime=extracted['utcTime'],
-                #eatTime=formatted_eat_time,
-                eatTime=eat_dt,
-                updateTime=extracted['updateTime'],
-                timeZone=extracted['timeZone'],
-                country=extracted['country'],
-                town=extracted['town'],
-                switchStatus=extracted['switchStatus'],
-                freq=extracted['freq'],
-                volt=extracted['volt'],
-                current=extracted['current'],
-                watts=(extracted["watts"] / 10) if extracted["watts"] is not None else None,
-                quota_data=quota,
-            )
-        except SmartPlug.DoesNotExist:
-            # Optional: log or handle missing device
+        plug = plugs.get(sn)
+        if plug is None:
             print(f"SmartPlug with SN {sn} not found; skipping quota data.")
+            continue
+        rows.append(build_smart_plug_data(plug, device_data.get("quota") or {}))
+
+    if deferred:
+        print(f"⏳ {deferred} quota calls deferred by the rate limiter; no samples stored for them.")
+    if adaptive:
+        scheduler.reschedule(devices, plugs)
+    return write_smart_plug_data(rows)
+
+
+def write_smart_plug_data(rows, on_error=None):
+    """
+    Write a batch of unsaved SmartPlugData rows through the configured path:
+    deadband filter, then the SQLite writer queue, COPY on PostgreSQL or one
+    bulk_create in a transaction. Shared by polling and MQTT ingestion.
+
+    Direct writes raise on failure. Queued writes return at once; if the writer
+    later gives up on them, on_error(rows) is called from the writer thread.
+    The deadband state only advances for rows that were committed.
+    """
+    deadband = settings.SMARTPLUG_DEADBAND_ENABLED
+    if deadband:
+        rows = apply_deadband(rows)
+
+    if use_writer_queue():
+        get_writer().submit(rows, on_error=on_error, on_written=remember_deadband_state if deadband else None)
+        return rows
+
+    with transaction.atomic():
+        if deadband:
+            transaction.on_commit(lambda: remember_deadband_state(rows))
+        if connection.vendor == 'postgresql' and settings.SMARTPLUG_COPY_INGEST:
+            return copy_smart_plug_data(rows)
+        created = SmartPlugData.objects.bulk_create(rows, batch_size=settings.SMARTPLUG_BULK_BATCH_SIZE)
+    return created
+
+
+def _copy_value(field, value):
+    """Encode one value for PostgreSQL's COPY text format."""
+    if value is None:
+        return "\\N"
+    if isinstance(field, models.JSONField):
+        value = json.dumps(value)
+    elif isinstance(value, bool):
+        value = "t" if value else "f"
+    elif isinstance(value, datetime):
+        value = value.isoformat()
+    return (
+        str(value).replace("\\", "\\\\").replace("\t", "\\t")
+        .replace("\n", "\\n").replace("\r", "\\r")
+    )
+
+
+def copy_smart_plug_data(rows):
+    """
+    Write SmartPlugData rows with a single COPY ... FROM STDIN (PostgreSQL only).
+    Rows are written as-is and come back without primary keys.
+    """
+    fields = [field for field in SmartPlugData._meta.concrete_fields if not field.primary_key]
+    buffer = io.StringIO()
+    for row in rows:
+        buffer.write("\t".join(_copy_value(field, field.pre_save(row, add=True)) for field in fields))
+        buffer.write("\n")
+    buffer.seek(0)
+
+    quote = connection.ops.quote_name
+    sql = (
+        f"COPY {quote(SmartPlugData._meta.db_table)} "
+        f"({', '.join(quote(field.column) for field in fields)}) FROM STDIN"
+    )
+    with connection.cursor() as cursor:
+        raw_cursor = cursor.cursor
+        if hasattr(raw_cursor, "copy_expert"):  # psycopg2
+            raw_cursor.copy_expert(sql, buffer)
+        else:  # psycopg 3
+            with raw_cursor.copy(sql) as copy:
+                copy.write(buffer.getvalue())
+    return rows
+
+
+DEADBAND_CACHE_PREFIX = "smartplug:deadband:"
+
+
+def _deadband_state(sample):
+    return {
+        "eatTime": sample.eatTime.timestamp() if sample.eatTime else time.time(),
+        "switchStatus": sample.switchStatus,
+        **{field: getattr(sample, field) for field in settings.SMARTPLUG_DEADBAND_THRESHOLDS},
+    }
 
-def smart_plug_data_aggregate(device_sn, interval_seconds=300):
-    print(f">>> Running aggregation for {device_sn}")
-    from django.utils.timezone import utc
-
-    try:
-        device = SmartPlug.objects.get(sn=device_sn)
-    except SmartPlug.DoesNotExist:
-        print(f"Device with SN {device_sn} not found.")
-        return
-
-    # Load only unaggregated records
-    qs = SmartPlugData.objects.filter(device=device, is_aggregated=False).order_by('eatTime')
-    if not qs.exists():
-        print(f"No unaggregated SmartPlugData for device {device_sn}")
-        return
 
-    # Load into DataFrame
-    df = pd.DataFrame(list(qs.values(
-        'id', 'eatTime', 'volt', 'current', 'freq', 'watts',
-        'switchStatus', 'country', 'town'
-    )))
+def _deadband_changed(last, state):
+    if last is None or last["switchStatus"] != state["switchStatus"]:
+        return True
+    if state["eatTime"] - last["eatTime"] >= settings.SMARTPLUG_DEADBAND_HEARTBEAT:
+        return True
+    for field, threshold in settings.SMARTPLUG_DEADBAND_THRESHOLDS.items():
+        previous, current = last.get(field), state[field]
+        if (previous is None) != (current is None):
+            return True
+        if current is not None and abs(current - previous) > threshold:
+            return True
+    return False
+
+
+def apply_deadband(rows):
+    """
+    Keep only samples that move beyond SMARTPLUG_DEADBAND_THRESHOLDS (or change
+    switch state) since the device's last written sample, plus a heartbeat every
+    SMARTPLUG_DEADBAND_HEARTBEAT seconds. The last written sample per device is
+    kept in the Django cache so it is shared across workers when Redis is used;
+    it is only updated by remember_deadband_state() once the kept rows are written.
+    """
+    keys = {row.device_id: f"{DEADBAND_CACHE_PREFIX}{row.device_id}" for row in rows}
+    last_written = cache.get_many(list(keys.values()))
+
+    kept = []
+    for row in rows:
+        state = _deadband_state(row)
+        if _deadband_changed(last_written.get(keys[row.device_id]), state):
+            kept.append(row)
+            last_written[keys[row.device_id]] = state
+    return kept
+
+
+def remember_deadband_state(rows):
+    """Record `rows` (already written) as each device's last written sample."""
+    state = {f"{DEADBAND_CACHE_PREFIX}{row.device_id}": _deadband_state(row) for row in rows}
+    cache.set_many(state, timeout=settings.SMARTPLUG_DEADBAND_HEARTBEAT * 2)
+
+
+AGGREGATE_UPDATE_FIELDS = [
+    'serial_number', 'manufacturer', 'country', 'town', 'switchStatus', 'phase',
+    'voltage_v', 'current_a', 'frequency_hz', 'power_w', 'power_factor',
+    'energy_interval_wh', 'energy_lifetime_wh', 'billing_cycle_start_at',
+]
+
+
+def _column(agg, name, decimals=None):
+    """Return a DataFrame column as a Python list, rounded, with NaN mapped to None."""
+    values = agg[name]
+    if decimals is not None:
+        values = pd.to_numeric(values).round(decimals)
+    return values.astype(object).where(values.notna(), None).tolist()
+
+
+def build_aggregate_rows(devices, agg, interval_seconds):
+    """
+    Build unsaved SmartPlugDataAggregate rows column-wise from a resampled
+    DataFrame indexed by (device_id, bin); `devices` maps device ids to plugs.
+    """
+    switch_status = [int(value) if value is not None else None for value in _column(agg, 'switchStatus')]
+    columns = zip(
+        (devices[device_id] for device_id in agg.index.get_level_values('device_id')),
+        agg.index.get_level_values('bin').to_pydatetime(),
+        _column(agg, 'country'),
+        _column(agg, 'town'),
+        switch_status,
+        _column(agg, 'voltage_v', 2),
+        _column(agg, 'current_a', 2),
+        _column(agg, 'frequency_hz', 2),
+        _column(agg, 'power_w', 2),
+        _column(agg, 'energy_interval_wh', 2),
+        _column(agg, 'energy_lifetime_wh', 2),
+    )
+    return [
+        SmartPlugDataAggregate(
+            device=device,
+            serial_number=device.sn,
+            manufacturer='Ecoflow',
+            metered_at=metered_at,
+            interval_seconds=interval_seconds,
+            country=country,
+            town=town,
+            switchStatus=switch,
+            phase='1',
+            voltage_v=voltage,
+            current_a=current,
+            frequency_hz=frequency,
+            power_w=power,
+            power_factor=1.0,
+            energy_interval_wh=energy_interval,
+            energy_lifetime_wh=energy_lifetime,
+            billing_cycle_start_at=None,
+        )
+        for (device, metered_at, country, town, switch, voltage, current,
+             frequency, power, energy_interval, energy_lifetime) in columns
+    ]
+
+
+def save_aggregates(rows):
+    """Upsert aggregate rows keyed on (device, metered_at, interval_seconds) in bulk."""
+    with transaction.atomic():
+        SmartPlugDataAggregate.objects.bulk_create(
+            rows,
+            batch_size=settings.SMARTPLUG_BULK_BATCH_SIZE,
+            update_conflicts=True,
+            unique_fields=['device', 'metered_at', 'interval_seconds'],
+            update_fields=AGGREGATE_UPDATE_FIELDS,
+        )
 
-    df.rename(columns={
-        'eatTime': 'timestamp',
-        'volt': 'voltage_v',
-        'current': 'current_a',
-        'freq': 'frequency_hz',
-        'watts': 'power_w',
-    }, inplace=True)
 
+AGGREGATE_SOURCE_COLUMNS = {
+    'eatTime': 'timestamp',
+    'volt': 'voltage_v',
+    'current': 'current_a',
+    'freq': 'frequency_hz',
+    'watts': 'power_w',
+}
+
+
+def _load_raw_frame(raw):
+    """Stream raw SmartPlugData rows into a DataFrame with aggregation column names."""
+    # Compact rows keep country/town on the interned location instead
+    df = pd.DataFrame.from_records(
+        raw.annotate(
+            country_name=Coalesce('country', 'location__country'),
+            town_name=Coalesce('town', 'location__town'),
+        ).values_list('device_id', *AGGREGATE_SOURCE_COLUMNS, 'switchStatus', 'country_name', 'town_name')
+        .iterator(chunk_size=settings.SMARTPLUG_AGGREGATE_CHUNK_SIZE),
+        columns=['device_id', *AGGREGATE_SOURCE_COLUMNS.values(), 'switchStatus', 'country', 'town'],
+    )
     df['timestamp'] = pd.to_datetime(df['timestamp'], utc=True)
-    df.set_index('timestamp', inplace=True)
-
-    # Map record IDs to resample bins
-    df['resample_bin'] = df.index.floor(f'{interval_seconds}s')
-    id_map = df.groupby('resample_bin')['id'].apply(list).to_dict()
-
-    print(f"[DEBUG] Sample bin ID map: {dict(list(id_map.items())[:2])}")
-
-    # Resample and aggregate
-    agg = df.resample(f"{interval_seconds}s").agg({
+    df = df.dropna(subset=['timestamp'])
+    numeric = ['voltage_v', 'current_a', 'frequency_hz', 'power_w']
+    df[numeric] = df[numeric].apply(pd.to_numeric)
+    return df
+
+
+def _gap_hold_seconds():
+    """
+    How long a sample's values hold when rebuilding the polling grid, or None when
+    samples arrive at the regular SMARTPLUG_POLL_SECONDS rate and plain bin means are
+    exact. Deadband recording holds up to its heartbeat; adaptive polling up to the
+    longest interval the scheduler gives an online plug; MQTT pushes, which only
+    arrive on change, up to SMARTPLUG_MQTT_HOLD_SECONDS.
+    """
+    holds = []
+    if settings.SMARTPLUG_DEADBAND_ENABLED:
+        holds.append(settings.SMARTPLUG_DEADBAND_HEARTBEAT)
+    if settings.SMARTPLUG_ADAPTIVE_POLLING:
+        holds.append(max(settings.SMARTPLUG_POLL_ACTIVE_MAX_SECONDS, settings.SMARTPLUG_POLL_IDLE_MAX_SECONDS))
+    if settings.SMARTPLUG_MQTT_INGEST:
+        holds.append(settings.SMARTPLUG_MQTT_HOLD_SECONDS)
+    return max(holds) if holds else None
+
+
+def _fill_sample_gaps(df, devices, interval_seconds, cutoff, hold_seconds):
+    """
+    Rebuild the regular polling grid for sparsely recorded data (deadband,
+    adaptive polling or MQTT pushes). Each sample's values hold until the next one (at most
+    `hold_seconds`), starting from the device's last already-aggregated sample,
+    so bin means are time-weighted and energy matches full-rate recording.
+    """
+    if df.empty:
+        return df
+    step = f"{settings.SMARTPLUG_POLL_SECONDS}s"
+    limit = max(int(hold_seconds // settings.SMARTPLUG_POLL_SECONDS), 1)
+
+    # Seed each device with its last aggregated sample before the pending rows
+    carry_ids = SmartPlug.objects.filter(id__in=list(devices)).annotate(
+        carry_id=Subquery(
+            SmartPlugData.objects.filter(device=OuterRef('pk'), is_aggregated=True, eatTime__isnull=False)
+            .order_by('-eatTime').values('id')[:1]
+        )
+    ).values_list('carry_id', flat=True)
+    carry = _load_raw_frame(SmartPlugData.objects.filter(id__in=[i for i in carry_ids if i]))
+    hold = pd.Timedelta(seconds=hold_seconds)
+    first_pending = df.groupby('device_id')['timestamp'].min()
+    carry = carry[carry['timestamp'] >= carry['device_id'].map(first_pending) - hold]
+    df = pd.concat([carry, df]) if not carry.empty else df
+
+    # The grid runs up to the end of the last closed bin, never into the open one
+    last_step = pd.Timestamp(cutoff) - pd.Timedelta(step)
+    frames = []
+    for device_id, samples in df.sort_values('timestamp').groupby('device_id'):
+        grid = samples.set_index('timestamp').drop(columns='device_id').resample(step).last()
+        bin_end = grid.index[-1].floor(f'{interval_seconds}s') + pd.Timedelta(seconds=interval_seconds)
+        grid = grid.reindex(pd.date_range(
+            grid.index[0], min(bin_end - pd.Timedelta(step), last_step), freq=step
+        ))
+        with pd.option_context('future.no_silent_downcasting', True):
+            grid = grid.ffill(limit=limit)
+        grid['device_id'] = device_id
+        frames.append(grid.rename_axis('timestamp').reset_index())
+    return pd.concat(frames, ignore_index=True)
+
+
+def smart_plug_data_aggregate_fleet(interval_seconds=300, device_sns=None):
+    """
+    Aggregate unaggregated SmartPlugData for the whole fleet (or only `device_sns`)
+    in one pass: one streamed read of raw rows, one grouped resample on
+    (device, bin), one query for the devices and their watermarks, one bulk upsert
+    of the results and one UPDATE of the aggregated flag.
+
+    Only fully closed bins are aggregated. Rows in the still-open bin are left for
+    the next run, and late rows falling at or before a device's watermark are
+    marked aggregated without recomputing that bin, so lifetime energy is never
+    counted twice.
+    """
+    print(f">>> Running fleet aggregation ({interval_seconds}s bins)")
+
+    # Bins starting at or after the cutoff may still receive samples.
+    cutoff = pd.Timestamp(now() - timedelta(seconds=settings.SMARTPLUG_AGGREGATE_GRACE_SECONDS))
+    cutoff = cutoff.floor(f'{interval_seconds}s').to_pydatetime()
+
+    raw = SmartPlugData.objects.filter(is_aggregated=False).filter(
+        Q(eatTime__lt=cutoff) | Q(eatTime__isnull=True)
+    )
+    if device_sns is not None:
+        raw = raw.filter(device__sn__in=device_sns)
+
+    # Snapshot the upper id bound so rows inserted while we work stay unaggregated.
+    max_id = raw.aggregate(max_id=Max('id'))['max_id']
+    if max_id is None:
+        print("No closed-bin SmartPlugData to aggregate")
+        return 0
+    raw = raw.filter(id__lte=max_id)
+
+    df = _load_raw_frame(raw)
+
+    # Devices with their watermark; plugs aggregated before watermarks existed
+    # fall back to their latest aggregate row.
+    last_aggregate = SmartPlugDataAggregate.objects.filter(
+        device=OuterRef('pk'), interval_seconds=interval_seconds
+    ).order_by('-metered_at')
+    watermark = SmartPlugAggregationWatermark.objects.filter(
+        device=OuterRef('pk'), interval_seconds=interval_seconds
+    )
+    devices = SmartPlug.objects.filter(id__in=df['device_id'].unique().tolist()).annotate(
+        watermark_at=Coalesce(
+            Subquery(watermark.values('last_bin_at')[:1]),
+            Subquery(last_aggregate.values('metered_at')[:1]),
+        ),
+        last_lifetime_wh=Coalesce(
+            Subquery(watermark.values('energy_lifetime_wh')[:1]),
+            Subquery(last_aggregate.values('energy_lifetime_wh')[:1]),
+        ),
+    ).in_bulk()
+
+    hold_seconds = _gap_hold_seconds()
+    if hold_seconds:
+        df = _fill_sample_gaps(df, devices, interval_seconds, cutoff, hold_seconds)
+
+    # Drop late samples for bins that are already closed and aggregated
+    df['bin'] = df['timestamp'].dt.floor(f'{interval_seconds}s')
+    watermark_at = pd.to_datetime(
+        df['device_id'].map(lambda device_id: devices[device_id].watermark_at), utc=True
+    )
+    df = df[watermark_at.isna() | (df['bin'] > watermark_at)]
+
+    agg = df.groupby(['device_id', 'bin']).agg({
         'voltage_v': 'mean',
         'current_a': 'mean',
         'frequency_hz': 'mean',
@@ -299,100 +874,112 @@ def smart_plug_data_aggregate(device_sn, interval_seconds=300):
         'town': 'last',
     }).dropna(subset=['power_w'])
 
-    if agg.empty:
-        print(f"No data to aggregate for {device_sn}")
-        return
+    with transaction.atomic():
+        if not agg.empty:
+            # Energy calculation, accumulated per device on top of its watermark
+            interval_hours = interval_seconds / 3600
+            agg['energy_interval_wh'] = agg['power_w'] * interval_hours
+            last_lifetime = agg.index.get_level_values('device_id').map(
+                lambda device_id: devices[device_id].last_lifetime_wh or 0.0
+            )
+            agg['energy_lifetime_wh'] = (
+                agg.groupby(level='device_id')['energy_interval_wh'].cumsum() + last_lifetime.to_numpy()
+            )
 
-    # Energy calculation
-    interval_hours = interval_seconds / 3600
-    agg['energy_interval_wh'] = agg['power_w'] * interval_hours
-    # Get last cumulative energy value for the device
-    last_agg = SmartPlugDataAggregate.objects.filter(device=device).order_by('-metered_at').first()
-    last_lifetime_wh = last_agg.energy_lifetime_wh if last_agg else 0.0
+            save_aggregates(build_aggregate_rows(devices, agg, interval_seconds))
+
+            closed = agg['energy_lifetime_wh'].groupby(level='device_id').tail(1)
+            watermarks = [
+                SmartPlugAggregationWatermark(
+                    device=devices[device_id],
+                    interval_seconds=interval_seconds,
+                    last_bin_at=last_bin.to_pydatetime(),
+                    energy_lifetime_wh=float(lifetime),
+                )
+                for (device_id, last_bin), lifetime in closed.items()
+            ]
+            SmartPlugAggregationWatermark.objects.bulk_create(
+                watermarks,
+                update_conflicts=True,
+                unique_fields=['device', 'interval_seconds'],
+                update_fields=['last_bin_at', 'energy_lifetime_wh', 'updated_at'],
+            )
 
-    # Add it to the new cumulative energy values
-    agg['energy_lifetime_wh'] = agg['energy_interval_wh'].cumsum() + last_lifetime_wh
+        updated = raw.update(is_aggregated=True)
 
-    for timestamp, row in agg.iterrows():
-        SmartPlugDataAggregate.objects.update_or_create(
-            device=device,
-            metered_at=timestamp,
-            interval_seconds=interval_seconds,
-            defaults={
-                'serial_number': device.sn,
-                'manufacturer': 'Ecoflow',
-                'country': row.get('country'),
-                'town': row.get('town'),
-                'switchStatus': row.get('switchStatus'),
-                'phase': '1',
-                'voltage_v': round(row.get('voltage_v', 0), 2),
-                'current_a': round(row.get('current_a', 0), 2),
-                'frequency_hz': round(row.get('frequency_hz', 0), 2),
-                'power_w': round(row.get('power_w', 0), 2),
-                'power_factor': 1.0,
-                'energy_interval_wh': round(row.get('energy_interval_wh', 0), 2),
-                'energy_lifetime_wh': round(row.get('energy_lifetime_wh', 0), 2),
-                'billing_cycle_start_at': None,
-            }
-        )
+    print(f"✅ Fleet aggregation complete. {len(agg)} closed intervals from {updated} records.")
+    return len(agg)
 
-    # ✅ Mark ALL fetched records as aggregated
-    all_ids = list(qs.values_list('id', flat=True))
-    print(f">>> Updating {len(all_ids)} records to is_aggregated=True")
-    SmartPlugData.objects.filter(id__in=all_ids).update(is_aggregated=True)
-    print(">>> Aggregation flag updated for all fetched records.")
-
-    print(f"✅ Aggregation complete for {device_sn}. {len(agg)} intervals processed.")
-
-
-def push_smart_plug_data_to_prospect():
-    unpushed_records = SmartPlugDataAggregate.objects.filter(is_pushed=False).order_by("metered_at")
-
-    if not unpushed_records.exists():
-        return {"message": "No unpushed records found."}
-
-    # Build the payload
-    payload = {
-        "data": [
-            {
-                "manufacturer": agg.manufacturer,
-                "serial_number": agg.serial_number,
-                "metered_at": agg.metered_at.strftime("%Y-%m-%d %H:%M:%S"),
-                "phase": agg.phase,
-                "voltage_v": agg.voltage_v,
-                "power_factor": agg.power_factor,
-                "power_w": agg.power_w,
-                "energy_lifetime_wh": agg.energy_lifetime_wh,
-                "energy_interval_wh": agg.energy_interval_wh,
-                "frequency_hz": agg.frequency_hz,
-                "current_a": agg.current_a,
-                "interval_seconds": agg.interval_seconds,
-                "billing_cycle_start_at": agg.billing_cycle_start_at.strftime("%Y-%m-%d") if agg.billing_cycle_start_at else None,
-            }
-            for agg in unpushed_records
-        ]
+
+def smart_plug_data_aggregate(device_sn, interval_seconds=300):
+    print(f">>> Running aggregation for {device_sn}")
+    if not SmartPlug.objects.filter(sn=device_sn).exists():
+        print(f"Device with SN {device_sn} not found.")
+        return
+    smart_plug_data_aggregate_fleet(interval_seconds, device_sns=[device_sn])
+
+
+def serialize_aggregate_for_prospect(agg) -> dict:
+    return {
+        "manufacturer": agg.manufacturer,
+        "serial_number": agg.serial_number,
+        "metered_at": agg.metered_at.strftime("%Y-%m-%d %H:%M:%S"),
+        "phase": agg.phase,
+        "voltage_v": agg.voltage_v,
+        "power_factor": agg.power_factor,
+        "power_w": agg.power_w,
+        "energy_lifetime_wh": agg.energy_lifetime_wh,
+        "energy_interval_wh": agg.energy_interval_wh,
+        "frequency_hz": agg.frequency_hz,
+        "current_a": agg.current_a,
+        "interval_seconds": agg.interval_seconds,
+        "billing_cycle_start_at": agg.billing_cycle_start_at.strftime("%Y-%m-%d") if agg.billing_cycle_start_at else None,
     }
 
+
+def push_smart_plug_data_to_prospect(batch_size=None):
+    """
+    Push unpushed aggregates to Prospect in primary-key order, one POST per batch.
+    Only the ids sent in a successful batch are marked pushed, so a failure stops
+    the run and the next run resumes from the first unconfirmed row.
+    """
+    batch_size = batch_size or settings.PROSPECT_PUSH_BATCH_SIZE
     headers = {
         "Content-Type": "application/json",
         "Authorization": f"Bearer {settings.PROSPECT_API_TOKEN}",
     }
 
-    try:
-        response = requests.post(settings.PROSPECT_API_URL, json=payload, headers=headers)
-        response.raise_for_status()
+    pushed_count = 0
+    last_id = 0
+    while True:
+        batch = list(
+            SmartPlugDataAggregate.objects.filter(is_pushed=False, id__gt=last_id).order_by("id")[:batch_size]
+        )
+        if not batch:
+            break
 
-        # If successful, update all records at once
-        unpushed_records.update(is_pushed=True)
+        payload = {"data": [serialize_aggregate_for_prospect(agg) for agg in batch]}
+        try:
+            response = get_client().session.post(
+                settings.PROSPECT_API_URL, json=payload, headers=headers, timeout=settings.PROSPECT_REQUEST_TIMEOUT
+            )
+            response.raise_for_status()
+        except requests.exceptions.RequestException as e:
+            return {
+                "success": False,
+                "error": str(e),
+                "pushed_count": pushed_count,
+            }
 
-        return {
-            "success": True,
-            "pushed_count": unpushed_records.count(),
-        }
+        sent_ids = [agg.id for agg in batch]
+        SmartPlugDataAggregate.objects.filter(id__in=sent_ids).update(is_pushed=True)
+        pushed_count += len(sent_ids)
+        last_id = sent_ids[-1]
 
-    except requests.exceptions.RequestException as e:
-        return {
-            "success": False,
-            "error": str(e),
-        }
+    if not pushed_count:
+        return {"success": True, "pushed_count": 0, "message": "No unpushed records found."}
 
+    return {
+        "success": True,
+        "pushed_count": pushed_count,
+    }
@@ -0,0 +1,154 @@
+"""
+Streaming CSV/Parquet export of SmartPlugData and SmartPlugDataAggregate.
+
+Rows are read with QuerySet.iterator() (a server-side cursor on PostgreSQL,
+chunked fetches on SQLite) and encoded SMARTPLUG_EXPORT_CHUNK_SIZE rows at a
+time, so memory stays flat whatever the export size. Parquet needs the optional
+pyarrow package; each chunk becomes one row group.
+"""
+import csv
+import io
+from itertools import islice
+from django.conf import settings
+from django.db.models.functions import Coalesce
+from smartPlug_devices.models import SmartPlugData, SmartPlugDataAggregate
+
+EXPORT_FORMATS = {
+    'csv': 'text/csv',
+    'parquet': 'application/vnd.apache.parquet',
+}
+RAW_EXPORT_FIELDS = [
+    'id', 'serial_number', 'eatTime', 'fetched_at', 'country', 'town', 'timeZone',
+    'switchStatus', 'volt', 'current', 'freq', 'watts', 'is_aggregated',
+]
+AGGREGATE_EXPORT_FIELDS = [
+    'id', 'serial_number', 'metered_at', 'interval_seconds', 'country', 'town', 'switchStatus',
+    'voltage_v', 'current_a', 'frequency_hz', 'power_w', 'power_factor',
+    'energy_interval_wh', 'energy_lifetime_wh', 'is_pushed', 'created_at',
+]
+EXPORTS = {
+    # kind: (model, time field, columns)
+    'raw': (SmartPlugData, 'eatTime', RAW_EXPORT_FIELDS),
+    'aggregates': (SmartPlugDataAggregate, 'metered_at', AGGREGATE_EXPORT_FIELDS),
+}
+
+
+def export_queryset(kind, device_sns=None, start=None, end=None):
+    """Return (columns, values_list queryset) for an export, filtered and in primary-key order."""
+    model, time_field, columns = EXPORTS[kind]
+    queryset = model.objects.all()
+    if device_sns:
+        queryset = queryset.filter(device__sn__in=device_sns)
+    if start:
+        queryset = queryset.filter(**{f'{time_field}__gte': start})
+    if end:
+        queryset = queryset.filter(**{f'{time_field}__lt': end})
+    selected = columns
+    if model is SmartPlugData:
+        # Compact rows keep country/town/time zone on the interned location
+        queryset = queryset.annotate(
+            export_country=Coalesce('country', 'location__country'),
+            export_town=Coalesce('town', 'location__town'),
+            export_time_zone=Coalesce('timeZone', 'location__timeZone'),
+        )
+        renamed = {'country': 'export_country', 'town': 'export_town', 'timeZone': 'export_time_zone'}
+        selected = [renamed.get(name, name) for name in columns]
+    return columns, queryset.order_by('id').values_list(*selected)
+
+
+def _chunks(queryset, chunk_size=None):
+    chunk_size = chunk_size or settings.SMARTPLUG_EXPORT_CHUNK_SIZE
+    rows = queryset.iterator(chunk_size=chunk_size)
+    while True:
+        chunk = list(islice(rows, chunk_size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def iter_csv(columns, queryset, chunk_size=None):
+    """Yield the export as UTF-8 CSV, one encoded chunk of rows at a time."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(columns)
+    for chunk in _chunks(queryset, chunk_size):
+        writer.writerows(
+            [value.isoformat() if hasattr(value, 'isoformat') else value for value in row] for row in chunk
+        )
+        yield buffer.getvalue().encode()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode()
+
+
+class _ChunkSink(io.RawIOBase):
+    """Write-only file that hands written bytes back to the generator instead of keeping them."""
+
+    def __init__(self):
+        super().__init__()
+        self.parts = []
+        self.position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.parts.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def drain(self):
+        data = b''.join(self.parts)
+        self.parts = []
+        return data
+
+
+def parquet_available():
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def _arrow_schema(model, columns):
+    import pyarrow as pa
+
+    types = {
+        'AutoField': pa.int64(), 'BigAutoField': pa.int64(), 'IntegerField': pa.int64(),
+        'FloatField': pa.float64(), 'BooleanField': pa.bool_(),
+        'DateTimeField': pa.timestamp('us', tz='UTC'),
+    }
+    return pa.schema([
+        (name, types.get(model._meta.get_field(name).get_internal_type(), pa.string()))
+        for name in columns
+    ])
+
+
+def iter_parquet(kind, columns, queryset, chunk_size=None):
+    """Yield the export as a Parquet file, one row group per chunk of rows."""
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    schema = _arrow_schema(EXPORTS[kind][0], columns)
+    sink = _ChunkSink()
+    with pq.ParquetWriter(pa.PythonFile(sink, mode='w'), schema, compression='zstd') as writer:
+        for chunk in _chunks(queryset, chunk_size):
+            writer.write_table(pa.Table.from_arrays(
+                [pa.array(values, type=field.type) for values, field in zip(zip(*chunk), schema)],
+                schema=schema,
+            ))
+            yield sink.drain()
+    yield sink.drain()
+
+
+def iter_export(kind, export_format='csv', device_sns=None, start=None, end=None, chunk_size=None):
+    """Yield the encoded bytes of an export in chunks."""
+    columns, queryset = export_queryset(kind, device_sns, start, end)
+    if export_format == 'parquet':
+        return iter_parquet(kind, columns, queryset, chunk_size)
+    return iter_csv(columns, queryset, chunk_size)
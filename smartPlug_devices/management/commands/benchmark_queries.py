@@ -0,0 +1,114 @@
+import time
+from datetime import timedelta
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.db.models import Max
+from django.utils.timezone import now
+from smartPlug_devices.models import SmartPlug, SmartPlugData, SmartPlugDataAggregate
+
+BENCH_SN_PREFIX = "BENCH-"
+
+
+class Command(BaseCommand):
+    help = "Print query plans and timings for the hot SmartPlugData/SmartPlugDataAggregate queries"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=0,
+                            help="Seed this many synthetic raw rows first (e.g. 10000000)")
+        parser.add_argument('--devices', type=int, default=100, help="Synthetic plugs to spread rows over")
+        parser.add_argument('--repeat', type=int, default=5, help="Timing runs per query (best is reported)")
+        parser.add_argument('--keep', action='store_true', help="Keep the synthetic rows afterwards")
+
+    def handle(self, *args, **options):
+        if options['rows']:
+            started = time.perf_counter()
+            self.seed(options['rows'], options['devices'])
+            self.stdout.write(f"Seeded in {time.perf_counter() - started:.0f}s")
+
+        self.stdout.write(
+            f"Database: {connection.vendor}, "
+            f"{SmartPlugData.objects.count()} raw rows, {SmartPlugDataAggregate.objects.count()} aggregates"
+        )
+
+        device = SmartPlug.objects.order_by('id').first()
+        cutoff = now() - timedelta(hours=2)
+        queries = {
+            "unaggregated rows for one device": lambda: list(
+                SmartPlugData.objects.filter(device=device, is_aggregated=False)
+                .order_by('eatTime').values_list('id', flat=True)[:1000]
+            ),
+            "fleet aggregation id snapshot": lambda: SmartPlugData.objects.filter(
+                is_aggregated=False, eatTime__lt=now()
+            ).aggregate(Max('id')),
+            "aggregated rows past retention": lambda: SmartPlugData.objects.filter(
+                is_aggregated=True, eatTime__lt=cutoff
+            ).count(),
+            "latest aggregate for one device": lambda: SmartPlugDataAggregate.objects.filter(
+                device=device
+            ).order_by('-metered_at').first(),
+            "unpushed aggregates batch": lambda: list(
+                SmartPlugDataAggregate.objects.filter(is_pushed=False)
+                .order_by('id').values_list('id', flat=True)[:1000]
+            ),
+        }
+        plans = {
+            "unaggregated rows for one device": SmartPlugData.objects.filter(
+                device=device, is_aggregated=False).order_by('eatTime'),
+            "fleet aggregation id snapshot": SmartPlugData.objects.filter(
+                is_aggregated=False, eatTime__lt=now()).order_by('-id'),
+            "aggregated rows past retention": SmartPlugData.objects.filter(
+                is_aggregated=True, eatTime__lt=cutoff),
+            "latest aggregate for one device": SmartPlugDataAggregate.objects.filter(
+                device=device).order_by('-metered_at'),
+            "unpushed aggregates batch": SmartPlugDataAggregate.objects.filter(
+                is_pushed=False).order_by('id'),
+        }
+
+        for label, query in queries.items():
+            timings = []
+            for _ in range(options['repeat']):
+                start = time.perf_counter()
+                query()
+                timings.append(time.perf_counter() - start)
+            self.stdout.write(f"\n{label}: best {min(timings) * 1000:.2f} ms")
+            self.stdout.write(plans[label].explain())
+
+        if options['rows'] and not options['keep']:
+            self.stdout.write("\nRemoving synthetic rows...")
+            SmartPlug.objects.filter(sn__startswith=BENCH_SN_PREFIX).delete()
+
+    def seed(self, rows, devices):
+        self.stdout.write(f"Seeding {rows} raw rows over {devices} plugs...")
+        SmartPlug.objects.bulk_create(
+            [SmartPlug(sn=f"{BENCH_SN_PREFIX}{i:05d}") for i in range(devices)],
+            ignore_conflicts=True,
+        )
+        plugs = list(SmartPlug.objects.filter(sn__startswith=BENCH_SN_PREFIX).order_by('id'))
+
+        per_device = rows // len(plugs)
+        start = now() - timedelta(seconds=10 * per_device)
+        open_after = now() - timedelta(minutes=5)
+        batch = []
+        for plug in plugs:
+            for i in range(per_device):
+                eat_time = start + timedelta(seconds=10 * i)
+                batch.append(SmartPlugData(
+                    device=plug, serial_number=plug.sn, eatTime=eat_time,
+                    volt=230.0, current=0.4, freq=50.0, watts=92.0, switchStatus=1,
+                    quota_data={}, is_aggregated=eat_time < open_after,
+                ))
+                if len(batch) >= 10000:
+                    SmartPlugData.objects.bulk_create(batch)
+                    batch = []
+            SmartPlugDataAggregate.objects.bulk_create(
+                [
+                    SmartPlugDataAggregate(
+                        device=plug, serial_number=plug.sn, interval_seconds=300,
+                        metered_at=start + timedelta(seconds=300 * i), power_w=92.0,
+                        is_pushed=i < per_device // 30 - 12,
+                    )
+                    for i in range(per_device // 30)
+                ],
+                batch_size=10000,
+            )
+        SmartPlugData.objects.bulk_create(batch)
@@ -0,0 +1,44 @@
+import sys
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.dateparse import parse_datetime
+from django.utils.timezone import is_naive, make_aware
+from smartPlug_devices.exports import EXPORTS, EXPORT_FORMATS, iter_export, parquet_available
+
+
+def _datetime(value):
+    parsed = parse_datetime(value)
+    if parsed is None:
+        raise ValueError(value)
+    return make_aware(parsed) if is_naive(parsed) else parsed
+
+
+class Command(BaseCommand):
+    help = "Stream SmartPlugData or SmartPlugDataAggregate rows to a CSV or Parquet file in constant memory"
+
+    def add_arguments(self, parser):
+        parser.add_argument('kind', choices=sorted(EXPORTS))
+        parser.add_argument('--format', choices=sorted(EXPORT_FORMATS), default='csv')
+        parser.add_argument('--device', action='append', dest='devices', help="Device SN (repeatable)")
+        parser.add_argument('--start', type=_datetime, help="ISO 8601, inclusive")
+        parser.add_argument('--end', type=_datetime, help="ISO 8601, exclusive")
+        parser.add_argument('--output', default='-', help="File path, or - for stdout")
+
+    def handle(self, *args, **options):
+        if options['format'] == 'parquet' and not parquet_available():
+            raise CommandError("Parquet export needs the pyarrow package")
+
+        chunks = iter_export(
+            options['kind'], options['format'], options['devices'], options['start'], options['end']
+        )
+        written = 0
+        if options['output'] == '-':
+            for chunk in chunks:
+                sys.stdout.buffer.write(chunk)
+                written += len(chunk)
+            sys.stdout.buffer.flush()
+            return
+        with open(options['output'], 'wb') as output:
+            for chunk in chunks:
+                output.write(chunk)
+                written += len(chunk)
+        self.stdout.write(f"Wrote {written} bytes to {options['output']}")
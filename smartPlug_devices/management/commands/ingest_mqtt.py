@@ -0,0 +1,90 @@
+import ssl
+import time
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import close_old_connections
+from smartPlug_devices.mqtt import QuotaStream, get_mqtt_certification, quota_topic
+
+
+class Command(BaseCommand):
+    help = (
+        "Long-running ingestion of EcoFlow quota updates over MQTT into SmartPlugData, "
+        "as an alternative to the 10-second quota polling"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', help="Broker host; defaults to the EcoFlow certification lookup")
+        parser.add_argument('--port', type=int)
+        parser.add_argument('--username')
+        parser.add_argument('--password')
+        parser.add_argument('--topic-prefix', help="Topics are <prefix>/<sn>/quota; default /open/<account>")
+        parser.add_argument('--no-tls', action='store_true', help="Plain TCP, e.g. a local Mosquitto")
+        parser.add_argument('--duration', type=float, default=0, help="Stop after this many seconds (0 = forever)")
+
+    def handle(self, *args, **options):
+        try:
+            import paho.mqtt.client as mqtt
+        except ImportError:
+            raise CommandError("MQTT ingestion needs the paho-mqtt package")
+
+        host, port = options['host'], options['port']
+        username, password = options['username'], options['password']
+        prefix = options['topic_prefix']
+        if not host:
+            certification = get_mqtt_certification()
+            host = certification['url']
+            port = port or int(certification['port'])
+            username = username or certification['certificateAccount']
+            password = password or certification['certificatePassword']
+            prefix = prefix or f"/open/{certification['certificateAccount']}"
+        port = port or (1883 if options['no_tls'] else 8883)
+        prefix = prefix or "/open"
+        topic = quota_topic(prefix)
+
+        if not settings.SMARTPLUG_MQTT_INGEST:
+            self.stderr.write("⚠️ SMARTPLUG_MQTT_INGEST is off: pushed samples will be averaged without time weighting")
+        stream = QuotaStream()
+        if hasattr(mqtt, 'CallbackAPIVersion'):  # paho-mqtt 2.x
+            client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2)
+        else:
+            client = mqtt.Client()
+        if username:
+            client.username_pw_set(username, password)
+        if not options['no_tls']:
+            client.tls_set(cert_reqs=ssl.CERT_REQUIRED)
+
+        def on_connect(client, userdata, flags, reason_code, *args):
+            self.stdout.write(f"Connected to {host}:{port} ({reason_code}); subscribing to {topic}")
+            client.subscribe(topic, qos=1)
+
+        client.on_connect = on_connect
+        client.on_message = lambda client, userdata, message: stream.on_message(message.topic, message.payload)
+        client.reconnect_delay_set(min_delay=1, max_delay=60)
+        client.connect(host, port, keepalive=60)
+        client.loop_start()
+
+        # The network thread only buffers; this thread writes micro-batches.
+        started = time.monotonic()
+        last_report = started
+        try:
+            while not options['duration'] or time.monotonic() - started < options['duration']:
+                time.sleep(settings.SMARTPLUG_MQTT_FLUSH_SECONDS)
+                close_old_connections()
+                try:
+                    stream.flush()
+                except Exception as e:
+                    # e.g. "database is locked": the batch was requeued, keep the service running
+                    self.stderr.write(f"❌ MQTT flush failed, retrying next cycle: {e}")
+                if time.monotonic() - last_report >= 60:
+                    last_report = time.monotonic()
+                    self.stdout.write(f"📡 {stream.received} updates received, {stream.written} samples written")
+        except KeyboardInterrupt:
+            pass
+        finally:
+            client.loop_stop()
+            client.disconnect()
+            try:
+                stream.flush(force=True)
+            except Exception as e:
+                self.stderr.write(f"❌ Final MQTT flush failed; {len(stream.pending)} samples not written: {e}")
+        self.stdout.write(f"Stopped: {stream.received} updates received, {stream.written} samples written")
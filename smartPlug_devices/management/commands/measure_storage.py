@@ -0,0 +1,66 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test.utils import override_settings
+from smartPlug_devices.ecoflow import QUOTA_KEYS, build_smart_plug_data
+from smartPlug_devices.models import SmartPlug, SmartPlugData
+
+# Representative quota/all document for an EcoFlow smart plug, used when the
+# database holds no real sample yet.
+SAMPLE_QUOTA = {
+    "2_1.utcTime": 1754300000, "2_1.updateTime": "2025-08-04 09:33:20", "2_1.timeZone": "UTC+3",
+    "2_1.country": "KE", "2_1.town": "Nairobi", "2_1.switchSta": 1, "2_1.freq": 50,
+    "2_1.volt": 231, "2_1.current": 412, "2_1.watts": 921, "2_1.temp": 38, "2_1.maxCur": 1600,
+    "2_1.maxWatts": 2500, "2_1.brightness": 1023, "2_1.heartbeatFrequency": 2, "2_1.runTime": 862341,
+    "2_1.warnCode": 0, "2_1.errCode": 0, "2_1.meshEnable": 0, "2_1.meshId": 0, "2_1.meshLayel": 0,
+    "2_1.lanState": 1, "2_1.otaDlErr": 0, "2_1.otaDlTlsErr": 0, "2_1.mqttErr": 0, "2_1.mqttErrTime": 0,
+    "2_1.wifiErr": 0, "2_1.wifiErrTime": 0, "2_1.matterFabric": 0, "2_1.parentWifiRssi": -52,
+    "2_1.staIpAddr": 3232235890, "2_1.stackFree": 41, "2_1.stackMinFree": 33, "2_1.geneWatt": 0,
+    "2_1.consWatt": 921, "2_1.consNum": 0, "2_1.powerPriority": 0, "2_1.selfMac": 0, "2_1.task1": {},
+}
+
+
+class Command(BaseCommand):
+    help = "Measure on-disk bytes per SmartPlugData sample in full, selective-quota and compact storage modes"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--samples', type=int, default=20000, help="Rows inserted per mode")
+
+    def handle(self, *args, **options):
+        latest = SmartPlugData.objects.exclude(quota_data=None).order_by('-id').values_list('quota_data', flat=True).first()
+        quota = latest or SAMPLE_QUOTA
+        self.stdout.write(f"Using {'latest stored' if latest else 'synthetic'} quota document ({len(quota)} keys)")
+
+        # Selective quota mode stores the full row layout with only QUOTA_KEYS in quota_data
+        selective = {key: quota[key] for key in QUOTA_KEYS if key in quota}
+        results = {
+            'full': self.measure('full', quota, options['samples']),
+            'selective': self.measure('full', selective, options['samples']),
+            'compact': self.measure('compact', quota, options['samples']),
+        }
+        for mode, size in results.items():
+            self.stdout.write(f"{mode:>9}: {size:8.1f} bytes/sample")
+        if results['compact']:
+            self.stdout.write(f"Compact storage is {results['full'] / results['compact']:.1f}x smaller")
+
+    def measure(self, mode, quota, samples):
+        """Insert `samples` rows inside a transaction that is rolled back, and report the size growth."""
+        with transaction.atomic():
+            plug, _ = SmartPlug.objects.get_or_create(sn="MEASURE-STORAGE")
+            with override_settings(SMARTPLUG_RAW_STORAGE=mode):
+                rows = [build_smart_plug_data(plug, quota) for _ in range(samples)]
+            before = self.table_bytes()
+            SmartPlugData.objects.bulk_create(rows, batch_size=settings.SMARTPLUG_BULK_BATCH_SIZE)
+            grown = self.table_bytes() - before
+            transaction.set_rollback(True)
+        return grown / samples
+
+    def table_bytes(self):
+        with connection.cursor() as cursor:
+            if connection.vendor == 'postgresql':
+                cursor.execute("SELECT pg_total_relation_size(%s)", [SmartPlugData._meta.db_table])
+                return cursor.fetchone()[0]
+            cursor.execute("PRAGMA page_count")
+            pages = cursor.fetchone()[0]
+            cursor.execute("PRAGMA page_size")
+            return pages * cursor.fetchone()[0]
@@ -0,0 +1,116 @@
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from django.core.management.base import BaseCommand, CommandError
+from django.db import OperationalError, close_old_connections, connection
+from django.utils.timezone import now
+from smartPlug_devices import ecoflow
+from smartPlug_devices.models import SmartPlug
+from smartPlug_devices.sqlite import get_writer, use_writer_queue
+from smartPlug_devices.tasks import delete_old_aggregated_data
+
+STRESS_SN_PREFIX = "STRESS-"
+
+
+class _ProspectStub:
+    def raise_for_status(self):
+        pass
+
+
+class Command(BaseCommand):
+    help = (
+        "Replay the Celery beat schedule (10s sync, 5-min aggregate, hourly delete and push) "
+        "against a scratch database with synthetic plugs, and report lock errors and latencies. "
+        "The delete and push steps are fleet-wide, so it refuses to run while real plugs exist"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--plugs', type=int, default=1000)
+        parser.add_argument('--minutes', type=int, default=120, help="Simulated minutes of beat schedule")
+        parser.add_argument('--keep', action='store_true', help="Keep the synthetic plugs and rows afterwards")
+
+    def handle(self, *args, **options):
+        if SmartPlug.objects.exclude(sn__startswith=STRESS_SN_PREFIX).exists():
+            raise CommandError(
+                "The database holds real SmartPlugs; the replayed delete and Prospect push would touch "
+                "their data. Point the settings at a scratch copy (e.g. an empty SQLite file) first."
+            )
+
+        with connection.cursor() as cursor:
+            if connection.vendor == 'sqlite':
+                cursor.execute("PRAGMA journal_mode")
+                self.stdout.write(f"SQLite journal_mode={cursor.fetchone()[0]}, writer queue={use_writer_queue()}")
+
+        SmartPlug.objects.bulk_create(
+            [SmartPlug(sn=f"{STRESS_SN_PREFIX}{i:05d}") for i in range(options['plugs'])],
+            ignore_conflicts=True,
+        )
+        sns = list(SmartPlug.objects.filter(sn__startswith=STRESS_SN_PREFIX).values_list('sn', flat=True))
+        session = ecoflow.get_client().session
+        session.post = lambda *args, **kwargs: _ProspectStub()
+        try:
+            self.replay(sns, options)
+        finally:
+            # Drop the instance attribute so the shared client posts for real again
+            del session.post
+
+        if not options['keep']:
+            SmartPlug.objects.filter(sn__startswith=STRESS_SN_PREFIX).delete()
+
+    def replay(self, sns, options):
+        self.timings = {}
+        self.errors = {}
+        self.lock = threading.Lock()
+        ticks = options['minutes'] * 6
+        sim_start = now() - timedelta(minutes=options['minutes'], hours=1)
+        started = time.perf_counter()
+
+        with ThreadPoolExecutor(max_workers=3) as background:
+            for tick in range(ticks):
+                utc_time = int((sim_start + timedelta(seconds=10 * tick)).timestamp())
+                devices = [
+                    {"sn": sn, "quota": {"2_1.utcTime": utc_time, "2_1.watts": 900 + tick % 50,
+                                         "2_1.volt": 230, "2_1.freq": 50, "2_1.current": 400,
+                                         "2_1.switchSta": 1}}
+                    for sn in sns
+                ]
+                self.run("sync", ecoflow.sync_smart_plug_data, devices)
+                if tick % 30 == 29:
+                    background.submit(self.run, "aggregate", ecoflow.smart_plug_data_aggregate_fleet, 300, sns)
+                if tick % 360 == 359:
+                    background.submit(self.run, "delete", delete_old_aggregated_data)
+                    background.submit(self.run, "push", ecoflow.push_smart_plug_data_to_prospect)
+
+        if use_writer_queue():
+            get_writer().flush()
+            if get_writer().failed:
+                self.stdout.write(f"❌ Telemetry writer gave up on {get_writer().failed} rows")
+        elapsed = time.perf_counter() - started
+
+        self.stdout.write(
+            f"\n{ticks} sync cycles x {len(sns)} plugs in {elapsed:.1f}s "
+            f"({ticks * len(sns) / elapsed:.0f} samples/s)"
+        )
+        for task, timings in self.timings.items():
+            self.stdout.write(
+                f"{task:>10}: runs={len(timings)} median={statistics.median(timings) * 1000:.1f}ms "
+                f"max={max(timings) * 1000:.1f}ms locked={self.errors.get(task, 0)}"
+            )
+
+    def run(self, task, func, *args):
+        close_old_connections()
+        start = time.perf_counter()
+        try:
+            func(*args)
+        except OperationalError as e:
+            if "locked" not in str(e):
+                raise
+            with self.lock:
+                self.errors[task] = self.errors.get(task, 0) + 1
+        finally:
+            with self.lock:
+                self.timings.setdefault(task, []).append(time.perf_counter() - start)
+            if threading.current_thread() is not threading.main_thread():
+                connection.close()
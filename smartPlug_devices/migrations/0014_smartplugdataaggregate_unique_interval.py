@@ -0,0 +1,35 @@
+# Generated by Django 4.2.23 on 2026-10-18 09:47
+
+from django.db import migrations, models
+
+
+def delete_duplicate_aggregates(apps, schema_editor):
+    # Keep the newest row for each (device, metered_at, interval_seconds).
+    SmartPlugDataAggregate = apps.get_model('smartPlug_devices', 'SmartPlugDataAggregate')
+    duplicates = (
+        SmartPlugDataAggregate.objects
+        .values('device', 'metered_at', 'interval_seconds')
+        .annotate(keep_id=models.Max('id'), rows=models.Count('id'))
+        .filter(rows__gt=1)
+    )
+    for group in duplicates:
+        SmartPlugDataAggregate.objects.filter(
+            device=group['device'],
+            metered_at=group['metered_at'],
+            interval_seconds=group['interval_seconds'],
+        ).exclude(id=group['keep_id']).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('smartPlug_devices', '0013_smartplugdataaggregate_is_pushed'),
+    ]
+
+    operations = [
+        migrations.RunPython(delete_duplicate_aggregates, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='smartplugdataaggregate',
+            constraint=models.UniqueConstraint(fields=('device', 'metered_at', 'interval_seconds'), name='unique_aggregate_interval'),
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 4.2.23 on 2026-10-18 09:49
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('smartPlug_devices', '0014_smartplugdataaggregate_unique_interval'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SmartPlugAggregationWatermark',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('interval_seconds', models.IntegerField()),
+                ('last_bin_at', models.DateTimeField()),
+                ('energy_lifetime_wh', models.FloatField(default=0.0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('device', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='aggregation_watermarks', to='smartPlug_devices.smartplug')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='smartplugaggregationwatermark',
+            constraint=models.UniqueConstraint(fields=('device', 'interval_seconds'), name='unique_aggregation_watermark'),
+        ),
+    ]
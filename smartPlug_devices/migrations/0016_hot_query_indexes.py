@@ -0,0 +1,25 @@
+# Generated by Django 4.2.23 on 2026-10-18 09:49
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('smartPlug_devices', '0015_smartplugaggregationwatermark'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='smartplugdata',
+            index=models.Index(condition=models.Q(('is_aggregated', False)), fields=['device', 'eatTime'], name='smartplugdata_unaggregated'),
+        ),
+        migrations.AddIndex(
+            model_name='smartplugdata',
+            index=models.Index(condition=models.Q(('is_aggregated', True)), fields=['eatTime'], name='smartplugdata_aggregated'),
+        ),
+        migrations.AddIndex(
+            model_name='smartplugdataaggregate',
+            index=models.Index(condition=models.Q(('is_pushed', False)), fields=['metered_at'], name='aggregate_unpushed'),
+        ),
+    ]
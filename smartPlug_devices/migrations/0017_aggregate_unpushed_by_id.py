@@ -0,0 +1,21 @@
+# Generated by Django 4.2.23 on 2026-10-18 09:51
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('smartPlug_devices', '0016_hot_query_indexes'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='smartplugdataaggregate',
+            name='aggregate_unpushed',
+        ),
+        migrations.AddIndex(
+            model_name='smartplugdataaggregate',
+            index=models.Index(condition=models.Q(('is_pushed', False)), fields=['id'], name='aggregate_unpushed'),
+        ),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 4.2.23 on 2026-10-18 09:51
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('smartPlug_devices', '0017_aggregate_unpushed_by_id'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SmartPlugLocation',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('country', models.CharField(blank=True, default='', max_length=100)),
+                ('town', models.CharField(blank=True, default='', max_length=100)),
+                ('timeZone', models.CharField(blank=True, default='', max_length=100)),
+            ],
+        ),
+        migrations.AlterField(
+            model_name='smartplugdata',
+            name='quota_data',
+            field=models.JSONField(blank=True, null=True),
+        ),
+        migrations.AddConstraint(
+            model_name='smartpluglocation',
+            constraint=models.UniqueConstraint(fields=('country', 'town', 'timeZone'), name='unique_smartplug_location'),
+        ),
+        migrations.AddField(
+            model_name='smartplugdata',
+            name='location',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='samples', to='smartPlug_devices.smartpluglocation'),
+        ),
+    ]
@@ -0,0 +1,75 @@
+from datetime import datetime, timezone
+
+from django.conf import settings
+from django.db import migrations
+
+TABLE = 'smartPlug_devices_smartplugdata'
+
+
+def partition_raw_table(apps, schema_editor):
+    """
+    Rebuild smartplugdata as a table partitioned by RANGE (fetched_at) on
+    PostgreSQL. Other backends keep the plain table, and TimescaleDB installs
+    partition it as a hypertable instead (migration 0020).
+    """
+    connection = schema_editor.connection
+    if connection.vendor != 'postgresql' or settings.SMARTPLUG_TIMESCALEDB:
+        return
+    from smartPlug_devices import partitions
+
+    quote = connection.ops.quote_name
+    legacy = f"{TABLE}_legacy"
+    with connection.cursor() as cursor:
+        # Capture secondary indexes and foreign keys so they keep Django's names
+        cursor.execute(
+            "SELECT indexdef FROM pg_indexes WHERE tablename = %s AND indexname NOT LIKE %s",
+            [TABLE, '%_pkey'],
+        )
+        index_defs = [row[0] for row in cursor.fetchall()]
+        cursor.execute(
+            "SELECT conname, pg_get_constraintdef(oid) FROM pg_constraint "
+            "WHERE conrelid = to_regclass(%s) AND contype = 'f'",
+            [quote(TABLE)],
+        )
+        foreign_keys = cursor.fetchall()
+        cursor.execute(f"SELECT min(fetched_at) FROM {quote(TABLE)}")
+        first = cursor.fetchone()[0]
+
+        cursor.execute(f"ALTER TABLE {quote(TABLE)} RENAME TO {quote(legacy)}")
+        cursor.execute(
+            f"CREATE TABLE {quote(TABLE)} (LIKE {quote(legacy)} INCLUDING DEFAULTS INCLUDING IDENTITY) "
+            "PARTITION BY RANGE (fetched_at)"
+        )
+        cursor.execute(
+            f"CREATE TABLE {quote(partitions.DEFAULT_PARTITION)} PARTITION OF {quote(TABLE)} DEFAULT"
+        )
+
+        now = datetime.now(timezone.utc)
+        partitions.create_partitions(first or now, now)
+        partitions.ensure_partitions(now)
+
+        cursor.execute(f"INSERT INTO {quote(TABLE)} SELECT * FROM {quote(legacy)}")
+        cursor.execute(f"DROP TABLE {quote(legacy)}")
+
+        # The partition key has to be part of the primary key
+        cursor.execute(f"ALTER TABLE {quote(TABLE)} ADD PRIMARY KEY (id, fetched_at)")
+
+        for index_def in index_defs:
+            cursor.execute(index_def)
+        for name, definition in foreign_keys:
+            cursor.execute(f"ALTER TABLE {quote(TABLE)} ADD CONSTRAINT {quote(name)} {definition}")
+        cursor.execute(
+            f"SELECT setval(pg_get_serial_sequence(%s, 'id'), coalesce(max(id), 0) + 1, false) FROM {quote(TABLE)}",
+            [quote(TABLE)],
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('smartPlug_devices', '0018_smartpluglocation_compact_storage'),
+    ]
+
+    operations = [
+        migrations.RunPython(partition_raw_table, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,45 @@
+from django.conf import settings
+from django.db import migrations
+
+TABLE = 'smartPlug_devices_smartplugdata'
+
+
+def create_hypertable(apps, schema_editor):
+    """
+    With SMARTPLUG_TIMESCALEDB on PostgreSQL, turn smartplugdata into a hypertable
+    chunked on fetched_at. The 5-minute aggregates stay with the Celery aggregation,
+    which applies the watermark and gap-fill rules.
+    """
+    connection = schema_editor.connection
+    if connection.vendor != 'postgresql' or not settings.SMARTPLUG_TIMESCALEDB:
+        return
+
+    quote = connection.ops.quote_name
+    with connection.cursor() as cursor:
+        cursor.execute("CREATE EXTENSION IF NOT EXISTS timescaledb")
+
+        # The time column has to be part of every unique index
+        cursor.execute(
+            "SELECT conname FROM pg_constraint WHERE conrelid = to_regclass(%s) AND contype = 'p'",
+            [quote(TABLE)],
+        )
+        primary_key = cursor.fetchone()[0]
+        cursor.execute(f"ALTER TABLE {quote(TABLE)} DROP CONSTRAINT {quote(primary_key)}")
+        cursor.execute(f"ALTER TABLE {quote(TABLE)} ADD PRIMARY KEY (id, fetched_at)")
+
+        cursor.execute(
+            "SELECT create_hypertable(%s, 'fetched_at', chunk_time_interval => %s * INTERVAL '1 hour', "
+            "migrate_data => true)",
+            [quote(TABLE), settings.SMARTPLUG_PARTITION_HOURS],
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('smartPlug_devices', '0019_partition_smartplugdata'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_hypertable, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 4.2.23 on 2026-10-18 10:13
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('smartPlug_devices', '0020_timescaledb_hypertable'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SmartPlugDataRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('period', models.CharField(choices=[('hour', 'Hourly'), ('day', 'Daily'), ('month', 'Monthly')], max_length=5)),
+                ('period_start', models.DateTimeField()),
+                ('energy_wh', models.FloatField(blank=True, null=True)),
+                ('energy_lifetime_wh', models.FloatField(blank=True, null=True)),
+                ('power_mean_w', models.FloatField(blank=True, null=True)),
+                ('power_min_w', models.FloatField(blank=True, null=True)),
+                ('power_max_w', models.FloatField(blank=True, null=True)),
+                ('intervals', models.IntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('device', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='rollups', to='smartPlug_devices.smartplug')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='smartplugdatarollup',
+            constraint=models.UniqueConstraint(fields=('device', 'period', 'period_start'), name='unique_rollup_period'),
+        ),
+    ]
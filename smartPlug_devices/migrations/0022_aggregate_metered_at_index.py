@@ -0,0 +1,17 @@
+# Generated by Django 4.2.23 on 2026-10-18 10:26
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('smartPlug_devices', '0021_smartplugdatarollup'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='smartplugdataaggregate',
+            index=models.Index(fields=['metered_at'], name='aggregate_metered_at'),
+        ),
+    ]
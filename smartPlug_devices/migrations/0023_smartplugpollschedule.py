@@ -0,0 +1,25 @@
+# Generated by Django 4.2.23 on 2026-10-18 10:29
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('smartPlug_devices', '0022_aggregate_metered_at_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SmartPlugPollSchedule',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('next_poll_at', models.DateTimeField()),
+                ('interval_seconds', models.FloatField()),
+                ('last_watts', models.FloatField(blank=True, null=True)),
+                ('last_polled_at', models.DateTimeField(blank=True, null=True)),
+                ('device', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='poll_schedule', to='smartPlug_devices.smartplug')),
+            ],
+        ),
+    ]
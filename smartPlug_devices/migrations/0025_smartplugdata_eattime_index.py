@@ -0,0 +1,17 @@
+# Generated by Django 4.2.23 on 2026-10-18 10:46
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('smartPlug_devices', '0024_smartplugtasklock'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='smartplugdata',
+            index=models.Index(fields=['eatTime'], name='smartplugdata_eattime'),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 4.2.23 on 2026-10-18 11:38
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('smartPlug_devices', '0025_smartplugdata_eattime_index'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='smartplugdata',
+            name='smartplugdata_aggregated',
+        ),
+    ]
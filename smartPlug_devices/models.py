@@ -15,6 +15,21 @@ class SmartPlug(models.Model):
         return f"{self.name} ({self.sn})"
 
 
+class SmartPlugLocation(models.Model):
+    """Interned country/town/time zone shared by compact SmartPlugData rows."""
+    country = models.CharField(max_length=100, blank=True, default='')
+    town = models.CharField(max_length=100, blank=True, default='')
+    timeZone = models.CharField(max_length=100, blank=True, default='')
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['country', 'town', 'timeZone'], name='unique_smartplug_location'),
+        ]
+
+    def __str__(self):
+        return f"{self.town}, {self.country} ({self.timeZone})"
+
+
 class SmartPlugData(models.Model):
     device = models.ForeignKey(SmartPlug, on_delete=models.CASCADE, related_name='quotas')
     serial_number = models.CharField(max_length=100, null=False, blank=False)
@@ -32,10 +47,24 @@ class SmartPlugData(models.Model):
     current= models.FloatField(null=True, blank=True) 
     current_calculated= models.FloatField(null=True, blank=True) #raw current
     watts = models.FloatField(null=True, blank=True)
-    quota_data = models.JSONField()
+    location = models.ForeignKey(SmartPlugLocation, on_delete=models.SET_NULL, null=True, blank=True, related_name='samples')
+    quota_data = models.JSONField(null=True, blank=True)  # empty in compact storage mode
     fetched_at = models.DateTimeField(auto_now_add=True)
     is_aggregated = models.BooleanField(default=False)
 
+    class Meta:
+        indexes = [
+            # Aggregation scan: unaggregated rows per device in time order
+            models.Index(
+                fields=['device', 'eatTime'],
+                name='smartplugdata_unaggregated',
+                condition=models.Q(is_aggregated=False),
+            ),
+            # Admin date hierarchy (min/max and range drill-down across devices)
+            # and the hourly retention delete of aggregated rows by eatTime
+            models.Index(fields=['eatTime'], name='smartplugdata_eattime'),
+        ]
+
     def save(self, *args, **kwargs):
         if not self.device:
             raise ValueError("Device must be set to inherit serial_number.")
@@ -80,6 +109,26 @@ class SmartPlugDataAggregate(models.Model):
 
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['device', 'metered_at', 'interval_seconds'],
+                name='unique_aggregate_interval',
+            ),
+        ]
+        # Latest aggregate per device is served by the unique constraint's
+        # (device, metered_at, ...) index.
+        indexes = [
+            # Prospect push: unpushed rows in primary-key order
+            models.Index(
+                fields=['id'],
+                name='aggregate_unpushed',
+                condition=models.Q(is_pushed=False),
+            ),
+            # Admin date hierarchy (min/max and range drill-down across devices)
+            models.Index(fields=['metered_at'], name='aggregate_metered_at'),
+        ]
+
     def save(self, *args, **kwargs):
         if not self.device:
             raise ValueError("Device must be set to inherit serial_number.")
@@ -91,3 +140,71 @@ class SmartPlugDataAggregate(models.Model):
     def __str__(self):
         return f"Aggregated data for {self.device} at {self.metered_at}"
 
+
+class SmartPlugAggregationWatermark(models.Model):
+    """Last fully closed aggregation bin per device and interval, with the lifetime energy at that bin."""
+    device = models.ForeignKey(SmartPlug, on_delete=models.CASCADE, related_name='aggregation_watermarks')
+    interval_seconds = models.IntegerField()
+    last_bin_at = models.DateTimeField()
+    energy_lifetime_wh = models.FloatField(default=0.0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['device', 'interval_seconds'],
+                name='unique_aggregation_watermark',
+            ),
+        ]
+
+    def __str__(self):
+        return f"Aggregated {self.device} up to {self.last_bin_at} ({self.interval_seconds}s)"
+
+
+class SmartPlugDataRollup(models.Model):
+    """Hourly, daily and monthly energy/power rollups cascaded from the 5-minute aggregates."""
+    HOUR = 'hour'
+    DAY = 'day'
+    MONTH = 'month'
+    PERIOD_CHOICES = [(HOUR, 'Hourly'), (DAY, 'Daily'), (MONTH, 'Monthly')]
+
+    device = models.ForeignKey(SmartPlug, on_delete=models.CASCADE, related_name='rollups')
+    period = models.CharField(max_length=5, choices=PERIOD_CHOICES)
+    period_start = models.DateTimeField()
+    energy_wh = models.FloatField(null=True, blank=True)
+    energy_lifetime_wh = models.FloatField(null=True, blank=True)  # at the end of the period
+    power_mean_w = models.FloatField(null=True, blank=True)
+    power_min_w = models.FloatField(null=True, blank=True)
+    power_max_w = models.FloatField(null=True, blank=True)
+    intervals = models.IntegerField(default=0)  # 5-minute aggregates covered
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['device', 'period', 'period_start'], name='unique_rollup_period'),
+        ]
+
+    def __str__(self):
+        return f"{self.get_period_display()} rollup for {self.device} at {self.period_start}"
+
+
+class SmartPlugPollSchedule(models.Model):
+    """Adaptive polling state per plug: when to poll it next and at what interval (see scheduler.py)."""
+    device = models.OneToOneField(SmartPlug, on_delete=models.CASCADE, related_name='poll_schedule')
+    next_poll_at = models.DateTimeField()
+    interval_seconds = models.FloatField()
+    last_watts = models.FloatField(null=True, blank=True)
+    last_polled_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"Poll {self.device} every {self.interval_seconds:.0f}s, next at {self.next_poll_at}"
+
+
+class SmartPlugTaskLock(models.Model):
+    """Cross-process lock for one shard of a fleet task (see sharding.shard_lock)."""
+    name = models.CharField(max_length=100, unique=True)
+    token = models.CharField(max_length=32)
+    expires_at = models.DateTimeField()
+
+    def __str__(self):
+        return f"{self.name} locked until {self.expires_at}"
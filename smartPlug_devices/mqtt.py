@@ -0,0 +1,153 @@
+"""
+Push-based telemetry ingestion from the EcoFlow open-platform MQTT broker.
+
+The broker publishes quota updates per device on /open/<account>/<sn>/quota.
+Updates only carry the fields that changed, so QuotaStream keeps the last known
+quota document per plug, merges each update into it and turns it into a regular
+SmartPlugData row with build_smart_plug_data(). Rows are written in micro-batches
+through write_smart_plug_data(), the same path the polling task uses.
+
+Pushed samples are irregular, so set SMARTPLUG_MQTT_INGEST for the aggregation to
+time-weight them like deadband samples.
+"""
+import json
+import threading
+import time
+from django.conf import settings
+from smartPlug_devices.ecoflow import QUOTA_FIELDS, build_smart_plug_data, get_client, write_smart_plug_data
+from smartPlug_devices.models import SmartPlug
+
+QUOTA_TOPIC_SUFFIX = "quota"
+
+
+def get_mqtt_certification():
+    """Fetch broker credentials: {certificateAccount, certificatePassword, url, port, protocol}."""
+    data = get_client().get("/iot-open/sign/certification")
+    if data.get("code") != "0":
+        raise Exception(f"API Error: {data.get('message')} (Code: {data.get('code')})")
+    return data.get("data", {})
+
+
+def quota_topic(prefix, sn="+"):
+    return f"{prefix.rstrip('/')}/{sn}/{QUOTA_TOPIC_SUFFIX}"
+
+
+def sn_from_topic(topic):
+    """/open/<account>/<sn>/quota -> <sn>"""
+    parts = topic.rstrip('/').split('/')
+    if len(parts) < 2 or parts[-1] != QUOTA_TOPIC_SUFFIX:
+        return None
+    return parts[-2]
+
+
+def parse_quota_message(payload):
+    """
+    Normalise one MQTT payload to quota/all style keys. Updates arrive either as
+    {"params": {"2_1.watts": ...}} or as {"cmdFunc": 2, "cmdId": 1, "param": {"watts": ...}};
+    the latter are prefixed with "<cmdFunc>_<cmdId>." so the usual extractor reads them.
+    Returns (quota dict, message timestamp in seconds or None).
+    """
+    message = json.loads(payload)
+    if not isinstance(message, dict):
+        return {}, None
+    if isinstance(message.get("params"), dict):
+        quota = dict(message["params"])
+    elif isinstance(message.get("param"), dict):
+        prefix = f"{message.get('cmdFunc', 2)}_{message.get('cmdId', 1)}."
+        quota = {key if "." in key else prefix + key: value for key, value in message["param"].items()}
+    else:
+        quota = {}
+    timestamp = message.get("timestamp")
+    if isinstance(timestamp, (int, float)) and timestamp > 1e12:  # milliseconds
+        timestamp = timestamp / 1000
+    return quota, timestamp
+
+
+class QuotaStream:
+    """
+    Thread-safe buffer between the MQTT network thread and the database writer.
+    At most one sample per plug is kept per SMARTPLUG_MQTT_MIN_SAMPLE_SECONDS;
+    newer updates within that window replace the pending one.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.state = {}    # sn -> merged quota document
+        self.pending = {}  # sn -> quota snapshot waiting to be written
+        self.last_sample = {}
+        self.plugs = {}
+        self.received = 0
+        self.written = 0
+
+    def on_message(self, topic, payload):
+        sn = sn_from_topic(topic)
+        if not sn:
+            return
+        try:
+            update, timestamp = parse_quota_message(payload)
+        except (ValueError, UnicodeDecodeError):
+            print(f"⚠️ Ignoring malformed MQTT payload on {topic}")
+            return
+        if not update:
+            return
+        with self.lock:
+            self.received += 1
+            quota = self.state.setdefault(sn, {})
+            quota.update(update)
+            if QUOTA_FIELDS['utcTime'] not in update:
+                quota[QUOTA_FIELDS['utcTime']] = int(timestamp or time.time())
+            self.pending[sn] = dict(quota)
+
+    def drain(self, force=False):
+        """Take the samples that are due, leaving ones still inside their plug's minimum interval."""
+        now = time.monotonic()
+        min_interval = 0 if force else settings.SMARTPLUG_MQTT_MIN_SAMPLE_SECONDS
+        with self.lock:
+            due = {
+                sn: quota for sn, quota in self.pending.items()
+                if now - self.last_sample.get(sn, 0) >= min_interval
+            }
+            for sn in due:
+                del self.pending[sn]
+                self.last_sample[sn] = now
+        return due
+
+    def requeue(self, due):
+        """Put drained samples back after a failed write; newer pending updates win."""
+        with self.lock:
+            for sn, quota in due.items():
+                self.pending.setdefault(sn, quota)
+                self.last_sample.pop(sn, None)
+
+    def _requeue_failed(self, due, rows):
+        with self.lock:
+            self.written -= len(rows)
+        self.requeue({row.serial_number: due[row.serial_number] for row in rows})
+
+    def flush(self, force=False):
+        """
+        Write the due samples (all pending ones if `force`) as one micro-batch. Returns the rows written.
+        If the write fails the samples are requeued for the next flush and the error is re-raised;
+        with the SQLite writer queue the rows it gives up on are requeued from the writer thread.
+        """
+        due = self.drain(force)
+        if not due:
+            return 0
+        try:
+            unknown = [sn for sn in due if sn not in self.plugs]
+            if unknown:
+                self.plugs.update(SmartPlug.objects.in_bulk(unknown, field_name='sn'))
+            rows = []
+            for sn, quota in due.items():
+                plug = self.plugs.get(sn)
+                if plug is None:
+                    print(f"SmartPlug with SN {sn} not found; skipping MQTT sample.")
+                    continue
+                rows.append(build_smart_plug_data(plug, quota))
+            if rows:
+                write_smart_plug_data(rows, on_error=lambda failed: self._requeue_failed(due, failed))
+        except Exception:
+            self.requeue(due)
+            raise
+        self.written += len(rows)
+        return len(rows)
@@ -0,0 +1,152 @@
+"""
+Time-range partitioning of the raw SmartPlugData table.
+
+On PostgreSQL the table is declaratively partitioned by RANGE (fetched_at) into
+SMARTPLUG_PARTITION_HOURS-wide partitions plus a DEFAULT partition, so retention
+drops whole partitions instead of deleting rows. A partition only goes once all of
+it is past the cutoff, so raw rows live for up to SMARTPLUG_RAW_RETENTION_HOURS +
+SMARTPLUG_PARTITION_HOURS (about 26h with the defaults), not the retention alone. With SMARTPLUG_TIMESCALEDB the
+table is a hypertable and retention drops chunks. SQLite has no partitioning;
+there retention falls back to a batched row delete.
+"""
+import re
+from datetime import datetime, timedelta, timezone
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Min
+from smartPlug_devices.models import SmartPlugData
+
+TABLE = SmartPlugData._meta.db_table
+DEFAULT_PARTITION = f"{TABLE}_default"
+PARTITION_NAME_FORMAT = f"{TABLE}_p%Y%m%d%H"
+# FOR VALUES FROM ('2025-08-04 00:00:00+00') TO ('2025-08-05 00:00:00+00')
+BOUND_PATTERN = re.compile(r"'([^']+)'")
+
+
+def _parse_bound(value):
+    return datetime.fromisoformat(value).astimezone(timezone.utc)
+
+
+def _quote(name):
+    return connection.ops.quote_name(name)
+
+
+def is_partitioned():
+    if connection.vendor != 'postgresql':
+        return False
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass(%s)", [_quote(TABLE)]
+        )
+        return cursor.fetchone() is not None
+
+
+def is_hypertable():
+    if connection.vendor != 'postgresql' or not settings.SMARTPLUG_TIMESCALEDB:
+        return False
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT 1 FROM timescaledb_information.hypertables WHERE hypertable_name = %s", [TABLE]
+        )
+        return cursor.fetchone() is not None
+
+
+def drop_expired_chunks(cutoff):
+    """Drop hypertable chunks older than `cutoff`, never past the oldest unaggregated row."""
+    oldest_pending = SmartPlugData.objects.filter(is_aggregated=False).aggregate(
+        oldest=Min('fetched_at')
+    )['oldest']
+    if oldest_pending is not None:
+        cutoff = min(cutoff, oldest_pending)
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT drop_chunks(%s, older_than => %s)", [_quote(TABLE), cutoff])
+        return [row[0] for row in cursor.fetchall()]
+
+
+def _partition_start(moment):
+    hours = settings.SMARTPLUG_PARTITION_HOURS
+    moment = moment.astimezone(timezone.utc)
+    epoch_hours = int(moment.timestamp() // 3600)
+    return datetime.fromtimestamp((epoch_hours - epoch_hours % hours) * 3600, tz=timezone.utc)
+
+
+def _partition_bounds(cursor):
+    """Return {partition name: (start, end)} for the range partitions of the raw table."""
+    cursor.execute(
+        """
+        SELECT child.relname, pg_get_expr(child.relpartbound, child.oid)
+        FROM pg_inherits
+        JOIN pg_class child ON child.oid = pg_inherits.inhrelid
+        WHERE pg_inherits.inhparent = to_regclass(%s) AND child.relname <> %s
+        """,
+        [_quote(TABLE), DEFAULT_PARTITION],
+    )
+    bounds = {}
+    for name, expression in cursor.fetchall():
+        start, end = BOUND_PATTERN.findall(expression)
+        bounds[name] = (_parse_bound(start), _parse_bound(end))
+    return bounds
+
+
+def create_partitions(start, end):
+    """Create every missing range partition covering [start, end)."""
+    step = timedelta(hours=settings.SMARTPLUG_PARTITION_HOURS)
+    created = []
+    with connection.cursor() as cursor:
+        existing = _partition_bounds(cursor)
+        moment = _partition_start(start)
+        while moment < end:
+            name = moment.strftime(PARTITION_NAME_FORMAT)
+            if name not in existing:
+                cursor.execute(
+                    f"CREATE TABLE IF NOT EXISTS {_quote(name)} PARTITION OF {_quote(TABLE)} "
+                    "FOR VALUES FROM (%s) TO (%s)",
+                    [moment, moment + step],
+                )
+                created.append(name)
+            moment += step
+    return created
+
+
+def ensure_partitions(now=None):
+    """Keep partitions ready for the next SMARTPLUG_PARTITION_AHEAD_HOURS of ingestion."""
+    now = now or datetime.now(timezone.utc)
+    return create_partitions(now, now + timedelta(hours=settings.SMARTPLUG_PARTITION_AHEAD_HOURS))
+
+
+def drop_expired_partitions(cutoff):
+    """
+    Drop range partitions that end before `cutoff` and hold no unaggregated rows,
+    then clear expired aggregated rows that landed in the DEFAULT partition.
+    Rows in the partition straddling `cutoff` stay until the whole partition expires.
+    Returns the names of the dropped partitions.
+    """
+    dropped = []
+    with connection.cursor() as cursor:
+        for name, (_, end) in sorted(_partition_bounds(cursor).items()):
+            if end > cutoff:
+                continue
+            cursor.execute(f"SELECT EXISTS (SELECT 1 FROM {_quote(name)} WHERE NOT is_aggregated)")
+            if cursor.fetchone()[0]:
+                continue
+            with transaction.atomic():
+                cursor.execute(f"ALTER TABLE {_quote(TABLE)} DETACH PARTITION {_quote(name)}")
+                cursor.execute(f"DROP TABLE {_quote(name)}")
+            dropped.append(name)
+
+        cursor.execute(
+            f'DELETE FROM {_quote(DEFAULT_PARTITION)} WHERE is_aggregated AND "eatTime" < %s', [cutoff]
+        )
+    return dropped
+
+
+def delete_expired_rows(cutoff, batch_size=None):
+    """Delete aggregated rows older than `cutoff` in short id-batched transactions."""
+    batch_size = batch_size or settings.SMARTPLUG_RETENTION_BATCH_SIZE
+    expired = SmartPlugData.objects.filter(is_aggregated=True, eatTime__lt=cutoff)
+    deleted = 0
+    while True:
+        ids = list(expired.values_list('id', flat=True)[:batch_size])
+        if not ids:
+            return deleted
+        deleted += SmartPlugData.objects.filter(id__in=ids).delete()[0]
@@ -0,0 +1,242 @@
+"""
+Rate limiting and circuit breaking for signed EcoFlow requests.
+
+TokenBucket holds ECOFLOW_RATE_LIMIT_BURST tokens refilled at
+ECOFLOW_RATE_LIMIT_PER_SECOND. With the Redis cache (CACHE_URL) the bucket is a
+single Lua-updated hash shared by every worker; otherwise it is per process.
+
+CircuitBreaker counts successes and failures per ECOFLOW_BREAKER_WINDOW_SECONDS
+window in the cache. Once a window has at least ECOFLOW_BREAKER_MIN_CALLS calls
+and an error rate of ECOFLOW_BREAKER_ERROR_RATE, the circuit opens and requests
+fail fast for ECOFLOW_BREAKER_COOLDOWN_SECONDS. After that a single probe is let
+through: success closes the circuit, failure opens it again.
+
+Both record counters under ecoflow:metrics:*, read back by get_metrics().
+"""
+import threading
+import time
+from django.conf import settings
+from django.core import checks
+from django.core.cache import cache, caches
+from django.core.cache.backends.redis import RedisCache
+
+METRICS_PREFIX = "ecoflow:metrics:"
+METRIC_NAMES = [
+    "tokens_granted", "waits", "wait_ms", "wait_timeouts",
+    "calls_succeeded", "calls_failed", "breaker_trips", "breaker_rejected",
+]
+
+# KEYS[1] bucket hash; ARGV: rate/s, capacity, now (s), requested tokens.
+# Returns 0 when granted, otherwise the milliseconds until enough tokens refill.
+TOKEN_BUCKET_LUA = """
+local tokens = tonumber(redis.call('HGET', KEYS[1], 'tokens'))
+local updated = tonumber(redis.call('HGET', KEYS[1], 'updated'))
+local rate, capacity, now, requested = tonumber(ARGV[1]), tonumber(ARGV[2]), tonumber(ARGV[3]), tonumber(ARGV[4])
+if tokens == nil then tokens = capacity; updated = now end
+tokens = math.min(capacity, tokens + math.max(0, now - updated) * rate)
+local wait = 0
+if tokens >= requested then
+    tokens = tokens - requested
+else
+    wait = math.ceil((requested - tokens) / rate * 1000)
+end
+redis.call('HSET', KEYS[1], 'tokens', tokens, 'updated', now)
+redis.call('EXPIRE', KEYS[1], math.ceil(capacity / rate) + 60)
+return wait
+"""
+
+
+class RateLimitTimeout(Exception):
+    """No token became available within ECOFLOW_RATE_LIMIT_MAX_WAIT."""
+
+
+class CircuitOpenError(Exception):
+    """The EcoFlow circuit is open; the request was not sent."""
+
+
+def tick_capacity():
+    """Calls the limiter can grant within one SMARTPLUG_POLL_SECONDS tick."""
+    return settings.ECOFLOW_RATE_LIMIT_PER_SECOND * settings.SMARTPLUG_POLL_SECONDS
+
+
+@checks.register()
+def check_poll_budget(app_configs, **kwargs):
+    """Warn when adaptive polling may spend more quota calls than the limiter grants."""
+    budget = settings.SMARTPLUG_POLL_BUDGET_PER_MINUTE
+    if settings.SMARTPLUG_ADAPTIVE_POLLING and settings.ECOFLOW_RATE_LIMIT_PER_SECOND * 60 < budget:
+        return [checks.Warning(
+            f"ECOFLOW_RATE_LIMIT_PER_SECOND={settings.ECOFLOW_RATE_LIMIT_PER_SECOND} grants fewer than the "
+            f"{budget} quota calls per minute of SMARTPLUG_POLL_BUDGET_PER_MINUTE.",
+            hint="Raise the rate limit or lower the poll budget; calls over the limit are deferred.",
+            id='smartPlug_devices.W001',
+        )]
+    return []
+
+
+def _incr(name, delta=1):
+    key = METRICS_PREFIX + name
+    try:
+        cache.incr(key, delta)
+    except ValueError:
+        # First increment: add() keeps a concurrent creator's value
+        if not cache.add(key, delta, None):
+            cache.incr(key, delta)
+
+
+def get_metrics():
+    """Counters plus the current bucket level and circuit state."""
+    values = cache.get_many([METRICS_PREFIX + name for name in METRIC_NAMES])
+    metrics = {name: values.get(METRICS_PREFIX + name, 0) for name in METRIC_NAMES}
+    metrics["tokens_available"] = get_limiter().available()
+    metrics["breaker_state"] = get_breaker().state()
+    return metrics
+
+
+def _redis_client(backend, key, write=False):
+    """
+    redis-py client behind a Django RedisCache backend, for commands the cache API
+    lacks (scripts, hashes). Django has no public accessor; this is the backend's
+    RedisCacheClient.get_client, which picks the primary/replica pool for `key`.
+    """
+    return backend._cache.get_client(key, write=write)
+
+
+class TokenBucket:
+    def __init__(self, key="ecoflow:ratelimit", rate=None, capacity=None):
+        self.key = key
+        self.rate = float(rate or settings.ECOFLOW_RATE_LIMIT_PER_SECOND)
+        self.capacity = float(capacity or settings.ECOFLOW_RATE_LIMIT_BURST)
+        self.lock = threading.Lock()
+        self.tokens = self.capacity
+        self.updated = time.time()
+        # django.core.cache.cache is a proxy; the configured backend decides sharing
+        self.backend = caches['default']
+        self.redis = isinstance(self.backend, RedisCache)
+        self.script = None
+
+    def _take_redis(self, requested):
+        key = self.backend.make_and_validate_key(self.key)
+        client = _redis_client(self.backend, key, write=True)
+        if self.script is None:
+            self.script = client.register_script(TOKEN_BUCKET_LUA)
+        return int(self.script(keys=[key], args=[self.rate, self.capacity, time.time(), requested], client=client)) / 1000
+
+    def _take_local(self, requested):
+        with self.lock:
+            now = time.time()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= requested:
+                self.tokens -= requested
+                return 0
+            return (requested - self.tokens) / self.rate
+
+    def try_acquire(self, tokens=1):
+        """Take `tokens` if available; otherwise return the seconds to wait before retrying."""
+        return self._take_redis(tokens) if self.redis else self._take_local(tokens)
+
+    def acquire(self, tokens=1, max_wait=None):
+        """Block until `tokens` are granted, or raise RateLimitTimeout after `max_wait` seconds."""
+        max_wait = settings.ECOFLOW_RATE_LIMIT_MAX_WAIT if max_wait is None else max_wait
+        deadline = time.monotonic() + max_wait
+        waited = 0.0
+        while True:
+            wait = self.try_acquire(tokens)
+            if not wait:
+                _incr("tokens_granted", tokens)
+                if waited:
+                    _incr("waits")
+                    _incr("wait_ms", int(waited * 1000))
+                return waited
+            if time.monotonic() + wait > deadline:
+                _incr("wait_timeouts")
+                raise RateLimitTimeout(f"EcoFlow rate limit: no token within {max_wait}s")
+            time.sleep(wait)
+            waited += wait
+
+    def available(self):
+        if not self.redis:
+            with self.lock:
+                return round(min(self.capacity, self.tokens + (time.time() - self.updated) * self.rate), 2)
+        key = self.backend.make_and_validate_key(self.key)
+        tokens, updated = _redis_client(self.backend, key).hmget(key, 'tokens', 'updated')
+        if tokens is None:
+            return self.capacity
+        return round(min(self.capacity, float(tokens) + (time.time() - float(updated)) * self.rate), 2)
+
+
+class CircuitBreaker:
+    CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+    def __init__(self, key="ecoflow:breaker"):
+        self.key = key
+
+    def _window_keys(self):
+        window = int(time.time() // settings.ECOFLOW_BREAKER_WINDOW_SECONDS)
+        return f"{self.key}:{window}:ok", f"{self.key}:{window}:error"
+
+    def state(self):
+        opened_until = cache.get(f"{self.key}:open_until")
+        if opened_until is None:
+            return self.CLOSED
+        return self.OPEN if time.time() < opened_until else self.HALF_OPEN
+
+    def before_call(self):
+        """Raise CircuitOpenError unless the call may go out (closed, or the single half-open probe)."""
+        state = self.state()
+        if state == self.CLOSED:
+            return
+        if state == self.HALF_OPEN and cache.add(f"{self.key}:probe", 1, settings.ECOFLOW_REQUEST_TIMEOUT * 2):
+            return
+        _incr("breaker_rejected")
+        raise CircuitOpenError("EcoFlow circuit open; shedding load")
+
+    def _count(self, key):
+        if not cache.add(key, 1, settings.ECOFLOW_BREAKER_WINDOW_SECONDS * 2):
+            return cache.incr(key)
+        return 1
+
+    def record_success(self):
+        _incr("calls_succeeded")
+        self._count(self._window_keys()[0])
+        if cache.get(f"{self.key}:open_until") is not None:
+            cache.delete_many([f"{self.key}:open_until", f"{self.key}:probe"])
+
+    def record_failure(self):
+        _incr("calls_failed")
+        ok_key, error_key = self._window_keys()
+        errors = self._count(error_key)
+        if self.state() == self.HALF_OPEN:
+            return self._trip()
+        calls = errors + (cache.get(ok_key) or 0)
+        if (calls >= settings.ECOFLOW_BREAKER_MIN_CALLS
+                and errors / calls >= settings.ECOFLOW_BREAKER_ERROR_RATE
+                and self.state() == self.CLOSED):
+            self._trip()
+
+    def _trip(self):
+        _incr("breaker_trips")
+        cooldown = settings.ECOFLOW_BREAKER_COOLDOWN_SECONDS
+        # Kept past the cooldown so the half-open state is visible until a probe resolves it
+        cache.set(f"{self.key}:open_until", time.time() + cooldown, cooldown * 10)
+        cache.delete(f"{self.key}:probe")
+        ok_key, error_key = self._window_keys()
+        cache.delete_many([ok_key, error_key])
+
+
+_limiter = None
+_breaker = None
+
+
+def get_limiter():
+    global _limiter
+    if _limiter is None:
+        _limiter = TokenBucket()
+    return _limiter
+
+
+def get_breaker():
+    global _breaker
+    if _breaker is None:
+        _breaker = CircuitBreaker()
+    return _breaker
@@ -0,0 +1,301 @@
+"""
+Rollup cascade for billing and reporting queries.
+
+Hourly rollups are derived from the 5-minute SmartPlugDataAggregate rows, daily
+rollups from the hourly ones and monthly rollups from the daily ones. Each level
+resumes from the start of its latest (possibly still open) period per device, so
+a run only reads the source rows of the periods it recomputes.
+
+Reads go through the coarsest resolution that fits: rollup_series() picks one
+resolution aligned to both ends of the range, energy_between() (/api/energy)
+splits an arbitrary range into months, days, hours and 5-minute edges, and
+period_for_points() picks the resolution /api/aggregates downsamples from.
+"""
+from collections import defaultdict
+from datetime import timedelta
+import numpy as np
+import pandas as pd
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Max, Q
+from smartPlug_devices.models import SmartPlug, SmartPlugDataAggregate, SmartPlugDataRollup
+
+SOURCE_INTERVAL_SECONDS = 300
+
+# (period, source period); None is the 5-minute aggregate table
+CASCADE = [
+    (SmartPlugDataRollup.HOUR, None),
+    (SmartPlugDataRollup.DAY, SmartPlugDataRollup.HOUR),
+    (SmartPlugDataRollup.MONTH, SmartPlugDataRollup.DAY),
+]
+PERIOD_FREQ = {
+    SmartPlugDataRollup.HOUR: 'h',
+    SmartPlugDataRollup.DAY: 'D',
+    SmartPlugDataRollup.MONTH: 'M',
+}
+# Added to a period start, always lands inside the next period (DST and month lengths included)
+PERIOD_STEP = {
+    SmartPlugDataRollup.HOUR: timedelta(hours=1),
+    SmartPlugDataRollup.DAY: timedelta(hours=25),
+    SmartPlugDataRollup.MONTH: timedelta(days=32),
+}
+# Nominal lengths, for sizing a range in periods
+PERIOD_SECONDS = {
+    SmartPlugDataRollup.HOUR: 3600,
+    SmartPlugDataRollup.DAY: 86400,
+    SmartPlugDataRollup.MONTH: 365.25 / 12 * 86400,
+}
+COARSEST_FIRST = [SmartPlugDataRollup.MONTH, SmartPlugDataRollup.DAY, SmartPlugDataRollup.HOUR]
+ROLLUP_COLUMNS = [
+    'device_id', 'period_start', 'energy_wh', 'power_mean_w', 'power_min_w',
+    'power_max_w', 'energy_lifetime_wh', 'intervals',
+]
+ROLLUP_UPDATE_FIELDS = [
+    'energy_wh', 'energy_lifetime_wh', 'power_mean_w', 'power_min_w', 'power_max_w',
+    'intervals', 'updated_at',
+]
+
+
+def period_starts(timestamps, period):
+    """Floor UTC timestamps to the start of their period in SMARTPLUG_ROLLUP_TIME_ZONE (returned in UTC)."""
+    tz = settings.SMARTPLUG_ROLLUP_TIME_ZONE
+    local = pd.to_datetime(pd.Series(timestamps), utc=True).dt.tz_convert(tz).dt.tz_localize(None)
+    starts = local.dt.to_period(PERIOD_FREQ[period]).dt.start_time
+    return starts.dt.tz_localize(
+        tz, ambiguous=np.zeros(len(starts), dtype=bool), nonexistent='shift_forward'
+    ).dt.tz_convert('UTC')
+
+
+def period_floor(moment, period):
+    return period_starts([moment], period).iloc[0].to_pydatetime()
+
+
+def period_ceil(moment, period):
+    floor = period_floor(moment, period)
+    if floor == moment:
+        return floor
+    return period_floor(floor + PERIOD_STEP[period], period)
+
+
+def _source_queryset(source):
+    """Return (rows, time field) for the level below, with rollup column names."""
+    if source is None:
+        rows = SmartPlugDataAggregate.objects.filter(interval_seconds=SOURCE_INTERVAL_SECONDS).annotate(
+            start=F('metered_at'),
+            energy=F('energy_interval_wh'),
+            power_mean=F('power_w'),
+            power_min=F('power_w'),
+            power_max=F('power_w'),
+        ).values_list('device_id', 'start', 'energy', 'power_mean', 'power_min', 'power_max',
+                      'energy_lifetime_wh')
+        return rows, 'metered_at'
+    rows = SmartPlugDataRollup.objects.filter(period=source).values_list(*ROLLUP_COLUMNS)
+    return rows, 'period_start'
+
+
+def _pending_filter(period, time_field, device_ids=None):
+    """
+    Select the source rows of every period that still has to be (re)computed:
+    from the start of each device's latest rollup onwards, or everything for
+    devices without one. Devices sharing a resume point share one condition,
+    selected by subquery so the SQL does not grow with the fleet.
+    """
+    latest = SmartPlugDataRollup.objects.filter(period=period)
+    if device_ids is not None:
+        latest = latest.filter(device_id__in=device_ids)
+    per_device = latest.values('device_id').annotate(last_start=Max('period_start'))
+
+    condition = ~Q(device_id__in=latest.values('device_id'))
+    for last_start in per_device.values_list('last_start', flat=True).distinct():
+        resumed = per_device.filter(last_start=last_start).values('device_id')
+        condition |= Q(device_id__in=resumed, **{f'{time_field}__gte': last_start})
+    if device_ids is not None:
+        condition &= Q(device_id__in=device_ids)
+    return condition
+
+
+def _values(frame, name, decimals=2):
+    values = pd.to_numeric(frame[name]).round(decimals)
+    return values.astype(object).where(values.notna(), None).tolist()
+
+
+def _combine(df, keys):
+    """
+    Merge consecutive rows grouped by `keys`: energy summed, min/max power kept,
+    mean power weighted by the 5-minute intervals behind each row, lifetime
+    energy taken from the last row.
+    """
+    numeric = ['energy_wh', 'power_mean_w', 'power_min_w', 'power_max_w', 'energy_lifetime_wh']
+    df[numeric] = df[numeric].apply(pd.to_numeric)
+    df['power_weighted'] = df['power_mean_w'] * df['intervals']
+    df['intervals_with_power'] = df['intervals'].where(df['power_mean_w'].notna(), 0)
+    agg = df.groupby(keys).agg(
+        energy_wh=('energy_wh', 'sum'),
+        power_weighted=('power_weighted', 'sum'),
+        intervals_with_power=('intervals_with_power', 'sum'),
+        power_min_w=('power_min_w', 'min'),
+        power_max_w=('power_max_w', 'max'),
+        energy_lifetime_wh=('energy_lifetime_wh', 'last'),
+        intervals=('intervals', 'sum'),
+    )
+    agg['power_mean_w'] = agg['power_weighted'] / agg['intervals_with_power'].replace(0, np.nan)
+    return agg[numeric + ['intervals']]
+
+
+def rollup_level(period, source, device_ids=None):
+    """Recompute the pending `period` rollups from the `source` level. Returns the rows upserted."""
+    rows, time_field = _source_queryset(source)
+    rows = rows.filter(_pending_filter(period, time_field, device_ids)).order_by('device_id', time_field)
+
+    df = pd.DataFrame.from_records(
+        rows.iterator(chunk_size=settings.SMARTPLUG_AGGREGATE_CHUNK_SIZE),
+        columns=ROLLUP_COLUMNS if source else ROLLUP_COLUMNS[:-1],
+    )
+    if df.empty:
+        return 0
+    if source is None:
+        df['intervals'] = 1
+    df['period_start'] = period_starts(df['period_start'], period).to_numpy()
+    agg = _combine(df, ['device_id', 'period_start'])
+
+    columns = zip(
+        agg.index.get_level_values('device_id'),
+        agg.index.get_level_values('period_start').to_pydatetime(),
+        _values(agg, 'energy_wh'),
+        _values(agg, 'energy_lifetime_wh'),
+        _values(agg, 'power_mean_w'),
+        _values(agg, 'power_min_w'),
+        _values(agg, 'power_max_w'),
+        agg['intervals'].astype(int).tolist(),
+    )
+    rollups = [
+        SmartPlugDataRollup(
+            device_id=device_id,
+            period=period,
+            period_start=start,
+            energy_wh=energy,
+            energy_lifetime_wh=lifetime,
+            power_mean_w=mean,
+            power_min_w=minimum,
+            power_max_w=maximum,
+            intervals=intervals,
+        )
+        for device_id, start, energy, lifetime, mean, minimum, maximum, intervals in columns
+    ]
+    SmartPlugDataRollup.objects.bulk_create(
+        rollups,
+        batch_size=settings.SMARTPLUG_BULK_BATCH_SIZE,
+        update_conflicts=True,
+        unique_fields=['device', 'period', 'period_start'],
+        update_fields=ROLLUP_UPDATE_FIELDS,
+    )
+    return len(rollups)
+
+
+def rollup_smart_plug_data(device_ids=None):
+    """Run the hourly -> daily -> monthly cascade. Returns {period: rows upserted}."""
+    print(">>> Running rollup cascade")
+    counts = {}
+    for period, source in CASCADE:
+        with transaction.atomic():
+            counts[period] = rollup_level(period, source, device_ids)
+    print(f"✅ Rollups complete: {counts}")
+    return counts
+
+
+def pick_period(start, end):
+    """Coarsest rollup period whose boundaries both ends of [start, end) fall on, or None for 5-minute rows."""
+    for period in COARSEST_FIRST:
+        if period_floor(start, period) == start and period_floor(end, period) == end:
+            return period
+    return None
+
+
+def period_for_points(start, end, points):
+    """Coarsest rollup period giving at least `points` periods over [start, end), or None."""
+    span = (end - start).total_seconds()
+    for period in COARSEST_FIRST:
+        if span / PERIOD_SECONDS[period] >= points:
+            return period
+    return None
+
+
+def period_rows(period, start=None, end=None, device_ids=None):
+    """
+    Rows of one resolution in [start, end) (either end may be open), ordered by
+    device and time. They yield ROLLUP_COLUMNS values whatever the resolution;
+    period None means 5-minute aggregates, which have no `intervals`.
+    """
+    if period is None:
+        rows = SmartPlugDataAggregate.objects.filter(interval_seconds=SOURCE_INTERVAL_SECONDS).annotate(
+            period_start=F('metered_at'),
+            energy_wh=F('energy_interval_wh'),
+            power_mean_w=F('power_w'),
+            power_min_w=F('power_w'),
+            power_max_w=F('power_w'),
+        ).values('device_id', 'period_start', 'energy_wh', 'power_mean_w', 'power_min_w',
+                 'power_max_w', 'energy_lifetime_wh')
+        time_field = 'metered_at'
+    else:
+        rows = SmartPlugDataRollup.objects.filter(period=period).values(*ROLLUP_COLUMNS)
+        time_field = 'period_start'
+    if start is not None:
+        rows = rows.filter(**{f'{time_field}__gte': start})
+    if end is not None:
+        rows = rows.filter(**{f'{time_field}__lt': end})
+    if device_ids is not None:
+        rows = rows.filter(device_id__in=device_ids)
+    return rows.order_by('device_id', time_field)
+
+
+def rollup_series(start, end, device_ids=None):
+    """
+    Return (period, queryset) for [start, end) at the coarsest resolution that
+    covers it exactly (see period_rows).
+    """
+    period = pick_period(start, end)
+    return period, period_rows(period, start, end, device_ids)
+
+
+def split_range(start, end, periods=COARSEST_FIRST):
+    """
+    Split [start, end) into (period, start, end) segments, using the coarsest
+    period for the aligned middle and finer ones for the edges.
+    """
+    if start >= end:
+        return []
+    for index, period in enumerate(periods):
+        inner_start, inner_end = period_ceil(start, period), period_floor(end, period)
+        if inner_start < inner_end:
+            finer = periods[index + 1:]
+            return (
+                split_range(start, inner_start, finer)
+                + [(period, inner_start, inner_end)]
+                + split_range(inner_end, end, finer)
+            )
+    return [(None, start, end)]
+
+
+def energy_between(start, end, device_ids=None):
+    """
+    Energy and power statistics per device over [start, end), read from as few
+    rows as possible. Returns {device_id: {energy_wh, power_mean_w, power_min_w,
+    power_max_w, energy_lifetime_wh}}.
+    """
+    frames = []
+    for period, segment_start, segment_end in split_range(start, end):
+        rows = period_rows(period, segment_start, segment_end, device_ids)
+        frame = pd.DataFrame.from_records(rows, columns=ROLLUP_COLUMNS)
+        if period is None:
+            frame['intervals'] = 1
+        if not frame.empty:
+            frames.append(frame)
+    if not frames:
+        return {}
+
+    df = pd.concat(frames, ignore_index=True).sort_values(['device_id', 'period_start'])
+    agg = _combine(df, 'device_id').drop(columns='intervals').round(2)
+    return {
+        device_id: {name: (None if pd.isna(value) else float(value)) for name, value in stats.items()}
+        for device_id, stats in agg.to_dict('index').items()
+    }
@@ -0,0 +1,103 @@
+"""
+Adaptive per-plug polling.
+
+The beat still ticks every SMARTPLUG_POLL_SECONDS, but each tick only polls the
+plugs whose next_poll_at has passed, at most the tick's share of
+SMARTPLUG_POLL_BUDGET_PER_MINUTE (most overdue first). After a poll each plug is
+rescheduled from what it reported:
+
+* active and changing by more than SMARTPLUG_POLL_CHANGE_WATTS: back to the base
+  SMARTPLUG_POLL_SECONDS interval;
+* active but steady: interval doubles up to SMARTPLUG_POLL_ACTIVE_MAX_SECONDS;
+* idle (0 W or switched off): interval doubles up to SMARTPLUG_POLL_IDLE_MAX_SECONDS;
+* offline in the device list: probed again after SMARTPLUG_POLL_OFFLINE_SECONDS,
+  without a quota call in between;
+* the quota call failed: retried with the interval doubling up to
+  SMARTPLUG_POLL_ACTIVE_MAX_SECONDS, so an API outage does not park the fleet.
+
+The aggregator time-weights the resulting irregular samples (ecoflow._fill_sample_gaps).
+"""
+import math
+from datetime import timedelta
+from django.conf import settings
+from django.utils.timezone import now as timezone_now
+from smartPlug_devices.ecoflow import extract_selected_quota_fields
+from smartPlug_devices.models import SmartPlugPollSchedule
+
+
+def tick_budget(shards=1):
+    """Quota calls one beat tick (or one of its `shards`) may spend to stay within the per-minute budget."""
+    return max(1, math.floor(settings.SMARTPLUG_POLL_BUDGET_PER_MINUTE * settings.SMARTPLUG_POLL_SECONDS / 60 / shards))
+
+
+def select_due_devices(device_list, now=None, shards=1):
+    """Return the device-list entries to poll this tick, never more than tick_budget(shards)."""
+    now = now or timezone_now()
+    sns = [device["sn"] for device in device_list if device.get("sn")]
+    next_poll = dict(
+        SmartPlugPollSchedule.objects.filter(device__sn__in=sns).values_list('device__sn', 'next_poll_at')
+    )
+    # Plugs never polled sort first, then the most overdue
+    due = sorted(
+        (device for device in device_list
+         if device.get("sn") and (device["sn"] not in next_poll or next_poll[device["sn"]] <= now)),
+        key=lambda device: (device["sn"] in next_poll, next_poll.get(device["sn"]) or now),
+    )
+    return due[:tick_budget(shards)]
+
+
+def _next_interval(schedule, device_data):
+    base = float(settings.SMARTPLUG_POLL_SECONDS)
+    if device_data.get("full_info", {}).get("online") == 0:
+        return float(settings.SMARTPLUG_POLL_OFFLINE_SECONDS), None
+
+    # Coming back from an offline probe restarts at the base rate
+    previous = base
+    if schedule and schedule.interval_seconds < settings.SMARTPLUG_POLL_OFFLINE_SECONDS:
+        previous = schedule.interval_seconds
+    quota = device_data.get("quota") or {}
+    if device_data.get("quota_error") or not quota:
+        # A failed call says nothing about the plug: retry soon, backing off to the active maximum
+        return min(previous * 2, settings.SMARTPLUG_POLL_ACTIVE_MAX_SECONDS), schedule.last_watts if schedule else None
+    extracted = extract_selected_quota_fields(quota)
+    watts = extracted["watts"] / 10 if extracted["watts"] is not None else None
+
+    if not watts or extracted["switchStatus"] == 0:
+        return min(previous * 2, settings.SMARTPLUG_POLL_IDLE_MAX_SECONDS), watts
+    last_watts = schedule.last_watts if schedule else None
+    if last_watts is None or abs(watts - last_watts) > settings.SMARTPLUG_POLL_CHANGE_WATTS:
+        return base, watts
+    return min(previous * 2, settings.SMARTPLUG_POLL_ACTIVE_MAX_SECONDS), watts
+
+
+def reschedule(devices, plugs, now=None):
+    """
+    Store the next poll time of every polled plug in one bulk upsert.
+    `devices` are get_ecoflow_devices_all() results, `plugs` maps SN to SmartPlug.
+    """
+    now = now or timezone_now()
+    schedules = {
+        schedule.device_id: schedule
+        for schedule in SmartPlugPollSchedule.objects.filter(device__in=list(plugs.values()))
+    }
+    updated = []
+    for device_data in devices:
+        plug = plugs.get(device_data.get("sn"))
+        # Calls deferred by the rate limiter keep their due time and go first next tick
+        if plug is None or device_data.get("quota_deferred"):
+            continue
+        interval, watts = _next_interval(schedules.get(plug.id), device_data)
+        updated.append(SmartPlugPollSchedule(
+            device=plug,
+            next_poll_at=now + timedelta(seconds=interval),
+            interval_seconds=interval,
+            last_watts=watts,
+            last_polled_at=now,
+        ))
+    SmartPlugPollSchedule.objects.bulk_create(
+        updated,
+        update_conflicts=True,
+        unique_fields=['device'],
+        update_fields=['next_poll_at', 'interval_seconds', 'last_watts', 'last_polled_at'],
+    )
+    return len(updated)
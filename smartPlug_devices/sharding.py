@@ -0,0 +1,81 @@
+"""
+Fleet sharding for the sync and aggregation tasks.
+
+Plugs are assigned to SMARTPLUG_SHARDS shards by consistent hashing on their SN
+(VNODES points per shard on an md5 ring), so changing the shard count only moves
+about 1/N of the plugs. The beat task dispatches one subtask per shard; each
+subtask holds a database lock for its shard (a unique SmartPlugTaskLock row, so
+it also holds across prefork worker processes without a shared cache) and skips
+the run when the previous one for that shard is still working.
+"""
+import bisect
+import hashlib
+import uuid
+from contextlib import contextmanager
+from datetime import timedelta
+from functools import lru_cache
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.utils.timezone import now
+from smartPlug_devices.models import SmartPlugTaskLock
+
+VNODES = 160
+
+
+def _hash(value):
+    return int.from_bytes(hashlib.md5(value.encode()).digest()[:8], 'big')
+
+
+@lru_cache(maxsize=8)
+def _ring(shards):
+    points = sorted((_hash(f"shard-{shard}#{vnode}"), shard) for shard in range(shards) for vnode in range(VNODES))
+    return [point for point, _ in points], [shard for _, shard in points]
+
+
+def shard_for(sn, shards=None):
+    """Shard index of a plug SN."""
+    shards = shards or settings.SMARTPLUG_SHARDS
+    if shards <= 1:
+        return 0
+    points, owners = _ring(shards)
+    return owners[bisect.bisect(points, _hash(sn)) % len(points)]
+
+
+def split(sns, shards=None):
+    """Group SNs by shard: {shard index: [sn, ...]}, omitting empty shards."""
+    groups = {}
+    for sn in sns:
+        groups.setdefault(shard_for(sn, shards), []).append(sn)
+    return groups
+
+
+def shard_devices(device_list, shard, shards=None):
+    """The EcoFlow device-list entries that belong to `shard`."""
+    return [device for device in device_list if device.get("sn") and shard_for(device["sn"], shards) == shard]
+
+
+@contextmanager
+def shard_lock(name, shard, timeout=None):
+    """
+    Yield True while holding the `name` lock for `shard`, or False if another run holds it.
+    The lock expires after SMARTPLUG_SHARD_LOCK_TTL so a killed worker cannot hold it forever.
+    """
+    key = f"{name}:{shard}"
+    token = uuid.uuid4().hex
+    current = now()
+    SmartPlugTaskLock.objects.filter(name=key, expires_at__lte=current).delete()
+    try:
+        with transaction.atomic():
+            SmartPlugTaskLock.objects.create(
+                name=key, token=token,
+                expires_at=current + timedelta(seconds=timeout or settings.SMARTPLUG_SHARD_LOCK_TTL),
+            )
+        acquired = True
+    except IntegrityError:
+        acquired = False
+    try:
+        yield acquired
+    finally:
+        # Only release our own lock, not one taken after ours expired
+        if acquired:
+            SmartPlugTaskLock.objects.filter(name=key, token=token).delete()
@@ -0,0 +1,134 @@
+"""
+SQLite performance profile.
+
+Tunes every new SQLite connection (WAL, synchronous=NORMAL, busy_timeout, mmap)
+and provides a writer thread that funnels telemetry inserts into larger
+transactions, so the Celery beat tasks stop tripping "database is locked".
+
+The writer is per process: it serialises writes within one process (runserver,
+ingest_mqtt, a threaded or solo Celery worker), but every prefork Celery child
+starts its own, so it is not the single writer for the database there. Locks
+between processes are still resolved by busy_timeout and the writer's retries.
+"""
+import atexit
+import queue
+import threading
+import time
+from django.conf import settings
+from django.db import OperationalError, close_old_connections, connection, transaction
+
+
+def configure_sqlite(sender, connection, **kwargs):
+    """connection_created hook applying SQLITE_PRAGMAS to each new SQLite connection."""
+    if connection.vendor != 'sqlite' or not settings.SQLITE_TUNING:
+        return
+    with connection.cursor() as cursor:
+        for pragma, value in settings.SQLITE_PRAGMAS.items():
+            cursor.execute(f"PRAGMA {pragma} = {value}")
+
+
+class TelemetryWriter:
+    """
+    Single writer thread for SmartPlugData in this process. Producers enqueue
+    unsaved rows; the thread flushes them with one bulk_create per transaction
+    once SQLITE_WRITER_BATCH_SIZE rows are waiting or SQLITE_WRITER_FLUSH_SECONDS
+    have passed. A batch that hits OperationalError ("database is locked") is
+    retried SQLITE_WRITER_RETRIES times with doubling backoff; rows that still
+    fail are counted in `failed` and handed to their submitter's on_error.
+    """
+
+    def __init__(self, batch_size=None, flush_seconds=None):
+        self.batch_size = batch_size or settings.SQLITE_WRITER_BATCH_SIZE
+        self.flush_seconds = flush_seconds or settings.SQLITE_WRITER_FLUSH_SECONDS
+        self.queue = queue.Queue()
+        self.written = 0
+        self.failed = 0
+        self._thread = threading.Thread(target=self._run, name="telemetry-writer", daemon=True)
+        self._thread.start()
+
+    def submit(self, rows, on_error=None, on_written=None):
+        """
+        Queue rows for writing. Once some of them are committed on_written(rows) is
+        called, and if some cannot be written on_error(rows), both from the writer
+        thread with the rows of this submission that the batch held.
+        """
+        for row in rows:
+            self.queue.put((row, on_written, on_error))
+
+    def flush(self):
+        """Block until everything submitted so far has been written or has failed."""
+        self.queue.join()
+
+    def _write(self, rows):
+        from smartPlug_devices.models import SmartPlugData
+
+        close_old_connections()
+        with transaction.atomic():
+            SmartPlugData.objects.bulk_create(rows, batch_size=settings.SMARTPLUG_BULK_BATCH_SIZE)
+
+    def _write_with_retry(self, rows):
+        delay = settings.SQLITE_WRITER_RETRY_SECONDS
+        for attempt in range(settings.SQLITE_WRITER_RETRIES + 1):
+            try:
+                return self._write(rows)
+            except OperationalError as e:
+                if attempt == settings.SQLITE_WRITER_RETRIES:
+                    raise
+                print(f"⚠️ Telemetry writer retrying {len(rows)} rows in {delay:.1f}s: {e}")
+                time.sleep(delay)
+                delay *= 2
+
+    @staticmethod
+    def _notify(batch, failed):
+        """Call each submitter's on_error (if `failed`) or on_written callback with its rows."""
+        index = 2 if failed else 1
+        by_callback = {}
+        for entry in batch:
+            if entry[index] is not None:
+                by_callback.setdefault(entry[index], []).append(entry[0])
+        for callback, rows in by_callback.items():
+            try:
+                callback(rows)
+            except Exception as e:
+                print(f"❌ Telemetry writer callback failed: {e}")
+
+    def _run(self):
+        while True:
+            batch = [self.queue.get()]
+            deadline = time.monotonic() + self.flush_seconds
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self.queue.get(timeout=max(deadline - time.monotonic(), 0)))
+                except queue.Empty:
+                    break
+            try:
+                self._write_with_retry([entry[0] for entry in batch])
+            except Exception as e:
+                self.failed += len(batch)
+                print(f"❌ Telemetry writer could not write {len(batch)} rows: {e}")
+                self._notify(batch, failed=True)
+            else:
+                self.written += len(batch)
+                self._notify(batch, failed=False)
+            finally:
+                for _ in batch:
+                    self.queue.task_done()
+
+
+_writer = None
+_writer_lock = threading.Lock()
+
+
+def get_writer() -> TelemetryWriter:
+    """Return this process's TelemetryWriter, starting it on first use."""
+    global _writer
+    if _writer is None:
+        with _writer_lock:
+            if _writer is None:
+                _writer = TelemetryWriter()
+                atexit.register(_writer.flush)
+    return _writer
+
+
+def use_writer_queue():
+    return connection.vendor == 'sqlite' and settings.SQLITE_WRITER_QUEUE
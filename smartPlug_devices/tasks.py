@@ -1,9 +1,11 @@
-from celery import shared_task
+from celery import chord, group, shared_task
+from django.conf import settings
 from django.utils import timezone
 from datetime import timedelta
 from django.core.management import call_command
-from smartPlug_devices.ecoflow import smart_plug_data_aggregate
+from smartPlug_devices.ecoflow import smart_plug_data_aggregate_fleet, sync_smart_plug_data
 from smartPlug_devices.models import SmartPlug, SmartPlugData
+from smartPlug_devices.sharding import shard_lock, split
 
 # @shared_task
 # def sync_ecoflow_task():
@@ -12,32 +14,96 @@ from smartPlug_devices.models import SmartPlug, SmartPlugData
 
 @shared_task
 def sync_ecoflow_task():
+    """Poll the fleet, as one subtask per shard when SMARTPLUG_SHARDS > 1."""
+    shards = settings.SMARTPLUG_SHARDS
+    if shards <= 1:
+        return sync_ecoflow_shard(0, 1)
+    group(sync_ecoflow_shard.s(shard, shards) for shard in range(shards)).apply_async()
+
+@shared_task
+def sync_ecoflow_shard(shard, shards):
+    with shard_lock('sync', shard) as acquired:
+        if not acquired:
+            print(f"⏭️ Sync of shard {shard}/{shards} still running; skipping this tick.")
+            return 0
+        created = sync_smart_plug_data(shard=shard if shards > 1 else None, shards=shards)
+        print(f"Stored {len(created)} SmartPlugData samples (shard {shard}/{shards}).")
+        return len(created)
+
+@shared_task
+def sync_smart_plugs_task():
     from smartPlug_devices.management.commands.sync_ecoflow import Command
     cmd = Command()
     cmd.sync_smart_plugs()
-    cmd.sync_smart_plug_data()
 
 @shared_task
 def aggregate_smart_plug_data_all_devices(interval_seconds=300):
-    print("⏱️ Starting aggregation for all devices...")
-    device_sns = SmartPlug.objects.values_list('sn', flat=True)
-    for sn in device_sns:
+    """
+    Aggregate the fleet, as one subtask per shard when SMARTPLUG_SHARDS > 1.
+    With a result backend the shards run as a chord that reports the total.
+    """
+    shards = settings.SMARTPLUG_SHARDS
+    if shards <= 1:
+        print("⏱️ Starting aggregation for all devices...")
+        aggregate_smart_plug_data_shard(interval_seconds, 0, 1)
+        print("✅ Aggregation loop complete.")
+        return
+    header = group(aggregate_smart_plug_data_shard.s(interval_seconds, shard, shards) for shard in range(shards))
+    if settings.CELERY_RESULT_BACKEND:
+        chord(header)(aggregation_shards_complete.s(interval_seconds))
+    else:
+        header.apply_async()
+    print(f"⏱️ Dispatched aggregation of {shards} shards.")
+
+@shared_task
+def aggregate_smart_plug_data_shard(interval_seconds, shard, shards):
+    with shard_lock(f'aggregate:{interval_seconds}', shard) as acquired:
+        if not acquired:
+            print(f"⏭️ Aggregation of shard {shard}/{shards} still running; skipping.")
+            return 0
+        device_sns = None
+        if shards > 1:
+            device_sns = split(SmartPlug.objects.values_list('sn', flat=True), shards).get(shard)
+            if not device_sns:
+                return 0
         try:
-            smart_plug_data_aggregate(sn, interval_seconds)
+            return smart_plug_data_aggregate_fleet(interval_seconds, device_sns=device_sns)
         except Exception as e:
-            print(f"❌ Error processing {sn}: {e}")
-    print("✅ Aggregation loop complete.")
+            print(f"❌ Error during aggregation of shard {shard}/{shards}: {e}")
+            return 0
+
+@shared_task
+def aggregation_shards_complete(results, interval_seconds=300):
+    print(f"✅ Aggregation complete: {sum(results)} closed {interval_seconds}s intervals across {len(results)} shards.")
+
+@shared_task
+def rollup_smart_plug_data_task():
+    from smartPlug_devices.rollups import rollup_smart_plug_data
+    try:
+        rollup_smart_plug_data()
+    except Exception as e:
+        print(f"❌ Error during rollup cascade: {e}")
 
 @shared_task
 def delete_old_aggregated_data():
     """
-    Delete SmartPlugData records that are older than 12 hours and are marked as is_aggregated=True.
+    Delete SmartPlugData records older than SMARTPLUG_RAW_RETENTION_HOURS that are marked as is_aggregated=True.
+    On PostgreSQL whole expired partitions (or TimescaleDB chunks) are dropped, so rows can outlive the retention
+    by up to one partition or chunk; otherwise rows are deleted in batches.
     """
-    cutoff_time = timezone.now() - timedelta(hours=2)
-    deleted_count, _ = SmartPlugData.objects.filter(
-        is_aggregated=True,
-        eatTime__lt=cutoff_time
-    ).delete()
+    from smartPlug_devices import partitions
+
+    cutoff_time = timezone.now() - timedelta(hours=settings.SMARTPLUG_RAW_RETENTION_HOURS)
+    if partitions.is_hypertable():
+        dropped = partitions.drop_expired_chunks(cutoff_time)
+        print(f"🧹❌Dropped {len(dropped)} expired SmartPlugData chunks.")
+        return
+    if partitions.is_partitioned():
+        partitions.ensure_partitions()
+        dropped = partitions.drop_expired_partitions(cutoff_time)
+        print(f"🧹❌Dropped {len(dropped)} expired SmartPlugData partitions.")
+        return
+    deleted_count = partitions.delete_expired_rows(cutoff_time)
     print(f"🧹❌Deleted {deleted_count} old aggregated SmartPlugData records.")
 
 @shared_task
@@ -46,6 +112,6 @@ def push_aggregated_data_to_prospect():
     result = push_smart_plug_data_to_prospect()
     
     if result.get("success"):
-        print(f"✅ Successfully pushed data")
+        print(f"✅ Successfully pushed {result['pushed_count']} records")
     else:
-        print(f"❌ Push failed: {result.get('error')}")
\ No newline at end of file
+        print(f"❌ Push failed after {result['pushed_count']} records: {result.get('error')}")
\ No newline at end of file
@@ -1,3 +1,786 @@
-from django.test import TestCase
+import csv
+import hashlib
+import io
+import sys
+import hmac
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from unittest import mock, skipUnless
+from django.core.cache import cache, caches
+from django.core.management import CommandError, call_command
+from django.db import OperationalError, connection, transaction
+from django.db.migrations.executor import MigrationExecutor
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.utils.timezone import now
+from smartPlug_devices import ecoflow
+from smartPlug_devices.caching import LOCK_SUFFIX, cached
+from smartPlug_devices.exports import iter_export
+from smartPlug_devices.ecoflow import (
+    QUOTA_KEYS, SELECTIVE_QUOTA_PATH, EcoFlowClient, copy_smart_plug_data, flatten_params, generate_signature, get_client, get_device_quota, get_location_id,
+    get_ecoflow_devices_all,
+    save_aggregates, smart_plug_data_aggregate_fleet, sync_smart_plug_data, sync_smart_plugs, write_smart_plug_data,
+)
+from smartPlug_devices.models import (
+    SmartPlug, SmartPlugData, SmartPlugDataAggregate, SmartPlugDataRollup, SmartPlugLocation, SmartPlugPollSchedule,
+    SmartPlugTaskLock,
+)
+from smartPlug_devices.mqtt import QuotaStream
+from smartPlug_devices.partitions import delete_expired_rows
+from smartPlug_devices.ratelimit import RateLimitTimeout, TokenBucket
+from smartPlug_devices.rollups import energy_between, rollup_smart_plug_data, split_range
+from smartPlug_devices.scheduler import _next_interval, reschedule
+from smartPlug_devices.sharding import shard_lock
+from smartPlug_devices.sqlite import TelemetryWriter, get_writer
+from smartPlug_devices.tasks import delete_old_aggregated_data
 
-# Create your tests here.
+try:
+    import fakeredis
+    import lupa  # noqa: F401  fakeredis needs it to run Lua scripts
+except ImportError:
+    fakeredis = None
+
+
+
+def closed_bin_start(hours_ago=2, interval_seconds=300):
+    """Start of a 5-minute bin that is well past the aggregation grace period."""
+    start = now() - timedelta(hours=hours_ago)
+    return start - timedelta(seconds=start.timestamp() % interval_seconds)
+
+
+def add_samples(plug, start, profile):
+    """Store raw samples at (offset seconds, watts) points after `start`."""
+    SmartPlugData.objects.bulk_create([
+        SmartPlugData(
+            device=plug, serial_number=plug.sn, eatTime=start + timedelta(seconds=offset),
+            switchStatus=1, volt=230.0, freq=50.0, current=watts / 230 * 1000, watts=watts,
+        )
+        for offset, watts in profile
+    ])
+
+
+def energy(plug, interval_seconds=300):
+    return {
+        agg.metered_at: agg.energy_interval_wh
+        for agg in SmartPlugDataAggregate.objects.filter(device=plug, interval_seconds=interval_seconds)
+    }
+
+
+def full_rate(profile_until):
+    """Samples every 10 s: profile_until is [(end offset, watts), ...] covering one bin."""
+    samples, offset = [], 0
+    for end, watts in profile_until:
+        while offset < end:
+            samples.append((offset, watts))
+            offset += 10
+    return samples
+
+
+class FleetAggregationTests(TestCase):
+    def setUp(self):
+        self.plug = SmartPlug.objects.create(sn='AGG', name='agg')
+        self.first_bin = closed_bin_start(hours_ago=3)
+        add_samples(self.plug, self.first_bin, full_rate([(300, 120.0)]))
+
+    def test_rerun_does_not_double_count(self):
+        smart_plug_data_aggregate_fleet(300)
+        first = SmartPlugDataAggregate.objects.get(device=self.plug, metered_at=self.first_bin)
+        self.assertAlmostEqual(first.energy_interval_wh, 10.0, places=2)
+
+        # A late sample for the closed bin is absorbed without recomputing it
+        add_samples(self.plug, self.first_bin, [(5, 5000.0)])
+        smart_plug_data_aggregate_fleet(300)
+        smart_plug_data_aggregate_fleet(300)
+        rerun = SmartPlugDataAggregate.objects.get(device=self.plug, metered_at=self.first_bin)
+        self.assertEqual(SmartPlugDataAggregate.objects.filter(device=self.plug).count(), 1)
+        self.assertEqual((rerun.energy_interval_wh, rerun.energy_lifetime_wh), (10.0, 10.0))
+        self.assertFalse(SmartPlugData.objects.filter(device=self.plug, is_aggregated=False).exists())
+
+    def test_lifetime_energy_accumulates_across_runs(self):
+        smart_plug_data_aggregate_fleet(300)
+        second_bin = closed_bin_start(hours_ago=2)
+        add_samples(self.plug, second_bin, full_rate([(300, 240.0)]))
+        smart_plug_data_aggregate_fleet(300)
+        latest = SmartPlugDataAggregate.objects.get(device=self.plug, metered_at=second_bin)
+        self.assertAlmostEqual(latest.energy_interval_wh, 20.0, places=2)
+        self.assertAlmostEqual(latest.energy_lifetime_wh, 30.0, places=2)
+
+    def test_open_bin_is_left_pending(self):
+        add_samples(self.plug, now() - timedelta(seconds=5), [(0, 300.0)])
+        smart_plug_data_aggregate_fleet(300)
+        self.assertEqual(list(energy(self.plug)), [self.first_bin])
+        self.assertEqual(SmartPlugData.objects.filter(device=self.plug, is_aggregated=False).count(), 1)
+
+
+class DeadbandEnergyTests(TestCase):
+    @override_settings(SMARTPLUG_DEADBAND_ENABLED=True, SMARTPLUG_DEADBAND_HEARTBEAT=300)
+    def test_deadband_samples_match_full_rate_energy(self):
+        start = closed_bin_start()
+        full = SmartPlug.objects.create(sn='FULL-RATE', name='full')
+        deadband = SmartPlug.objects.create(sn='DEADBAND', name='deadband')
+        # 100 W for 240 s, then 300 W: only the change is recorded under deadband
+        add_samples(full, start, full_rate([(240, 100.0), (300, 300.0)]))
+        add_samples(deadband, start, [(0, 100.0), (240, 300.0)])
+        smart_plug_data_aggregate_fleet(300)
+        self.assertAlmostEqual(energy(full)[start], 11.67, places=2)
+        self.assertAlmostEqual(energy(deadband)[start], 11.67, places=2)
+
+
+@override_settings(SMARTPLUG_DEADBAND_ENABLED=True, SMARTPLUG_DEADBAND_HEARTBEAT=300)
+class DeadbandFilterTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.plug = SmartPlug.objects.create(sn='DB-FILTER', name='deadband')
+        self.start = closed_bin_start()
+
+    def write(self, offset, watts, switch=1):
+        row = SmartPlugData(device=self.plug, serial_number=self.plug.sn, eatTime=self.start + timedelta(seconds=offset),
+                            switchStatus=switch, volt=230.0, freq=50.0, current=watts / 230 * 1000, watts=watts)
+        with self.captureOnCommitCallbacks(execute=True):
+            return len(write_smart_plug_data([row]))
+
+    def test_small_changes_are_suppressed(self):
+        self.assertEqual([self.write(0, 100.0), self.write(10, 100.5), self.write(20, 102.0)], [1, 0, 1])
+
+    def test_switch_change_is_kept(self):
+        self.assertEqual([self.write(0, 0.0), self.write(10, 0.0, switch=0)], [1, 1])
+
+    def test_heartbeat_is_kept(self):
+        self.assertEqual([self.write(0, 100.0), self.write(100, 100.0), self.write(300, 100.0)], [1, 0, 1])
+
+    def test_failed_write_does_not_advance_state(self):
+        self.write(0, 100.0)
+        with mock.patch.object(SmartPlugData.objects, 'bulk_create', side_effect=OperationalError("database is locked")):
+            with self.assertRaises(OperationalError):
+                self.write(10, 150.0)
+        self.assertEqual(self.write(20, 150.0), 1)
+
+
+class AdaptivePollingEnergyTests(TestCase):
+    def setUp(self):
+        self.start = closed_bin_start()
+        self.full = SmartPlug.objects.create(sn='FULL-RATE', name='full')
+        self.sparse = SmartPlug.objects.create(sn='ADAPTIVE', name='adaptive')
+        # 100 W for 240 s, then 500 W for 60 s
+        add_samples(self.full, self.start, full_rate([(240, 100.0), (300, 500.0)]))
+        add_samples(self.sparse, self.start, [(0, 100.0), (60, 100.0), (120, 100.0), (180, 100.0)]
+                    + [(offset, 500.0) for offset in range(240, 300, 10)])
+
+    @override_settings(SMARTPLUG_ADAPTIVE_POLLING=True)
+    def test_irregular_samples_match_full_rate_energy(self):
+        smart_plug_data_aggregate_fleet(300)
+        self.assertAlmostEqual(energy(self.full)[self.start], 15.0, places=2)
+        self.assertAlmostEqual(energy(self.sparse)[self.start], 15.0, places=2)
+
+
+class MqttEnergyTests(TestCase):
+    @override_settings(SMARTPLUG_MQTT_INGEST=True, SMARTPLUG_MQTT_HOLD_SECONDS=300)
+    def test_pushed_samples_are_time_weighted(self):
+        start = closed_bin_start()
+        plug = SmartPlug.objects.create(sn='MQTT-PUSH', name='mqtt')
+        # Pushes on change only: 100 W for 200 s, 400 W for 60 s, then 100 W again
+        add_samples(plug, start, [(0, 100.0), (200, 400.0), (260, 100.0)])
+        smart_plug_data_aggregate_fleet(300)
+        aggregate = SmartPlugDataAggregate.objects.get(device=plug, metered_at=start)
+        self.assertAlmostEqual(aggregate.power_w, 160.0, places=2)
+        self.assertAlmostEqual(aggregate.energy_interval_wh, 13.33, places=2)
+
+
+class AdaptiveScheduleTests(TestCase):
+    def setUp(self):
+        self.plug = SmartPlug.objects.create(sn='SCHED', name='sched')
+        self.schedule = SmartPlugPollSchedule(
+            device=self.plug, next_poll_at=now(), interval_seconds=20, last_watts=40.0, last_polled_at=now(),
+        )
+
+    @override_settings(SMARTPLUG_POLL_SECONDS=10, SMARTPLUG_POLL_ACTIVE_MAX_SECONDS=60,
+                       SMARTPLUG_POLL_OFFLINE_SECONDS=600)
+    def test_request_error_backs_off_without_offline_interval(self):
+        failed = {"sn": "SCHED", "full_info": {"online": 1}, "quota": {}, "quota_error": "EcoFlow circuit open"}
+        self.assertEqual(_next_interval(self.schedule, failed), (40, 40.0))
+        self.schedule.interval_seconds = 60
+        self.assertEqual(_next_interval(self.schedule, failed), (60, 40.0))
+
+    @override_settings(SMARTPLUG_POLL_OFFLINE_SECONDS=600)
+    def test_offline_device_uses_offline_interval(self):
+        offline = {"sn": "SCHED", "full_info": {"online": 0}, "quota": {}, "quota_error": None}
+        self.assertEqual(_next_interval(self.schedule, offline), (600.0, None))
+
+
+class RateLimitDeferralTests(TestCase):
+    def setUp(self):
+        self.plug = SmartPlug.objects.create(sn='DEFERRED', name='deferred')
+
+    def test_limiter_timeout_stores_no_sample(self):
+        deferred = {"sn": "DEFERRED", "full_info": {"online": 1}, "quota": {},
+                    "quota_error": "EcoFlow rate limit: no token within 10s", "quota_deferred": True}
+        self.assertEqual(sync_smart_plug_data(devices=[deferred]), [])
+        self.assertFalse(SmartPlugData.objects.exists())
+
+    def test_limiter_timeout_keeps_poll_schedule(self):
+        due_at = now() - timedelta(seconds=5)
+        SmartPlugPollSchedule.objects.create(
+            device=self.plug, next_poll_at=due_at, interval_seconds=20, last_watts=40.0, last_polled_at=due_at,
+        )
+        reschedule([{"sn": "DEFERRED", "quota": {}, "quota_deferred": True}], {"DEFERRED": self.plug})
+        self.assertEqual(SmartPlugPollSchedule.objects.get(device=self.plug).next_poll_at, due_at)
+
+
+class HistoryApiTests(TestCase):
+    def setUp(self):
+        self.plug = SmartPlug.objects.create(sn='API', name='api')
+        start = closed_bin_start()
+        add_samples(self.plug, start, [(offset, 100.0) for offset in range(0, 50, 10)])
+        SmartPlugData.objects.create(device=self.plug, serial_number='API', eatTime=None)
+        add_samples(self.plug, start, [(offset, 200.0) for offset in range(50, 100, 10)])
+
+    def test_cursor_pages_skip_rows_without_timestamp(self):
+        url, seen = '/api/raw?page_size=3&fields=watts', []
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            seen += response.json()['results']
+            url = response.json()['next']
+        self.assertEqual(len(seen), 10)
+        self.assertTrue(all(row['eatTime'] for row in seen))
+
+    def test_invalid_parameters_are_rejected(self):
+        self.assertEqual(self.client.get('/api/raw?start=2025-13-01').status_code, 400)
+        response = self.client.get('/api/raw?device=API&points=5&fields=watts,serial_number&y=serial_number')
+        self.assertEqual(response.status_code, 400)
+
+
+class QuotaStreamTests(TestCase):
+    def setUp(self):
+        SmartPlug.objects.create(sn='MQTT', name='mqtt')
+        self.stream = QuotaStream()
+        self.stream.on_message('/open/account/MQTT/quota', '{"params": {"2_1.watts": 1000, "2_1.volt": 230}}')
+
+    def test_failed_write_requeues_samples(self):
+        with mock.patch('smartPlug_devices.mqtt.write_smart_plug_data', side_effect=OperationalError("database is locked")):
+            with self.assertRaises(OperationalError):
+                self.stream.flush(force=True)
+        self.assertIn('MQTT', self.stream.pending)
+        self.assertEqual(self.stream.flush(force=True), 1)
+        self.assertEqual(SmartPlugData.objects.filter(device__sn='MQTT').count(), 1)
+
+    @override_settings(SQLITE_WRITER_QUEUE=True, SQLITE_WRITER_RETRIES=0)
+    def test_writer_queue_failure_requeues_samples(self):
+        with mock.patch.object(TelemetryWriter, '_write', side_effect=OperationalError("database is locked")):
+            self.assertEqual(self.stream.flush(force=True), 1)
+            get_writer().flush()
+        self.assertIn('MQTT', self.stream.pending)
+        self.assertEqual(self.stream.written, 0)
+
+
+@override_settings(SQLITE_WRITER_RETRIES=2, SQLITE_WRITER_RETRY_SECONDS=0.01)
+class TelemetryWriterTests(TestCase):
+    def setUp(self):
+        self.writer = TelemetryWriter(flush_seconds=0.01)
+        self.failed = []
+
+    def test_locked_batch_is_retried(self):
+        locked, written = OperationalError("database is locked"), []
+        with mock.patch.object(TelemetryWriter, '_write', side_effect=[locked, locked, None]) as write:
+            self.writer.submit(['a', 'b'], on_error=self.failed.extend, on_written=written.extend)
+            self.writer.flush()
+        self.assertEqual(write.call_count, 3)
+        self.assertEqual((self.writer.written, self.writer.failed, self.failed, written), (2, 0, [], ['a', 'b']))
+
+    def test_rows_are_reported_after_retries(self):
+        with mock.patch.object(TelemetryWriter, '_write', side_effect=OperationalError("database is locked")):
+            self.writer.submit(['a', 'b'], on_error=self.failed.extend)
+            self.writer.flush()
+        self.assertEqual((self.writer.written, self.writer.failed, self.failed), (0, 2, ['a', 'b']))
+
+
+class ShardLockTests(TestCase):
+    def test_lock_is_exclusive_and_released(self):
+        with shard_lock('sync', 0) as first:
+            with shard_lock('sync', 0) as second, shard_lock('sync', 1) as other_shard:
+                self.assertEqual((first, second, other_shard), (True, False, True))
+        self.assertFalse(SmartPlugTaskLock.objects.exists())
+
+    def test_expired_lock_is_taken_over(self):
+        SmartPlugTaskLock.objects.create(name='sync:0', token='dead', expires_at=now() - timedelta(seconds=1))
+        with shard_lock('sync', 0) as acquired:
+            self.assertTrue(acquired)
+
+
+FAKE_REDIS_CACHE = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': 'redis://fake-ratelimit:6379/0',
+        'OPTIONS': {'connection_class': fakeredis.FakeConnection if fakeredis else None},
+    }
+}
+
+
+@skipUnless(fakeredis, "needs fakeredis and lupa")
+@override_settings(CACHES=FAKE_REDIS_CACHE)
+class SharedTokenBucketTests(TestCase):
+    def test_buckets_share_one_budget_through_redis(self):
+        caches['default'].clear()
+        first = TokenBucket(key='test:shared-bucket', rate=1, capacity=3)
+        second = TokenBucket(key='test:shared-bucket', rate=1, capacity=3)
+        self.assertTrue(first.redis and second.redis)
+        self.assertEqual([first.try_acquire(), second.try_acquire(), first.try_acquire()], [0, 0, 0])
+        # The fourth token is refused to either instance: the budget is shared, not per process
+        self.assertGreater(second.try_acquire(), 0)
+        self.assertLess(first.available(), 1)
+
+
+class CopyIngestTests(TestCase):
+    def test_copy_rows_use_postgres_text_encoding(self):
+        plug = SmartPlug.objects.create(sn='COPY', name='copy')
+        row = SmartPlugData(
+            device=plug, serial_number='COPY', eatTime=datetime(2025, 1, 1, 12, tzinfo=timezone(timedelta(hours=3))),
+            switchStatus=1, watts=12.5, quota_data={"note": "tab\there"},
+        )
+        with mock.patch('smartPlug_devices.ecoflow.connection') as db:
+            db.ops.quote_name = lambda name: f'"{name}"'
+            raw = db.cursor.return_value.__enter__.return_value.cursor
+            copy_smart_plug_data([row])
+        sql, buffer = raw.copy_expert.call_args.args
+        columns = sql[sql.index('(') + 1:sql.index(')')].replace('"', '').split(', ')
+        values = dict(zip(columns, buffer.getvalue().rstrip('\n').split('\t')))
+
+        self.assertEqual(values['device_id'], str(plug.pk))
+        self.assertEqual(values['eatTime'], '2025-01-01T12:00:00+03:00')
+        self.assertEqual((values['is_aggregated'], values['switchStatus'], values['watts']), ('f', '1', '12.5'))
+        self.assertEqual((values['location_id'], values['timeZone']), ('\\N', '\\N'))
+        # JSON's own escape for the tab, with the backslash doubled for COPY
+        self.assertEqual(values['quota_data'], '{"note": "tab\\\\there"}')
+        self.assertNotEqual(values['fetched_at'], '\\N')
+
+
+def add_aggregates(plug, start, count, watts=120.0, lifetime=0.0):
+    """Store `count` consecutive 5-minute aggregates from `start`; returns the lifetime energy after them."""
+    rows = []
+    for index in range(count):
+        lifetime += watts / 12
+        rows.append(SmartPlugDataAggregate(
+            device=plug, serial_number=plug.sn, interval_seconds=300, metered_at=start + timedelta(minutes=5 * index),
+            power_w=watts, energy_interval_wh=watts / 12, energy_lifetime_wh=lifetime,
+        ))
+    SmartPlugDataAggregate.objects.bulk_create(rows)
+    return lifetime
+
+
+@override_settings(SMARTPLUG_ROLLUP_TIME_ZONE='UTC')
+class RollupCascadeTests(TestCase):
+    def setUp(self):
+        self.plug = SmartPlug.objects.create(sn='ROLLUP', name='rollup')
+        self.start = datetime(2025, 1, 31, 22, tzinfo=timezone.utc)
+        # 120 W (10 Wh per 5 minutes) for 28 hours, across a day and a month boundary
+        self.lifetime = add_aggregates(self.plug, self.start, 28 * 12)
+
+    def rollups(self, period):
+        return {
+            rollup.period_start.replace(tzinfo=timezone.utc): (rollup.energy_wh, rollup.intervals)
+            for rollup in SmartPlugDataRollup.objects.filter(device=self.plug, period=period)
+        }
+
+    def test_cascade_builds_hours_days_and_months(self):
+        rollup_smart_plug_data()
+        hours = self.rollups(SmartPlugDataRollup.HOUR)
+        self.assertEqual(len(hours), 28)
+        self.assertEqual(set(hours.values()), {(120.0, 12)})
+        self.assertEqual(self.rollups(SmartPlugDataRollup.DAY), {
+            datetime(2025, 1, 31, tzinfo=timezone.utc): (240.0, 24),
+            datetime(2025, 2, 1, tzinfo=timezone.utc): (2880.0, 288),
+            datetime(2025, 2, 2, tzinfo=timezone.utc): (240.0, 24),
+        })
+        self.assertEqual(self.rollups(SmartPlugDataRollup.MONTH), {
+            datetime(2025, 1, 1, tzinfo=timezone.utc): (240.0, 24),
+            datetime(2025, 2, 1, tzinfo=timezone.utc): (3120.0, 312),
+        })
+        february = SmartPlugDataRollup.objects.get(device=self.plug, period=SmartPlugDataRollup.MONTH,
+                                                   period_start=datetime(2025, 2, 1, tzinfo=timezone.utc))
+        self.assertAlmostEqual(february.energy_lifetime_wh, self.lifetime, places=2)
+
+    def test_rerun_extends_open_periods_in_place(self):
+        rollup_smart_plug_data()
+        add_aggregates(self.plug, datetime(2025, 2, 2, 2, tzinfo=timezone.utc), 12, lifetime=self.lifetime)
+        rollup_smart_plug_data()
+        self.assertEqual(self.rollups(SmartPlugDataRollup.DAY)[datetime(2025, 2, 2, tzinfo=timezone.utc)], (360.0, 36))
+        self.assertEqual(self.rollups(SmartPlugDataRollup.MONTH)[datetime(2025, 2, 1, tzinfo=timezone.utc)], (3240.0, 324))
+        self.assertEqual(SmartPlugDataRollup.objects.filter(device=self.plug).count(), 29 + 3 + 2)
+
+    def test_energy_between_mixes_resolutions(self):
+        # One 240 W interval in the 5-minute edge before midnight
+        SmartPlugDataAggregate.objects.filter(metered_at=datetime(2025, 1, 31, 23, 40, tzinfo=timezone.utc)).update(
+            power_w=240.0, energy_interval_wh=20.0)
+        rollup_smart_plug_data()
+        start = datetime(2025, 1, 31, 23, 30, tzinfo=timezone.utc)
+        end = datetime(2025, 2, 2, 1, 10, tzinfo=timezone.utc)
+        midnight, next_midnight = datetime(2025, 2, 1, tzinfo=timezone.utc), datetime(2025, 2, 2, tzinfo=timezone.utc)
+        self.assertEqual([period for period, _, _ in split_range(start, end)], [None, 'day', 'hour', None])
+        self.assertEqual(split_range(start, end)[1:3], [
+            ('day', midnight, next_midnight), ('hour', next_midnight, next_midnight + timedelta(hours=1)),
+        ])
+
+        stats = energy_between(start, end)[self.plug.id]
+        in_range = SmartPlugDataAggregate.objects.filter(device=self.plug, metered_at__gte=start, metered_at__lt=end)
+        self.assertAlmostEqual(stats['energy_wh'], sum(row.energy_interval_wh for row in in_range), places=2)
+        self.assertEqual((stats['power_min_w'], stats['power_max_w']), (120.0, 240.0))
+        self.assertAlmostEqual(stats['power_mean_w'], sum(row.power_w for row in in_range) / len(in_range), places=2)
+        self.assertAlmostEqual(stats['energy_lifetime_wh'], in_range.order_by('metered_at').last().energy_lifetime_wh,
+                               places=2)
+
+    def test_aggregate_history_downsamples_from_monthly_rollups(self):
+        rollup_smart_plug_data()
+        response = self.client.get(
+            '/api/aggregates?device=ROLLUP&points=3&method=mean&fields=power_w,energy_interval_wh'
+            '&start=2024-11-01&end=2025-03-01'
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['resolution'], 'month')
+
+
+class QuotaFanOutTests(TestCase):
+    def fake_quota(self, sn):
+        if sn == 'SLOW':
+            time.sleep(0.05)  # finishes last, yet keeps its place in the results
+            return {"code": "0", "data": {"2_1.watts": 5}}
+        if sn == 'BROKEN':
+            raise ConnectionError("connection reset")
+        if sn == 'THROTTLED':
+            raise RateLimitTimeout("EcoFlow rate limit: no token within 10s")
+        if sn == 'REJECTED':
+            return {"code": "1006", "message": "device offline"}
+        return {"code": "0", "data": {"2_1.watts": 7}}
+
+    def test_results_keep_order_and_isolate_failures(self):
+        devices = [{"sn": sn} for sn in ['SLOW', 'BROKEN', 'THROTTLED', 'REJECTED', 'OK']] + [{"deviceName": "no sn"}]
+        with mock.patch('smartPlug_devices.ecoflow.get_device_quota', side_effect=self.fake_quota) as quota:
+            results = get_ecoflow_devices_all(max_workers=4, devices=devices)
+        self.assertEqual(quota.call_count, 5)
+        self.assertEqual([device["sn"] for device in results], ['SLOW', 'BROKEN', 'THROTTLED', 'REJECTED', 'OK', None])
+        by_sn = {device["sn"]: device for device in results}
+        self.assertEqual((by_sn['SLOW']["quota"], by_sn['OK']["quota"]), ({"2_1.watts": 5}, {"2_1.watts": 7}))
+        self.assertEqual(by_sn['BROKEN']["quota_error"], "connection reset")
+        self.assertEqual(by_sn['REJECTED']["quota_error"], "API Error: device offline (Code: 1006)")
+        self.assertTrue(by_sn['THROTTLED']["quota_deferred"])
+        self.assertNotIn("quota_deferred", by_sn['BROKEN'])
+        self.assertEqual(by_sn[None]["quota"], {})
+
+
+class EcoFlowClientTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.api = EcoFlowClient(access_key='ak', secret_key='sk', base_url='https://api.example.test')
+
+    def test_nested_params_are_flattened_for_signing(self):
+        body = {"sn": "X", "params": {"quotas": ["2_1.watts", "2_1.volt"], "cmd": {"on": 1}}}
+        self.assertEqual(flatten_params(body), {
+            "sn": "X", "params.quotas[0]": "2_1.watts", "params.quotas[1]": "2_1.volt", "params.cmd.on": 1,
+        })
+        expected = hmac.new(
+            b'sk', b"params.cmd.on=1&params.quotas[0]=2_1.watts&params.quotas[1]=2_1.volt&sn=X"
+                   b"&accessKey=ak&nonce=000042&timestamp=1700000000000", hashlib.sha256,
+        ).hexdigest()
+        self.assertEqual(generate_signature(body, 1700000000000, "000042", 'ak', 'sk'), expected)
+
+    def test_requests_are_signed_on_one_session(self):
+        response = mock.Mock(status_code=200, json=lambda: {"code": "0"})
+        with mock.patch.object(self.api.session, 'request', return_value=response) as request:
+            self.api.get("/iot-open/sign/device/quota/all", {"sn": "X"})
+            self.api.get("/iot-open/sign/device/list")
+        self.assertEqual(request.call_count, 2)
+        headers = request.call_args_list[0].kwargs['headers']
+        self.assertEqual(headers['sign'], generate_signature(
+            {"sn": "X"}, int(headers['timestamp']), headers['nonce'], 'ak', 'sk'))
+        with mock.patch.object(ecoflow, '_client', None):
+            self.assertIs(get_client(), get_client())
+            self.assertIs(get_client().session, get_client().session)
+
+    def test_retries_are_limited_to_get(self):
+        retry = self.api.session.get_adapter('https://api.example.test/iot-open/sign/device/list').max_retries
+        self.assertEqual(set(retry.allowed_methods), {"GET"})
+        self.assertEqual(set(retry.status_forcelist), {429, 500, 502, 503, 504})
+
+
+class SyncCycleTests(TestCase):
+    def setUp(self):
+        SmartPlug.objects.bulk_create([SmartPlug(sn='KNOWN-1', name='one'), SmartPlug(sn='KNOWN-2', name='two')])
+        self.devices = [
+            {"sn": "KNOWN-1", "quota": {"2_1.watts": 1200, "2_1.volt": 230, "2_1.utcTime": 1700000000},
+             "quota_error": None},
+            {"sn": "KNOWN-2", "quota": {}, "quota_error": "API Error: device offline (Code: 1006)"},
+        ]
+
+    def test_one_lookup_and_one_write_per_cycle(self):
+        with mock.patch.object(SmartPlug.objects, 'in_bulk', wraps=SmartPlug.objects.in_bulk) as in_bulk, \
+                mock.patch.object(SmartPlugData.objects, 'bulk_create', wraps=SmartPlugData.objects.bulk_create) as bulk:
+            sync_smart_plug_data(devices=self.devices)
+        self.assertEqual((in_bulk.call_count, bulk.call_count), (1, 1))
+        self.assertEqual(len(bulk.call_args.args[0]), 2)
+
+    def test_failed_quota_stores_null_row(self):
+        sync_smart_plug_data(devices=self.devices)
+        self.assertEqual(SmartPlugData.objects.get(device__sn='KNOWN-1').watts, 120.0)
+        failed = SmartPlugData.objects.get(device__sn='KNOWN-2')
+        self.assertEqual((failed.watts, failed.volt, failed.eatTime), (None, None, None))
+
+    def test_unknown_sn_refreshes_registry_then_is_skipped(self):
+        ghost = {"sn": "GHOST", "quota": {"2_1.watts": 10}, "quota_error": None}
+        with mock.patch('smartPlug_devices.ecoflow.get_cached_devices', return_value=[]) as refresh:
+            rows = sync_smart_plug_data(devices=self.devices + [ghost])
+        refresh.assert_called_once_with(force_refresh=True)
+        self.assertEqual(len(rows), 2)
+        self.assertFalse(SmartPlugData.objects.filter(serial_number='GHOST').exists())
+
+
+class RegistrySyncTests(TestCase):
+    def listed(self, sn, name):
+        return {"sn": sn, "name": name, "model": "Smart Plug", "status": "ok",
+                "full_info": {"sn": sn, "online": 1, "productName": "Smart Plug"}}
+
+    def test_only_changed_plugs_are_upserted(self):
+        self.assertEqual(sync_smart_plugs([self.listed('REG-1', 'one'), self.listed('REG-2', 'two')]), 2)
+        earlier = now() - timedelta(days=1)
+        SmartPlug.objects.update(last_updated=earlier)
+
+        self.assertEqual(sync_smart_plugs([self.listed('REG-1', 'one'), self.listed('REG-2', 'two')]), 0)
+        self.assertEqual(set(SmartPlug.objects.values_list('last_updated', flat=True)), {earlier})
+
+        self.assertEqual(sync_smart_plugs([self.listed('REG-1', 'one'), self.listed('REG-2', 'renamed')]), 1)
+        plugs = SmartPlug.objects.in_bulk(field_name='sn')
+        self.assertEqual((plugs['REG-2'].name, plugs['REG-2'].online), ('renamed', True))
+        self.assertGreater(plugs['REG-2'].last_updated, earlier)
+        self.assertEqual(plugs['REG-1'].last_updated, earlier)
+        self.assertEqual(len(plugs), 2)
+
+
+class AggregateUpsertTests(TestCase):
+    def test_rerun_updates_the_existing_interval(self):
+        plug = SmartPlug.objects.create(sn='UPSERT', name='upsert')
+        metered_at = closed_bin_start()
+
+        def aggregate(watts):
+            return SmartPlugDataAggregate(device=plug, serial_number='UPSERT', metered_at=metered_at,
+                                          interval_seconds=300, power_w=watts, energy_interval_wh=watts / 12)
+
+        save_aggregates([aggregate(120.0)])
+        first_id = SmartPlugDataAggregate.objects.get().id
+        save_aggregates([aggregate(240.0)])
+        updated = SmartPlugDataAggregate.objects.get()
+        self.assertEqual((updated.id, updated.power_w, updated.energy_interval_wh), (first_id, 240.0, 20.0))
+
+
+class AggregateDedupeMigrationTests(TransactionTestCase):
+    before = [('smartPlug_devices', '0013_smartplugdataaggregate_is_pushed')]
+    after = [('smartPlug_devices', '0014_smartplugdataaggregate_unique_interval')]
+
+    def migrate(self, targets):
+        executor = MigrationExecutor(connection)
+        executor.migrate(targets or executor.loader.graph.leaf_nodes())
+        return executor.loader.project_state(targets).apps if targets else None
+
+    def test_duplicates_are_collapsed_to_the_newest_row(self):
+        apps = self.migrate(self.before)
+        try:
+            Plug = apps.get_model('smartPlug_devices', 'SmartPlug')
+            Aggregate = apps.get_model('smartPlug_devices', 'SmartPlugDataAggregate')
+            plug = Plug.objects.create(sn='DEDUPE', name='dedupe')
+            metered_at = closed_bin_start()
+            ids = [
+                Aggregate.objects.create(device=plug, serial_number='DEDUPE', metered_at=metered_at + offset,
+                                         interval_seconds=300, power_w=watts).id
+                for offset, watts in [(timedelta(0), 100.0), (timedelta(0), 200.0), (timedelta(minutes=5), 300.0)]
+            ]
+            Aggregate = self.migrate(self.after).get_model('smartPlug_devices', 'SmartPlugDataAggregate')
+            self.assertEqual(sorted(Aggregate.objects.values_list('id', 'power_w')), [(ids[1], 200.0), (ids[2], 300.0)])
+        finally:
+            self.migrate(None)
+
+
+@override_settings(SMARTPLUG_RAW_RETENTION_HOURS=2)
+class RetentionTests(TestCase):
+    def setUp(self):
+        self.plug = SmartPlug.objects.create(sn='RETAIN', name='retain')
+        old, recent = closed_bin_start(hours_ago=5), closed_bin_start(hours_ago=1)
+        add_samples(self.plug, old, [(offset, 100.0) for offset in range(0, 50, 10)])
+        add_samples(self.plug, recent, [(0, 100.0)])
+        SmartPlugData.objects.update(is_aggregated=True)
+        add_samples(self.plug, old, [(60, 100.0)])  # expired but not aggregated yet
+
+    def test_expired_aggregated_rows_are_deleted_in_batches(self):
+        with mock.patch.object(SmartPlugData.objects, 'filter', wraps=SmartPlugData.objects.filter) as batches:
+            deleted = delete_expired_rows(now() - timedelta(hours=2), batch_size=2)
+        self.assertEqual(deleted, 5)
+        # Three id-batched deletes of at most 2 rows each
+        self.assertEqual(len([call for call in batches.call_args_list if 'id__in' in call.kwargs]), 3)
+        self.assertEqual(SmartPlugData.objects.count(), 2)
+        self.assertEqual(SmartPlugData.objects.filter(is_aggregated=False).count(), 1)
+
+    def test_task_uses_row_deletes_on_sqlite(self):
+        delete_old_aggregated_data()
+        self.assertEqual(SmartPlugData.objects.count(), 2)
+
+
+LOCMEM_CACHE = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'view-cache-tests'}}
+
+
+@override_settings(CACHES=LOCMEM_CACHE)
+class ViewCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.calls = 0
+
+    def producer(self):
+        self.calls += 1
+        return f"fetch {self.calls}"
+
+    def wait_for(self, key, data):
+        deadline = time.monotonic() + 2
+        while cache.get(key)["data"] != data and time.monotonic() < deadline:
+            time.sleep(0.01)
+        return cache.get(key)["data"]
+
+    def test_fresh_entry_is_served_from_cache(self):
+        self.assertEqual([cached('test:fresh', self.producer, ttl=60) for _ in range(3)], ["fetch 1"] * 3)
+        self.assertEqual(self.calls, 1)
+
+    def test_stale_entry_is_served_while_one_refresh_runs(self):
+        cache.set('test:stale', {"data": "old", "cached_at": time.time() - 120}, 600)
+        self.assertEqual(cached('test:stale', self.producer, ttl=60, stale_ttl=300), "old")
+        self.assertEqual(self.wait_for('test:stale', "fetch 1"), "fetch 1")
+        self.assertEqual(cached('test:stale', self.producer, ttl=60), "fetch 1")
+        self.assertIsNone(cache.get('test:stale' + LOCK_SUFFIX))
+
+    def test_stale_entry_with_refresh_in_flight_starts_no_other(self):
+        cache.set('test:busy', {"data": "old", "cached_at": time.time() - 120}, 600)
+        cache.add('test:busy' + LOCK_SUFFIX, 1, 60)
+        self.assertEqual(cached('test:busy', self.producer, ttl=60), "old")
+        time.sleep(0.05)
+        self.assertEqual(self.calls, 0)
+
+    def test_miss_waits_for_the_concurrent_fetch(self):
+        cache.add('test:miss' + LOCK_SUFFIX, 1, 5)
+        threading.Timer(0.2, cache.set, args=('test:miss', {"data": "theirs", "cached_at": time.time()}, 60)).start()
+        self.assertEqual(cached('test:miss', self.producer, wait=5), "theirs")
+        self.assertEqual(self.calls, 0)
+
+    def test_miss_fetches_itself_when_the_wait_runs_out(self):
+        cache.add('test:timeout' + LOCK_SUFFIX, 1, 5)
+        self.assertEqual(cached('test:timeout', self.producer, wait=0.2), "fetch 1")
+
+    @override_settings(SMARTPLUG_RAW_STORAGE='compact')
+    def test_snapshot_rebuilds_quota_of_compact_rows(self):
+        plug = SmartPlug.objects.create(sn='SNAP', name='snapshot')
+        location = SmartPlugLocation.objects.create(country='KE', town='Nairobi', timeZone='Africa/Nairobi')
+        eat_time = datetime(2025, 1, 1, 12, tzinfo=timezone.utc)
+        SmartPlugData.objects.create(device=plug, serial_number='SNAP', eatTime=eat_time, location=location,
+                                     switchStatus=1, volt=231.0, freq=50.0, current=500.0, watts=115.0)
+        response = self.client.get('/api/devices_data?source=snapshot')
+        self.assertEqual(response.status_code, 200)
+        quota = response.json()[0]["quota"]
+        self.assertEqual(quota["2_1.watts"], 1150.0)
+        self.assertEqual((quota["2_1.country"], quota["2_1.town"], quota["2_1.timeZone"]),
+                         ('KE', 'Nairobi', 'Africa/Nairobi'))
+        self.assertEqual((quota["2_1.utcTime"], quota["2_1.volt"], quota["2_1.switchSta"]),
+                         (int(eat_time.timestamp()), 231.0, 1))
+
+
+class ExportTests(TestCase):
+    def setUp(self):
+        plug = SmartPlug.objects.create(sn='EXPORT', name='export')
+        location = SmartPlugLocation.objects.create(country='KE', town='Nairobi', timeZone='Africa/Nairobi')
+        add_samples(plug, closed_bin_start(), [(offset, 100.0 + offset) for offset in range(0, 50, 10)])
+        SmartPlugData.objects.filter(watts=140.0).update(location=location)  # one compact row
+
+    def test_csv_round_trip(self):
+        body = b''.join(iter_export('raw', 'csv', ['EXPORT'], chunk_size=2)).decode()
+        header, *rows = csv.reader(io.StringIO(body))
+        exported = [dict(zip(header, row)) for row in rows]
+        stored = list(SmartPlugData.objects.order_by('id'))
+        self.assertEqual([int(row['id']) for row in exported], [sample.id for sample in stored])
+        self.assertEqual([float(row['watts']) for row in exported], [sample.watts for sample in stored])
+        self.assertEqual([datetime.fromisoformat(row['eatTime']) for row in exported],
+                         [sample.eatTime for sample in stored])
+        self.assertEqual([row['town'] for row in exported], ['', '', '', '', 'Nairobi'])
+
+    def test_parquet_without_pyarrow_is_refused(self):
+        with mock.patch.dict(sys.modules, {'pyarrow': None}):
+            self.assertEqual(self.client.get('/api/export/raw?format=parquet').status_code, 400)
+            with self.assertRaisesMessage(CommandError, "pyarrow"):
+                call_command('export_telemetry', 'raw', '--format', 'parquet')
+
+
+class SelectiveQuotaTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.api = EcoFlowClient(access_key='ak', secret_key='sk', base_url='https://api.example.test')
+        response = mock.Mock(status_code=200, json=lambda: {"code": "0", "data": {}})
+        self.request = mock.patch.object(self.api.session, 'request', return_value=response).start()
+        mock.patch('smartPlug_devices.ecoflow.get_client', return_value=self.api).start()
+        self.addCleanup(mock.patch.stopall)
+
+    @override_settings(ECOFLOW_SELECTIVE_QUOTA=True)
+    def test_selective_quota_posts_the_stored_keys(self):
+        get_device_quota('X')
+        method, url = self.request.call_args.args
+        body, headers = self.request.call_args.kwargs['json'], self.request.call_args.kwargs['headers']
+        self.assertEqual((method, url), ("POST", "https://api.example.test" + SELECTIVE_QUOTA_PATH))
+        self.assertEqual(body, {"sn": "X", "params": {"quotas": QUOTA_KEYS}})
+        self.assertEqual(headers['sign'], generate_signature(body, int(headers['timestamp']), headers['nonce'], 'ak', 'sk'))
+
+    @override_settings(ECOFLOW_SELECTIVE_QUOTA=False)
+    def test_full_quota_fallback(self):
+        get_device_quota('X')
+        self.assertEqual(self.request.call_args.args, ("GET", "https://api.example.test/iot-open/sign/device/quota/all"))
+        self.assertEqual(self.request.call_args.kwargs['params'], {"sn": "X"})
+
+    def test_only_the_selective_quota_post_is_retried(self):
+        def retried_methods(url):
+            adapter = self.api.session.get_adapter(url)
+            sent = mock.Mock(url=url)
+            with mock.patch('requests.adapters.HTTPAdapter.send', autospec=True) as send:
+                adapter.send(sent)
+            return set(send.call_args.args[0].max_retries.allowed_methods)
+
+        self.assertEqual(retried_methods("https://api.example.test" + SELECTIVE_QUOTA_PATH), {"GET", "POST"})
+        for url in ["https://api.example.test/iot-open/sign/device/list",
+                    "https://api.example.test/iot-open/sign/device/quota/all?sn=X",
+                    "https://api.example.test/iot-open/sign/device/quota-set",
+                    "https://prospect.example.test/api/v1/readings"]:
+            self.assertNotIn("POST", retried_methods(url), url)
+
+
+class SmartPlugDataAdminTests(TestCase):
+    def test_changelist_shows_location_of_compact_rows(self):
+        from django.contrib.auth.models import User
+
+        plug = SmartPlug.objects.create(sn='ADMIN', name='admin')
+        location = SmartPlugLocation.objects.create(country='Kenya', town='Kisumu', timeZone='Africa/Nairobi')
+        add_samples(plug, closed_bin_start(), [(0, 100.0), (10, 100.0)])
+        SmartPlugData.objects.update(location=location)
+        self.client.force_login(User.objects.create_superuser('admin', 'admin@example.com', 'pw'))
+        with self.assertNumQueries(6):  # no per-row location lookups
+            response = self.client.get('/admin/smartPlug_devices/smartplugdata/')
+        self.assertContains(response, 'Kisumu', count=2)
+        self.assertContains(response, 'Kenya', count=2)
+
+
+class LocationCacheTests(TestCase):
+    def setUp(self):
+        patcher = mock.patch.dict(ecoflow._location_ids, clear=True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_rolled_back_location_is_not_cached(self):
+        with self.assertRaises(OperationalError):
+            with transaction.atomic():
+                get_location_id('KE', 'Nakuru', 'Africa/Nairobi')
+                raise OperationalError("write failed")
+        self.assertEqual(ecoflow._location_ids, {})
+        self.assertFalse(SmartPlugLocation.objects.filter(town='Nakuru').exists())
+
+    def test_committed_location_is_cached(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            location_id = get_location_id('KE', 'Nakuru', 'Africa/Nairobi')
+        self.assertEqual(ecoflow._location_ids, {('KE', 'Nakuru', 'Africa/Nairobi'): location_id})
+        with self.assertNumQueries(0):
+            self.assertEqual(get_location_id('KE', 'Nakuru', 'Africa/Nairobi'), location_id)
@@ -1,7 +1,12 @@
 from django.urls import path
-from .views import get_devices, device_list
+from .views import get_devices, device_list, aggregate_history, raw_history, export_history, ecoflow_metrics, energy_report
 
 urlpatterns = [
     path('api/device_list', device_list),
     path('api/devices_data', get_devices),
+    path('api/aggregates', aggregate_history),
+    path('api/raw', raw_history),
+    path('api/energy', energy_report),
+    path('api/export/<str:kind>', export_history),
+    path('api/ecoflow/metrics', ecoflow_metrics),
 ]
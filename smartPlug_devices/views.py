@@ -1,23 +1,302 @@
+from datetime import datetime, time, timezone as dt_timezone
+import pandas as pd
+from django.conf import settings
+from django.db.models import Min
+from django.http import JsonResponse, StreamingHttpResponse
+from django.utils.dateparse import parse_date, parse_datetime
+from django.utils.timezone import is_naive, make_aware, now
+from django.views.decorators.http import require_GET
 from rest_framework.decorators import api_view
+from rest_framework.exceptions import NotFound, ValidationError
+from rest_framework.pagination import CursorPagination
 from rest_framework.response import Response
 from rest_framework import status
-from smartPlug_devices.ecoflow import get_ecoflow_devices_all, get_device_list, sync_smart_plug_data, sync_smart_plugs
+from smartPlug_devices.caching import cached
+from smartPlug_devices.downsampling import bucket_mean, lttb
+from smartPlug_devices.ecoflow import (
+    get_cached_devices, get_device_list, get_device_list_snapshot, get_ecoflow_devices_all,
+    get_ecoflow_devices_snapshot, sync_smart_plug_data, sync_smart_plugs,
+)
+from smartPlug_devices.exports import EXPORTS, EXPORT_FORMATS, iter_export, parquet_available
+from smartPlug_devices.models import SmartPlug, SmartPlugData, SmartPlugDataAggregate, SmartPlugDataRollup
+from smartPlug_devices.ratelimit import CircuitOpenError, RateLimitTimeout, get_metrics
+from smartPlug_devices.rollups import energy_between, period_for_points, period_rows
+
+VIEW_SOURCES = ('cache', 'live', 'snapshot')
+
+
+def _view_source(request):
+    source = request.query_params.get('source', settings.ECOFLOW_VIEW_SOURCE)
+    if source not in VIEW_SOURCES:
+        raise ValidationError({'source': f"Must be one of {', '.join(VIEW_SOURCES)}"})
+    return source
+
 
 @api_view(['GET'])
 def device_list(request):
+    source = _view_source(request)
     try:
-        data = get_device_list()
+        if source == 'snapshot':
+            data = get_device_list_snapshot()
+        elif source == 'live':
+            data = get_device_list()
+        else:
+            data = cached("ecoflow:view:device_list", lambda: get_device_list(get_cached_devices()))
         return Response(data, status=status.HTTP_200_OK)
+    except (CircuitOpenError, RateLimitTimeout) as e:
+        return Response({"error": str(e)}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
     except Exception as e:
         return Response({"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
     
 @api_view(['GET'])
 def get_devices(request):
+    source = _view_source(request)
     try:
-        data = get_ecoflow_devices_all()
+        if source == 'snapshot':
+            data = get_ecoflow_devices_snapshot()
+        elif source == 'live':
+            data = get_ecoflow_devices_all()
+        else:
+            data = cached(
+                "ecoflow:view:devices_data",
+                lambda: get_ecoflow_devices_all(devices=get_cached_devices()),
+            )
         return Response(data, status=status.HTTP_200_OK)
+    except (CircuitOpenError, RateLimitTimeout) as e:
+        return Response({"error": str(e)}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
     except Exception as e:
         return Response({"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
-    
 
 
+@api_view(['GET'])
+def ecoflow_metrics(request):
+    """Rate limiter and circuit breaker counters for the EcoFlow client."""
+    return Response(get_metrics(), status=status.HTTP_200_OK)
+
+
+# Stored history: /api/aggregates and /api/raw
+#
+# Query parameters:
+#   device=<sn>              one plug (required when downsampling)
+#   start, end               ISO 8601 bounds, [start, end)
+#   fields=a,b,c             columns to return (the time column is always included)
+#   page_size, cursor        keyset pagination in time order
+#   points=N&method=lttb|mean&y=<field>
+#                            downsample the series to N points instead of paginating
+
+AGGREGATE_FIELDS = [
+    'id', 'serial_number', 'metered_at', 'interval_seconds', 'country', 'town', 'switchStatus',
+    'voltage_v', 'current_a', 'frequency_hz', 'power_w', 'power_factor',
+    'energy_interval_wh', 'energy_lifetime_wh', 'is_pushed',
+]
+RAW_FIELDS = [
+    'id', 'serial_number', 'eatTime', 'fetched_at', 'switchStatus',
+    'volt', 'current', 'freq', 'watts', 'is_aggregated',
+]
+# Aggregate columns also available from the hourly/daily/monthly rollups
+ROLLUP_FIELDS = {
+    'power_w': 'power_mean_w',
+    'energy_interval_wh': 'energy_wh',
+    'energy_lifetime_wh': 'energy_lifetime_wh',
+}
+
+
+class TimeCursorPagination(CursorPagination):
+    page_size = settings.SMARTPLUG_API_PAGE_SIZE
+    page_size_query_param = 'page_size'
+    max_page_size = settings.SMARTPLUG_API_MAX_PAGE_SIZE
+
+
+def _parse_time(request, name):
+    raw = request.GET.get(name)
+    if not raw:
+        return None
+    try:
+        value = parse_datetime(raw) or (parse_date(raw) and datetime.combine(parse_date(raw), time.min))
+    except ValueError:  # well formed but out of range, e.g. month 13
+        value = None
+    if value is None:
+        raise ValidationError({name: f"Invalid datetime: {raw}"})
+    return make_aware(value, dt_timezone.utc) if is_naive(value) else value
+
+
+def _selected_fields(request, allowed, time_field):
+    fields = request.query_params.get('fields')
+    if not fields:
+        return allowed
+    fields = [name.strip() for name in fields.split(',') if name.strip()]
+    unknown = sorted(set(fields) - set(allowed))
+    if unknown:
+        raise ValidationError({'fields': f"Unknown fields: {', '.join(unknown)}"})
+    return [time_field] + [name for name in fields if name != time_field]
+
+
+def _filter_history(request, queryset, time_field):
+    """Apply the device and time-range filters; returns (queryset, device, start, end)."""
+    device = None
+    sn = request.query_params.get('device')
+    if sn:
+        device = SmartPlug.objects.filter(sn=sn).only('id', 'sn').first()
+        if device is None:
+            raise NotFound(f"Device {sn} not found")
+        queryset = queryset.filter(device_id=device.id)
+    start, end = _parse_time(request, 'start'), _parse_time(request, 'end')
+    if start:
+        queryset = queryset.filter(**{f'{time_field}__gte': start})
+    if end:
+        queryset = queryset.filter(**{f'{time_field}__lt': end})
+    return queryset, device, start, end
+
+
+def _rollup_source(device, fields, time_field, start, end, points):
+    """
+    Pick the coarsest rollup that still has at least `points` periods in the
+    range, so long ranges are downsampled from hourly, daily or monthly rows
+    instead of every 5-minute aggregate. Returns (resolution, rows) or None.
+    """
+    values = [name for name in fields if name != time_field]
+    if not values or any(name not in ROLLUP_FIELDS for name in values):
+        return None
+    span_start = start
+    if span_start is None:
+        rollups = SmartPlugDataRollup.objects.filter(device_id=device.id)
+        span_start = (rollups.filter(period_start__lt=end) if end else rollups).aggregate(
+            first=Min('period_start'))['first']
+    if span_start is None:
+        return None
+    period = period_for_points(span_start, end or now(), points)
+    if period is None:
+        return None
+    rows = period_rows(period, start, end, [device.id])
+    return period, rows.values_list('period_start', *[ROLLUP_FIELDS[name] for name in values])
+
+
+def _downsample(request, queryset, device, fields, time_field, default_y, start, end, resolution, rollups=False):
+    if device is None:
+        raise ValidationError({'device': "Downsampling needs a single device"})
+    try:
+        points = int(request.query_params['points'])
+    except ValueError:
+        raise ValidationError({'points': "Must be an integer"})
+    if not 3 <= points <= settings.SMARTPLUG_API_MAX_POINTS:
+        raise ValidationError({'points': f"Must be between 3 and {settings.SMARTPLUG_API_MAX_POINTS}"})
+    method = request.query_params.get('method', 'lttb')
+    if method not in ('lttb', 'mean'):
+        raise ValidationError({'method': "Must be 'lttb' or 'mean'"})
+    y = request.query_params.get('y', default_y)
+    fields = [name for name in fields if name != 'id']
+    if y not in fields:
+        raise ValidationError({'y': f"{y} is not among the selected fields"})
+
+    source = _rollup_source(device, fields, time_field, start, end, points) if rollups else None
+    if source is not None:
+        resolution, rows = source
+    else:
+        rows = queryset.order_by(time_field).values_list(*fields)
+    df = pd.DataFrame.from_records(rows.iterator(chunk_size=settings.SMARTPLUG_AGGREGATE_CHUNK_SIZE), columns=fields)
+
+    if method == 'lttb':
+        df = df.dropna(subset=[time_field, y]).reset_index(drop=True)
+        try:
+            values = pd.to_numeric(df[y])
+        except (ValueError, TypeError):
+            raise ValidationError({'y': f"{y} is not a numeric field"})
+        x = pd.to_datetime(df[time_field], utc=True).astype('int64')
+        df = df.iloc[lttb(x, values, points)]
+    else:
+        df = bucket_mean(df.dropna(subset=[time_field]), time_field, points, start, end)
+
+    df = df.round(2)
+    results = df.astype(object).where(df.notna(), None).to_dict('records')
+    return Response({
+        "device": device.sn,
+        "method": method,
+        "resolution": resolution,
+        "count": len(results),
+        "results": results,
+    }, status=status.HTTP_200_OK)
+
+
+def _history(request, queryset, allowed, time_field, default_y, resolution, rollups=False):
+    fields = _selected_fields(request, allowed, time_field)
+    queryset, device, start, end = _filter_history(request, queryset, time_field)
+    if 'points' in request.query_params:
+        return _downsample(request, queryset, device, fields, time_field, default_y, start, end, resolution, rollups)
+
+    # Rows without a timestamp (failed quota calls) cannot carry a cursor position
+    paginator = TimeCursorPagination()
+    paginator.ordering = (time_field, 'id')
+    queryset = queryset.filter(**{f'{time_field}__isnull': False})
+    page = paginator.paginate_queryset(queryset.values(*fields), request)
+    return paginator.get_paginated_response(page)
+
+
+@api_view(['GET'])
+def aggregate_history(request):
+    try:
+        interval_seconds = int(request.query_params.get('interval', 300))
+    except ValueError:
+        raise ValidationError({'interval': "Must be an integer number of seconds"})
+    queryset = SmartPlugDataAggregate.objects.filter(interval_seconds=interval_seconds)
+    return _history(request, queryset, AGGREGATE_FIELDS, 'metered_at', 'power_w',
+                    resolution=f"{interval_seconds}s", rollups=interval_seconds == 300)
+
+
+@api_view(['GET'])
+def raw_history(request):
+    return _history(request, SmartPlugData.objects.all(), RAW_FIELDS, 'eatTime', 'watts', resolution='raw')
+
+
+@api_view(['GET'])
+def energy_report(request):
+    """
+    /api/energy?start=&end=&device=sn1,sn2: energy and power statistics per plug
+    over [start, end), read from the coarsest rollups that fit the range.
+    """
+    start, end = _parse_time(request, 'start'), _parse_time(request, 'end')
+    if start is None or end is None or start >= end:
+        raise ValidationError({'end': "start and end are required, with start before end"})
+    plugs = SmartPlug.objects.all()
+    devices = request.query_params.get('device')
+    if devices:
+        sns = {sn.strip() for sn in devices.split(',') if sn.strip()}
+        plugs = plugs.filter(sn__in=sns)
+        missing = sns - set(plugs.values_list('sn', flat=True))
+        if missing:
+            raise NotFound(f"Devices not found: {', '.join(sorted(missing))}")
+    sns = dict(plugs.values_list('id', 'sn'))
+    stats = energy_between(start, end, list(sns) if devices else None)
+    return Response({
+        "start": start,
+        "end": end,
+        "devices": {sns[device_id]: values for device_id, values in stats.items() if device_id in sns},
+    }, status=status.HTTP_200_OK)
+
+
+@require_GET
+def export_history(request, kind):
+    """
+    Stream /api/export/<raw|aggregates>?format=csv|parquet&device=sn1,sn2&start=&end=
+    without building the dataset in memory. A plain Django view, since DRF would
+    treat ?format= as a renderer override.
+    """
+    if kind not in EXPORTS:
+        return JsonResponse({"error": f"Unknown export {kind}"}, status=status.HTTP_404_NOT_FOUND)
+    export_format = request.GET.get('format', 'csv')
+    if export_format not in EXPORT_FORMATS:
+        return JsonResponse({"format": f"Must be one of {', '.join(EXPORT_FORMATS)}"}, status=status.HTTP_400_BAD_REQUEST)
+    if export_format == 'parquet' and not parquet_available():
+        return JsonResponse({"format": "Parquet export needs the pyarrow package"}, status=status.HTTP_400_BAD_REQUEST)
+    devices = request.GET.get('device')
+    device_sns = [sn.strip() for sn in devices.split(',') if sn.strip()] if devices else None
+    try:
+        start, end = _parse_time(request, 'start'), _parse_time(request, 'end')
+    except ValidationError as e:
+        return JsonResponse(e.detail, status=status.HTTP_400_BAD_REQUEST)
+
+    response = StreamingHttpResponse(
+        iter_export(kind, export_format, device_sns, start, end),
+        content_type=EXPORT_FORMATS[export_format],
+    )
+    response['Content-Disposition'] = f'attachment; filename="smartplug_{kind}.{export_format}"'
+    return response